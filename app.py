@@ -1,10 +1,15 @@
 # app.py
 import streamlit as st
 import os
+import sqlite3
 from utils.document_processor import DocumentProcessor
+from utils.index_registry import get_index_registry
+from utils.metrics import get_metrics
 from utils.form_handler import FormHandler
 from utils.chatbot import ChatBot
 from utils.date_extractor import DateExtractor
+from utils.session_state import (SessionSnapshot, SessionConflict, get_session_store, new_tab_id, valid_tab_id,
+                                 SESSION_COOKIE, TAB_PARAM)
 
 # Page configuration
 st.set_page_config(
@@ -89,14 +94,39 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+# Name of a published knowledge base that every session attaches to read-only
+SHARED_INDEX_NAME = os.environ.get("SHARED_INDEX_NAME")
+# Log the agent's reasoning steps, which include user messages, to the server console
+AGENT_VERBOSE = os.environ.get("AGENT_VERBOSE") == "1"
+
 def initialize_session_state():
     """Initialize session state variables"""
     if 'api_key' not in st.session_state:
         st.session_state.api_key = ""
     if 'chatbot' not in st.session_state:
         st.session_state.chatbot = None
+    if 'session_id' not in st.session_state:
+        # server.py gives each browser a signed HttpOnly cookie, and each tab carries its own id in
+        # the URL: a reload resumes the tab, and a shared link is useless without the cookie
+        store = get_session_store()
+        browser_id = store.browser_id(st.context.cookies.get(SESSION_COOKIE))
+        if browser_id is None:
+            st.error("This page has no session cookie. Start the app with `streamlit run server.py`.")
+            st.stop()
+        tab_id = st.query_params.get(TAB_PARAM)
+        if not valid_tab_id(tab_id):
+            tab_id = st.query_params[TAB_PARAM] = new_tab_id()
+        # Links from earlier versions carried a session id; it is no longer honoured
+        if "sid" in st.query_params:
+            del st.query_params["sid"]
+        st.session_state.browser_id = browser_id
+        st.session_state.session_id = store.session_key(browser_id, tab_id)
+        # Only loaded when this process does not already hold the session
+        st.session_state.restored = store.load(st.session_state.session_id)
+        st.session_state.session_revision = st.session_state.restored.revision if st.session_state.restored else 0
     if 'messages' not in st.session_state:
-        st.session_state.messages = []
+        restored = st.session_state.restored
+        st.session_state.messages = restored.messages if restored else []
     if 'documents_processed' not in st.session_state:
         st.session_state.documents_processed = False
     if 'document_processor' not in st.session_state:
@@ -104,6 +134,29 @@ def initialize_session_state():
     if 'form_handler' not in st.session_state:
         st.session_state.form_handler = None
 
+def attach_shared_knowledge_base():
+    """Attach a new session to the shared knowledge base, if one is published"""
+    if not SHARED_INDEX_NAME or st.session_state.document_processor or not st.session_state.api_key:
+        return
+
+    registry = get_index_registry()
+    if registry.current_version(SHARED_INDEX_NAME) is None:
+        return
+
+    try:
+        doc_processor = DocumentProcessor(st.session_state.api_key)
+        doc_processor.attach_shared(registry, SHARED_INDEX_NAME)
+        use_document_processor(doc_processor)
+    except Exception as e:
+        st.error(f"Error loading shared knowledge base: {str(e)}")
+
+def use_document_processor(doc_processor):
+    """Make doc_processor this session's knowledge base, keeping the conversation"""
+    st.session_state.document_processor = doc_processor
+    st.session_state.documents_processed = True
+    if st.session_state.chatbot:
+        st.session_state.chatbot.set_document_processor(doc_processor)
+
 def setup_sidebar():
     """Setup the sidebar with configuration options"""
     with st.sidebar:
@@ -117,6 +170,7 @@ def setup_sidebar():
             except:
                 st.session_state.api_key = "your-fallback-api-key"
         
+        attach_shared_knowledge_base()
         
         
         # Document upload section
@@ -131,23 +185,47 @@ def setup_sidebar():
         if uploaded_files and st.session_state.api_key:
             if st.button("Process Documents", type="primary"):
                 with st.spinner("Processing documents..."):
+                    progress_bar = st.progress(0.0)
+
+                    def show_progress(stats):
+                        progress_bar.progress(
+                            stats['files_done'] / max(stats['files_total'], 1),
+                            text=f"{stats['pages']} pages, {stats['chunks']} chunks "
+                                 f"({stats['pages_per_sec']:.1f} pages/s, {stats['chunks_per_sec']:.1f} chunks/s)"
+                        )
+
                     try:
-                        # Initialize document processor
-                        doc_processor = DocumentProcessor(st.session_state.api_key)
-                        
-                        # Load and process documents
-                        documents = doc_processor.load_documents(uploaded_files)
-                        vector_store = doc_processor.create_vector_store(documents)
-                        
-                        if vector_store:
-                            st.session_state.document_processor = doc_processor
-                            st.session_state.documents_processed = True
-                            st.session_state.chatbot = None  # Reset chatbot to include new documents
-                            st.success(f"Successfully processed {len(uploaded_files)} documents!")
+                        doc_processor = st.session_state.document_processor
+
+                        if doc_processor and doc_processor.vector_store and not doc_processor.shared_index:
+                            # Only embed new/changed files and drop the ones no longer uploaded
+                            added, removed = doc_processor.sync_files(uploaded_files, show_progress)
+                            st.success(f"Index updated: {len(added)} added, {len(removed)} removed.")
                         else:
-                            st.error("Failed to process documents.")
+                            # Initialize document processor
+                            doc_processor = DocumentProcessor(st.session_state.api_key)
+
+                            # Stream documents page by page into the index
+                            doc_processor.ingest_files(uploaded_files, show_progress)
+
+                            if doc_processor.vector_store:
+                                # The chatbot switches retrievers in place and keeps the conversation
+                                use_document_processor(doc_processor)
+                                st.success(f"Successfully processed {len(uploaded_files)} documents!")
+                            else:
+                                st.error("Failed to process documents.")
                     except Exception as e:
                         st.error(f"Error processing documents: {str(e)}")
+
+        # Let this session's documents become the knowledge base other sessions attach to
+        doc_processor = st.session_state.document_processor
+        if SHARED_INDEX_NAME and doc_processor and doc_processor.vector_store and not doc_processor.shared_index:
+            if st.button("📤 Publish as shared knowledge base"):
+                try:
+                    version = doc_processor.publish_shared(get_index_registry(), SHARED_INDEX_NAME)
+                    st.success(f"Published {SHARED_INDEX_NAME} version {version}.")
+                except Exception as e:
+                    st.error(f"Error publishing documents: {str(e)}")
         
         # Features section
         st.markdown("### ✨ Features")
@@ -156,7 +234,7 @@ def setup_sidebar():
         - **Appointment Booking**: Schedule calls with conversational forms
         - **Smart Date Parsing**: Understands "next Monday", "tomorrow", etc.
         - **Input Validation**: Email, phone, and date validation
-        - **Conversation Memory**: Maintains context across messages
+        - **Conversation Memory**: Recent turns verbatim, older ones summarized
         """)
         
         # Status section
@@ -166,7 +244,11 @@ def setup_sidebar():
         else:
             st.warning("⚠️ API Key required")
         
-        if st.session_state.documents_processed:
+        doc_processor = st.session_state.document_processor
+        if doc_processor and doc_processor.shared_index:
+            st.success(f"✅ Shared knowledge base: {doc_processor.shared_index.name} "
+                       f"(version {doc_processor.shared_index.version})")
+        elif st.session_state.documents_processed:
             st.success("✅ Documents processed")
         else:
             st.info("ℹ️ No documents uploaded")
@@ -178,12 +260,28 @@ def setup_sidebar():
         
         # Clear conversation button
         if st.button("🗑️ Clear Conversation"):
-            st.session_state.messages = []
+            # Cleared in place: the chatbot's memory shares this list
+            st.session_state.messages.clear()
             if st.session_state.chatbot:
                 st.session_state.chatbot.reset_conversation()
             if st.session_state.form_handler:
                 st.session_state.form_handler.reset_form()
+            save_session()
             st.rerun()
+        
+        # Where the last turn's time went, and latency percentiles across all sessions
+        if st.checkbox("🐞 Debug metrics"):
+            chatbot = st.session_state.chatbot
+            if chatbot and chatbot.last_turn_spans:
+                st.markdown("**Last turn**")
+                st.dataframe(chatbot.last_turn_spans, use_container_width=True)
+            
+            metrics = get_metrics()
+            st.markdown("**Latency by step (s)**")
+            st.dataframe([{'span': name, **values} for name, values in metrics.to_dict()['spans'].items()],
+                         use_container_width=True)
+            st.download_button("Download JSON", metrics.to_json(indent=2), file_name="metrics.json")
+            st.download_button("Download Prometheus", metrics.to_prometheus(), file_name="metrics.prom")
 
 def initialize_chatbot():
     """Initialize the chatbot with current configuration"""
@@ -200,28 +298,65 @@ def initialize_chatbot():
             st.session_state.chatbot = ChatBot(
                 api_key=st.session_state.api_key,
                 document_processor=st.session_state.document_processor,
-                form_handler=st.session_state.form_handler
+                form_handler=st.session_state.form_handler,
+                # The chatbot records turns straight into the list the chat is rendered from
+                transcript=st.session_state.messages,
+                memory_mode="summary",
+                verbose=AGENT_VERBOSE
             )
         
+        # Summary and form progress saved by an earlier request, possibly on another worker
+        if st.session_state.restored:
+            st.session_state.restored.restore(st.session_state.chatbot, st.session_state.form_handler)
+            st.session_state.restored = None
+        
         return True
     except Exception as e:
         st.error(f"Error initializing chatbot: {str(e)}")
         return False
 
-def display_message(message, is_user=True):
-    """Display a chat message"""
+def save_session():
+    """Write the conversation and form progress to the shared session store"""
+    snapshot = SessionSnapshot.capture(st.session_state.messages, st.session_state.chatbot,
+                                       st.session_state.form_handler, revision=st.session_state.session_revision)
+    store = get_session_store()
+    try:
+        try:
+            store.save(st.session_state.session_id, snapshot)
+        except SessionConflict:
+            # Another tab on the same URL (e.g. a duplicated one) saved first; rather than
+            # overwrite its conversation, this tab carries on under an id of its own
+            tab_id = st.query_params[TAB_PARAM] = new_tab_id()
+            st.session_state.session_id = store.session_key(st.session_state.browser_id, tab_id)
+            snapshot.revision = 0
+            store.save(st.session_state.session_id, snapshot)
+        st.session_state.session_revision = snapshot.revision
+    except (sqlite3.Error, SessionConflict):
+        # This process still has the state; only resuming elsewhere is affected
+        pass
+
+def message_html(message, is_user=True):
+    """HTML for a chat message"""
     if is_user:
-        st.markdown(f"""
+        return f"""
         <div class="chat-message user-message">
             <strong>You:</strong> {message}
         </div>
-        """, unsafe_allow_html=True)
-    else:
-        st.markdown(f"""
+        """
+    return f"""
         <div class="chat-message bot-message">
             <strong>🤖 Assistant:</strong> {message}
         </div>
-        """, unsafe_allow_html=True)
+        """
+
+def display_message(message, is_user=True, timing=None):
+    """Display a chat message"""
+    st.markdown(message_html(message, is_user), unsafe_allow_html=True)
+    if timing and timing.get('ttft') is not None:
+        caption = f"⏱️ first token {timing['ttft']:.2f}s · total {timing['total']:.2f}s"
+        if timing.get('prompt_tokens') is not None:
+            caption += f" · prompt ~{timing['prompt_tokens']} tokens (history {timing['history_tokens']})"
+        st.caption(caption)
 
 def main():
     """Main application function"""
@@ -252,30 +387,36 @@ def main():
     
     # Display chat history
     for message in st.session_state.messages:
-        display_message(message["content"], message["role"] == "user")
+        display_message(message["content"], message["role"] == "user", message.get("timing"))
     
     # Chat input
     if prompt := st.chat_input("Ask me anything about your documents or say 'call me' to book an appointment..."):
-        # Add user message to history
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        # The chatbot adds both sides of the turn to st.session_state.messages
         display_message(prompt, True)
         
-        # Get bot response
-        with st.spinner("Thinking..."):
-            try:
-                response = st.session_state.chatbot.get_response(prompt)
-                
-                # Add bot response to history
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                display_message(response, False)
-                
-                # Auto-scroll to bottom
-                st.rerun()
-                
-            except Exception as e:
-                error_msg = f"I encountered an error: {str(e)}"
-                st.session_state.messages.append({"role": "assistant", "content": error_msg})
-                display_message(error_msg, False)
+        # Stream the bot response into a placeholder as it is generated
+        placeholder = st.empty()
+        placeholder.markdown(message_html("▌", False), unsafe_allow_html=True)
+        try:
+            chatbot = st.session_state.chatbot
+            response = ""
+            for piece in chatbot.get_response_stream(prompt):
+                response += piece
+                placeholder.markdown(message_html(response + "▌", False), unsafe_allow_html=True)
+            
+            st.session_state.messages[-1]["timing"] = dict(chatbot.last_turn_timing)
+            placeholder.markdown(message_html(response, False), unsafe_allow_html=True)
+            save_session()
+            
+            # Auto-scroll to bottom
+            st.rerun()
+            
+        except Exception as e:
+            error_msg = f"I encountered an error: {str(e)}"
+            st.session_state.messages.append({"role": "user", "content": prompt})
+            st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            placeholder.markdown(message_html(error_msg, False), unsafe_allow_html=True)
+            save_session()
     
     # Instructions
     if not st.session_state.messages:
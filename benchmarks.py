@@ -0,0 +1,460 @@
+# benchmarks.py
+"""
+Offline micro-benchmarks for the chatbot components.
+Uses the deterministic FakeEmbeddings backend, so no API key or network is needed.
+
+Run: python benchmarks.py
+"""
+
+import re
+import json
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+import numpy as np
+from dateutil.parser import parse
+from dateutil.relativedelta import relativedelta
+from concurrent.futures import ThreadPoolExecutor
+from utils.embedding_pipeline import FakeEmbeddings, EmbeddingPipeline
+from utils.query_batcher import QueryEmbeddingBatcher, FakeQueryBackend
+from utils.date_extractor import DateExtractor
+from utils.validators import ValidatorRegistry
+from utils.appointment_store import AppointmentStore, SCHEMA
+from utils.availability import AvailabilityEngine
+from utils.session_state import SessionSnapshot, SessionStore, SQLiteSessionBackend
+from utils.form_handler import FormState
+from utils import ann_index
+
+def bench_embedding_pipeline(num_texts=2000, latency=0.05):
+    """Compare ingestion throughput across batch sizes and concurrency levels"""
+    print(f"⏱️ Embedding pipeline ({num_texts} chunks, {latency * 1000:.0f} ms simulated latency per request)")
+
+    texts = [f"chunk {i} of a long policy document about office hours and refunds" for i in range(num_texts)]
+    settings = [(16, 1), (64, 1), (64, 4), (128, 8)]
+
+    for batch_size, max_concurrency in settings:
+        embeddings = FakeEmbeddings(latency=latency)
+        pipeline = EmbeddingPipeline(embeddings, batch_size=batch_size, max_concurrency=max_concurrency)
+
+        start = time.perf_counter()
+        pipeline.embed_documents(texts)
+        elapsed = time.perf_counter() - start
+
+        print(f"  batch={batch_size:<4} concurrency={max_concurrency:<2} "
+              f"{elapsed:6.2f}s  {num_texts / elapsed:8.0f} chunks/s  ({embeddings.calls} requests)")
+    print()
+
+def bench_ann_index(num_vectors=20000, dimensions=256, num_queries=200, k=10):
+    """Compare FAISS index types on build time, query latency, recall@k and memory"""
+    print(f"⏱️ ANN index types ({num_vectors} x {dimensions} vectors, {num_queries} queries, recall@{k} vs flat)")
+
+    rng = np.random.RandomState(0)
+    # Clustered data resembles real embeddings better than uniform noise
+    centers = rng.randn(200, dimensions).astype(np.float32)
+    vectors = centers[rng.randint(0, 200, num_vectors)] + 0.3 * rng.randn(num_vectors, dimensions).astype(np.float32)
+    queries = vectors[rng.randint(0, num_vectors, num_queries)] + 0.05 * rng.randn(num_queries, dimensions).astype(np.float32)
+
+    exact = None
+    for index_type in ann_index.INDEX_TYPES:
+        start = time.perf_counter()
+        index = ann_index.build_index(vectors, index_type)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+        ann_index.tune_index(index, nprobe=16, ef_search=64)
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        query_ms = (time.perf_counter() - start) * 1000 / num_queries
+
+        if exact is None:
+            exact = found
+        recall = np.mean([len(set(found[i]) & set(exact[i])) / k for i in range(num_queries)])
+        memory_mb = ann_index.index_memory_bytes(index) / 1024 ** 2
+
+        print(f"  {index_type:<9} build {build_time:6.2f}s  query {query_ms:6.3f} ms  "
+              f"recall {recall:5.3f}  memory {memory_mb:7.1f} MB")
+    print()
+
+# Answers users gave to "When would you like to schedule the appointment?"
+DATE_PHRASES = [
+    "tomorrow", "Tomorrow please", "today if possible", "tomorrow afternoon", "day after tomorrow",
+    "next Monday", "next monday morning", "Next Friday works for me", "this Friday", "this thursday at 3",
+    "Wednesday", "on tuesday", "any time on Saturday", "coming Sunday", "next week",
+    "sometime next week", "next month", "in 3 days", "in two weeks", "in a week",
+    "5 days from now", "2024-12-25", "2025-01-07 please", "12/25/2024", "1/5/2025",
+    "03-15-2025", "January 15, 2024", "jan 15", "March 3rd", "15 March 2025",
+    "the 3rd of june", "Dec 1st, 2025", "as soon as possible", "asap", "not sure yet",
+    "whenever works", "monday or tuesday", "I'm free next Thursday after lunch", "can we do the 14th", "yesterday",
+]
+
+def bench_date_extractor(repeat=200):
+    """Compare the single-pass date grammar with the previous chain of checks"""
+    print(f"⏱️ Date extraction ({len(DATE_PHRASES)} phrasings x {repeat})")
+
+    legacy, current = LegacyDateExtractor(), DateExtractor()
+    corpus = DATE_PHRASES * repeat
+
+    for name, extract in [("legacy", lambda: [legacy.extract_date(text) for text in corpus]),
+                          ("grammar", lambda: [current.extract_date(text) for text in corpus]),
+                          ("extract_dates", lambda: current.extract_dates(corpus))]:
+        start = time.perf_counter()
+        extract()
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<14} {elapsed * 1e6 / len(corpus):8.1f} us/phrase")
+
+    legacy_results = [legacy.extract_date(text) for text in DATE_PHRASES]
+    current_results = current.extract_dates(DATE_PHRASES)
+    print(f"  resolved: legacy {sum(r is not None for r in legacy_results)}/{len(DATE_PHRASES)}, "
+          f"grammar {sum(r is not None for r in current_results)}/{len(DATE_PHRASES)}")
+    for text, old, new in zip(DATE_PHRASES, legacy_results, current_results):
+        if old != new:
+            print(f"    {text!r:<40} {old} -> {new}")
+    print()
+
+def bench_validate_records(num_records=5000, distinct=500):
+    """Bulk lead validation throughput with and without the normalization memos"""
+    print(f"⏱️ Lead validation ({num_records} records, {distinct} distinct contacts)")
+
+    rng = np.random.RandomState(0)
+    records = [
+        {'name': f"Lead {chr(65 + i % 26)}. Smith", 'phone': f"(415) 73{i % 10}-{i:04d}", 'email': f"lead{i}@example.com",
+         'appointment_date': ("tomorrow", "next Monday", "in 3 days", "this Friday")[i % 4],
+         'appointment_time': "2:30 PM"}
+        for i in rng.randint(0, distinct, num_records)
+    ]
+
+    for name, registry in [("no memo", ValidatorRegistry(cache_size=0)), ("memoized", ValidatorRegistry())]:
+        start = time.perf_counter()
+        results = registry.validate_records(records)
+        elapsed = time.perf_counter() - start
+        valid = sum(not errors for _, errors in results)
+        print(f"  {name:<9} {elapsed:6.2f}s  {num_records / elapsed:8.0f} records/s  ({valid} valid)")
+    print()
+
+def bench_appointment_store(sessions=64, bookings_per_session=20):
+    """Concurrent bookings: one commit per booking vs the store's group commits"""
+    print(f"⏱️ Appointment bookings ({sessions} sessions x {bookings_per_session} bookings)")
+
+    def booking(session, i):
+        return {'name': f"Lead {session}", 'phone': "(415) 735-0005", 'email': f"lead{session}@example.com",
+                'appointment_date': "2030-01-15", 'appointment_time': f"{9 + i % 8}:00", 'purpose': "Follow-up call"}
+
+    def run(book):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            list(pool.map(lambda session: [book(booking(session, i)) for i in range(bookings_per_session)],
+                          range(sessions)))
+        return time.perf_counter() - start
+
+    total = sessions * bookings_per_session
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/naive.db"
+        with sqlite3.connect(path) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+        def naive(appointment):
+            connection = sqlite3.connect(path, timeout=60)
+            with connection:
+                connection.execute(
+                    "INSERT INTO appointments (name, phone, email, appointment_date, appointment_time, purpose, "
+                    "created_at) VALUES (:name, :phone, :email, :appointment_date, :appointment_time, :purpose, 0)",
+                    appointment
+                )
+            connection.close()
+        elapsed = run(naive)
+        print(f"  commit each  {elapsed:6.2f}s  {total / elapsed:8.0f} bookings/s")
+
+        store = AppointmentStore(f"{tmp}/store.db")
+        elapsed = run(store.add)
+        print(f"  group commit {elapsed:6.2f}s  {total / elapsed:8.0f} bookings/s  "
+              f"({store.stats()['rows_per_transaction']:.1f} bookings per transaction)")
+
+        start = time.perf_counter()
+        for _ in range(200):
+            store.on_date("2030-01-15")
+            store.by_email("lead7@example.com")
+        print(f"  queries      {(time.perf_counter() - start) * 1000 / 400:6.2f} ms per range/email lookup")
+        store.close()
+    print()
+
+def bench_availability(num_bookings=50000, days=365, lookups=20000):
+    """Slot checks against a year of bookings: an indexed SQL count vs the in-memory slot arrays"""
+    print(f"⏱️ Availability ({num_bookings} future bookings over {days} days)")
+    rng = np.random.default_rng(0)
+    start_day = datetime.now().date() + timedelta(days=1)
+    workdays = [d for d in (start_day + timedelta(days=i) for i in range(days)) if d.weekday() < 5]
+    times = [f"{9 + i // 2:02d}:{30 * (i % 2):02d}" for i in range(16)]
+
+    def slot(i):
+        return workdays[int(rng.integers(len(workdays)))].isoformat(), times[int(rng.integers(len(times)))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AppointmentStore(f"{tmp}/store.db")
+        store.add_many([{'name': "Lead", 'appointment_date': day, 'appointment_time': t}
+                        for day, t in (slot(i) for i in range(num_bookings))])
+
+        engine = AvailabilityEngine(capacity=8)
+        start = time.perf_counter()
+        engine.load(store)
+        print(f"  load         {(time.perf_counter() - start) * 1000:8.1f} ms  {engine.stats()}")
+
+        queries = [slot(i) for i in range(lookups)]
+        connection = sqlite3.connect(f"{tmp}/store.db")
+        start = time.perf_counter()
+        for day, t in queries:
+            connection.execute("SELECT COUNT(*) FROM appointments WHERE appointment_date = ? AND sort_time = ?",
+                               (day, t)).fetchone()
+        print(f"  SQL count    {(time.perf_counter() - start) * 1e6 / lookups:8.2f} us per check")
+        connection.close()
+
+        start = time.perf_counter()
+        for day, t in queries:
+            engine.check(day, t)
+        print(f"  slot arrays  {(time.perf_counter() - start) * 1e6 / lookups:8.2f} us per check")
+
+        start = time.perf_counter()
+        for day, t in queries[:2000]:
+            engine.nearest_free(day, t, n=3)
+        print(f"  nearest 3    {(time.perf_counter() - start) * 1e6 / 2000:8.2f} us per search")
+        store.close()
+    print()
+
+def bench_session_state(turns=20, sessions=2000):
+    """Size and cost of externalized session state: encode/decode and SQLite save/load"""
+    print(f"⏱️ Session state ({turns}-turn conversations)")
+    messages = []
+    for i in range(turns):
+        messages.append({'role': "user", 'content': f"Question {i} about the uploaded contract terms?"})
+        messages.append({'role': "assistant", 'content': "According to the document, the notice period is "
+                         f"{i + 30} days and renewal is automatic unless cancelled in writing.",
+                         'timing': {'ttft': 0.41, 'total': 1.37, 'prompt_tokens': 812, 'history_tokens': 390}})
+    snapshot = SessionSnapshot(messages, "User is reviewing a services contract.", 8,
+                               FormState('collecting', 'email', ("Jane Doe", "(202) 555-0143", None, None, None, None)))
+    data = snapshot.to_bytes()
+    naive = json.dumps({'messages': messages, 'summary': snapshot.summary, 'form': snapshot.form.fields}).encode()
+    print(f"  size         {len(data):6d} bytes  (plain JSON {len(naive)} bytes)")
+
+    rounds = 1000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        SessionSnapshot.from_bytes(snapshot.to_bytes())
+    print(f"  round trip   {(time.perf_counter() - start) * 1000 / rounds:6.3f} ms per encode + decode")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(SQLiteSessionBackend(f"{tmp}/sessions.db"))
+        start = time.perf_counter()
+        for i in range(sessions):
+            store.save(f"session-{i}", snapshot)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(sessions):
+            store.load(f"session-{i}")
+        loaded = time.perf_counter() - start
+        print(f"  SQLite       {sessions / saved:6.0f} saves/s  {sessions / loaded:6.0f} loads/s")
+    print()
+
+def bench_import_time(runs=5):
+    """Cold import time of the package and its entry points, each in a fresh interpreter"""
+    print(f"⏱️ Import time (median of {runs} fresh interpreters)")
+
+    statements = [
+        "import utils",
+        "from utils.date_extractor import DateExtractor",
+        "from utils.form_handler import FormHandler",
+        "from utils.chatbot import ChatBot",
+        "from utils.document_processor import DocumentProcessor",
+    ]
+    for statement in statements:
+        script = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+        timings = sorted(
+            float(subprocess.run([sys.executable, "-W", "ignore", "-c", script],
+                                 capture_output=True, text=True, check=True).stdout)
+            for _ in range(runs)
+        )
+        print(f"  {statement:<55} {timings[runs // 2] * 1000:8.1f} ms")
+    print()
+
+def bench_query_batcher(sessions=64, queries_per_session=10, latency=0.05, max_inflight=4):
+    """Compare per-query embedding calls with cross-session micro-batching.
+
+    Both sides may have max_inflight requests to the API at once, as with a
+    shared connection pool or a per-key concurrency limit.
+    """
+    print(f"⏱️ Query embedding batching ({sessions} sessions x {queries_per_session} queries, "
+          f"{latency * 1000:.0f} ms per request, {max_inflight} requests in flight)")
+
+    queries = [[f"session {s} question {q}" for q in range(queries_per_session)] for s in range(sessions)]
+    total = sessions * queries_per_session
+
+    def run(embed_query):
+        def session(texts):
+            for text in texts:
+                embed_query(text)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            list(pool.map(session, queries))
+        return time.perf_counter() - start
+
+    embeddings = FakeEmbeddings(latency=latency)
+    inflight = threading.Semaphore(max_inflight)
+    def direct(text):
+        with inflight:
+            return embeddings.embed_query(text)
+    elapsed = run(direct)
+    print(f"  direct         {elapsed:6.2f}s  {total / elapsed:8.0f} queries/s  ({embeddings.calls} requests)")
+
+    for max_wait in (0.002, 0.005, 0.02):
+        backend = FakeQueryBackend(latency=latency)
+        batcher = QueryEmbeddingBatcher(backend, max_batch_size=32, max_wait=max_wait, max_concurrency=max_inflight)
+        elapsed = run(batcher.embed_query)
+        stats = batcher.stats()
+        print(f"  batched {max_wait * 1000:4.0f}ms {elapsed:6.2f}s  {total / elapsed:8.0f} queries/s  "
+              f"({backend.embeddings.calls} requests, mean batch {stats['mean_batch_size']:.1f})")
+    print()
+
+# DateExtractor.extract_date as it was before the precompiled grammar, kept as the baseline
+class LegacyDateExtractor:
+    def __init__(self):
+        self.today = datetime.now().date()
+        
+    def extract_date(self, text):
+        """Extract date from natural language text"""
+        text = text.lower().strip()
+        
+        # Handle relative dates
+        if 'today' in text:
+            return self.today.strftime('%Y-%m-%d')
+        elif 'tomorrow' in text:
+            return (self.today + timedelta(days=1)).strftime('%Y-%m-%d')
+        elif 'yesterday' in text:
+            return (self.today - timedelta(days=1)).strftime('%Y-%m-%d')
+        
+        # Handle "next" dates
+        if 'next' in text:
+            return self._handle_next_dates(text)
+        
+        # Handle "this" dates
+        if 'this' in text:
+            return self._handle_this_dates(text)
+        
+        # Handle specific weekdays
+        weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+        for i, day in enumerate(weekdays):
+            if day in text:
+                return self._get_next_weekday(i)
+        
+        # Try to parse absolute dates
+        try:
+            # Look for date patterns
+            date_patterns = [
+                r'\d{4}-\d{2}-\d{2}',  # YYYY-MM-DD
+                r'\d{2}/\d{2}/\d{4}',  # MM/DD/YYYY
+                r'\d{2}-\d{2}-\d{4}',  # MM-DD-YYYY
+                r'\d{1,2}/\d{1,2}/\d{4}',  # M/D/YYYY
+            ]
+            
+            for pattern in date_patterns:
+                matches = re.findall(pattern, text)
+                if matches:
+                    try:
+                        parsed_date = parse(matches[0])
+                        return parsed_date.strftime('%Y-%m-%d')
+                    except:
+                        continue
+            
+            # Try general parsing
+            parsed_date = parse(text, fuzzy=True)
+            return parsed_date.strftime('%Y-%m-%d')
+            
+        except:
+            return None
+    
+    def _handle_next_dates(self, text):
+        """Handle 'next' relative dates"""
+        if 'next week' in text:
+            return (self.today + timedelta(weeks=1)).strftime('%Y-%m-%d')
+        elif 'next month' in text:
+            return (self.today + relativedelta(months=1)).strftime('%Y-%m-%d')
+        elif 'next year' in text:
+            return (self.today + relativedelta(years=1)).strftime('%Y-%m-%d')
+        
+        # Handle next specific weekday
+        weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+        for i, day in enumerate(weekdays):
+            if f'next {day}' in text:
+                return self._get_next_weekday(i, next_week=True)
+        
+        return None
+    
+    def _handle_this_dates(self, text):
+        """Handle 'this' relative dates"""
+        weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+        for i, day in enumerate(weekdays):
+            if f'this {day}' in text:
+                return self._get_this_weekday(i)
+        
+        return None
+    
+    def _get_next_weekday(self, weekday, next_week=False):
+        """Get the next occurrence of a specific weekday"""
+        days_ahead = weekday - self.today.weekday()
+        
+        if days_ahead <= 0 or next_week:  # Target day already happened this week or explicitly next week
+            days_ahead += 7
+        
+        target_date = self.today + timedelta(days=days_ahead)
+        return target_date.strftime('%Y-%m-%d')
+    
+    def _get_this_weekday(self, weekday):
+        """Get this week's occurrence of a specific weekday"""
+        days_ahead = weekday - self.today.weekday()
+        
+        if days_ahead < 0:  # If the day already passed this week, get next week
+            days_ahead += 7
+        
+        target_date = self.today + timedelta(days=days_ahead)
+        return target_date.strftime('%Y-%m-%d')
+    
+    def validate_date(self, date_string):
+        """Validate if a date string is in correct format and not in the past"""
+        try:
+            date_obj = datetime.strptime(date_string, '%Y-%m-%d').date()
+            
+            if date_obj < self.today:
+                return False, "Date cannot be in the past"
+            
+            return True, "Valid date"
+        except ValueError:
+            return False, "Invalid date format. Please use YYYY-MM-DD"
+    
+    def format_date_display(self, date_string):
+        """Format date for display"""
+        try:
+            date_obj = datetime.strptime(date_string, '%Y-%m-%d')
+            return date_obj.strftime('%B %d, %Y')  # e.g., "January 15, 2024"
+        except:
+            return date_string
+
+def main():
+    """Run all benchmarks"""
+    print("🚀 Running benchmarks...\n")
+
+    bench_import_time()
+    bench_date_extractor()
+    bench_validate_records()
+    bench_appointment_store()
+    bench_availability()
+    bench_session_state()
+    bench_embedding_pipeline()
+    bench_query_batcher()
+    bench_ann_index()
+
+    print("🎉 Benchmarks completed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+# server.py
+"""
+Entry point for serving the chatbot: `streamlit run server.py` (or `uvicorn server:app`).
+
+Runs app.py through st.App with SessionCookieMiddleware in front, so every
+browser gets its signed session token as an HttpOnly cookie.
+"""
+
+import streamlit as st
+from starlette.middleware import Middleware
+from utils.session_state import SessionCookieMiddleware, get_session_store
+
+# Fail at startup rather than on the first request when SESSION_SECRET is missing
+get_session_store()
+
+app = st.App("app.py", middleware=[Middleware(SessionCookieMiddleware)])
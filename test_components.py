@@ -5,8 +5,85 @@ Run this before starting the main application to ensure everything is set up pro
 """
 
 import os
+import sys
+import asyncio
+import subprocess
+from datetime import date, timedelta
+import io
+import sqlite3
+import tempfile
+import time
+import docx
+import faiss
+import numpy as np
 from utils.date_extractor import DateExtractor
 from utils.form_handler import FormHandler
+from utils.validators import ValidatorRegistry
+from utils.appointment_store import AppointmentStore, SlotTaken
+from utils.availability import AvailabilityEngine
+from utils.session_state import (SessionSnapshot, SessionStore, SessionConflict, MemorySessionBackend, SQLiteSessionBackend,
+                                 SessionCookieMiddleware, new_tab_id, SESSION_COOKIE)
+from utils.document_processor import DocumentProcessor
+from utils.file_parsers import parse_file
+from utils import ann_index
+from utils.embedding_pipeline import FakeEmbeddings, EmbeddingPipeline
+from utils.chunk_dedup import ChunkDeduplicator
+from utils.index_registry import IndexRegistry
+from utils.context_builder import ContextBuilder
+from utils.tokens import estimate_tokens
+from utils.intent_router import IntentRouter
+from utils.chatbot import ChatBot
+from utils.answer_cache import SemanticAnswerCache
+from utils.query_batcher import QueryEmbeddingBatcher, FakeQueryBackend
+from utils.metrics import Metrics
+from concurrent.futures import ThreadPoolExecutor
+from langchain.schema import Document, AIMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+class UploadedFile:
+    """Minimal stand-in for a Streamlit UploadedFile"""
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+    
+    def getvalue(self):
+        return self.data
+
+def make_pdf(pages):
+    """Minimal PDF with one line of Helvetica text per page"""
+    count = len(pages)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(count))
+               + b"] /Count %d >>" % count,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, text in enumerate(pages):
+        stream = b"BT /F1 12 Tf 72 720 Td (" + text.encode('latin-1') + b") Tj ET"
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i))
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    
+    data, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    return data + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+def make_docx(paragraphs, table):
+    """DOCX bytes with the given paragraphs and one table (list of rows)"""
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    grid = document.add_table(rows=len(table), cols=len(table[0]))
+    for row, values in zip(grid.rows, table):
+        for cell, value in zip(row.cells, values):
+            cell.text = value
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
 
 def test_date_extractor():
     """Test the date extraction functionality"""
@@ -27,6 +104,16 @@ def test_date_extractor():
         result = date_extractor.extract_date(test_case)
         print(f"  '{test_case}' -> {result}")
     
+    today = date_extractor.today
+    assert date_extractor.extract_date("in 3 days") == (today + timedelta(days=3)).isoformat()
+    assert date_extractor.extract_date("January 15, 2024") == "2024-01-15"
+    assert date_extractor.extract_date("2024-02-30") is None
+    
+    # Batch API: one result per input, in order
+    assert date_extractor.extract_dates(["2024-12-25", "not a date", "12/25/2024", ""]) == [
+        "2024-12-25", None, "2024-12-25", None
+    ]
+    
     print("✅ Date Extractor test completed\n")
 
 def test_form_handler():
@@ -49,6 +136,913 @@ def test_form_handler():
     
     print("✅ Form Handler test completed\n")
 
+def test_validators():
+    """Test shared field validation and bulk lead validation"""
+    print("☑️ Testing Validators...")
+    
+    validators = ValidatorRegistry()
+    assert validators.validate_phone("(202) 555-0143")[0] == "(202) 555-0143"
+    assert validators.validate_phone("+44 20 7946 0018")[0] == "+44 20 7946 0018"
+    assert ValidatorRegistry(default_region="GB").validate_phone("020 7946 0018")[0] == "020 7946 0018"
+    assert validators.validate_email(" Jane.Doe@Example.COM ")[0] == "jane.doe@example.com"
+    assert validators.validate_time("2 pm") == ("2 PM", None)
+    
+    leads = [
+        {'name': "Jane Doe", 'phone': "(202) 555-0143", 'email': "jane@example.com", 'appointment_date': "tomorrow"},
+        {'name': "J", 'phone': "12", 'email': "not-an-email"},
+        {'name': "Sam Lee", 'phone': ""},
+    ] * 500
+    results = validators.validate_records(leads)
+    assert len(results) == 1500
+    assert results[0][1] == {} and results[0][0]['appointment_date']
+    assert set(results[1][1]) == {'name', 'phone', 'email'}
+    assert results[2][1] == {'phone': "Required"}
+    
+    info = validators.cache_info()
+    print(f"  Cache: {info}")
+    assert info['phone'].misses == 3 and info['phone'].hits == 999
+    
+    print("✅ Validators test completed\n")
+
+def test_appointment_store():
+    """Test that completed forms are saved and bookings can be queried"""
+    print("📒 Testing Appointment Store...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AppointmentStore(os.path.join(tmp, "appointments.db"))
+        form_handler = FormHandler(store=store)
+        form_handler.start_form_collection()
+        for answer in ["Jane Doe", "(202) 555-0143", "Jane@Example.com", "next monday", "2:30 PM", "Review the contract"]:
+            response = form_handler.process_form_input(answer)
+        assert form_handler.is_form_complete() and f"#{form_handler.appointment_id}" in response
+        
+        booked_date = form_handler.form_fields['appointment_date']
+        assert [row['name'] for row in store.by_email("jane@example.com")] == ["Jane Doe"]
+        
+        # Concurrent sessions share the writer's transactions
+        def book(i):
+            return store.add({'name': f"Lead {i}", 'phone': "(202) 555-0143", 'email': f"lead{i}@example.com",
+                              'appointment_date': booked_date, 'appointment_time': f"{9 + i % 8}:00"})
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            ids = list(pool.map(book, range(200)))
+        assert len(set(ids)) == 200 and store.count() == 201
+        
+        day = store.on_date(booked_date)
+        assert len(day) == 201 and [row['sort_time'] for row in day] == sorted(row['sort_time'] for row in day)
+        assert len(store.by_phone("(202) 555-0143")) == 201
+        # Lookups and imports normalize the number the way the form does
+        assert len(store.by_phone("202-555-0143")) == len(store.by_phone("+1 202 555 0143")) == 201
+        store.add_many([{'name': "Imported", 'phone': "2025550199", 'appointment_date': booked_date}])
+        assert [row['name'] for row in store.by_phone("(202) 555-0199")] == ["Imported"]
+        
+        # Bad rows fail on their own; the writer keeps serving everyone else
+        try:
+            store.submit({'name': "Typo", 'appointment_date': booked_date, 'appointment_time': 1430})
+            assert False, "non-string time was queued"
+        except TypeError:
+            pass
+        nameless, valid = store.submit({'phone': "(202) 555-0143"}), store.submit({'name': "After"})
+        try:
+            nameless.result(timeout=5)
+            assert False, "row without a name was saved"
+        except sqlite3.IntegrityError:
+            pass
+        assert store.get(valid.result(timeout=5))['name'] == "After" and store._writer.is_alive()
+        print(f"  Stats: {store.stats()}")
+        assert store.stats()['transactions'] < 201
+        store.close()
+    
+    print("✅ Appointment Store test completed\n")
+
+def test_availability():
+    """Test slot conflicts, nearest free slots and the form's alternatives"""
+    print("🗓️ Testing Availability Engine...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AppointmentStore(os.path.join(tmp, "appointments.db"))
+        monday = date.today() + timedelta(days=7 - date.today().weekday() + 7)  # Monday after next
+        day = monday.isoformat()
+        store.add_many([{'name': "Lead", 'appointment_date': day, 'appointment_time': t}
+                        for t in ("10:00 AM", "10:00 AM", "10:30 AM", "2:00 PM")])
+        
+        engine = AvailabilityEngine(capacity=2).load(store)
+        assert engine.check(day, "10:00") == "that slot is already booked"
+        assert engine.is_free(day, "10:30")
+        assert engine.check(day, "08:00") and engine.check(day, "10:15")
+        assert engine.check((monday - timedelta(days=1)).isoformat(), "10:00") == "we're closed that day"
+        assert engine.nearest_free(day, "10:00", n=2) == [(day, "09:30"), (day, "10:30")]
+        
+        # Weekend requests get the closest slots on either side
+        saturday = monday + timedelta(days=5)
+        assert engine.nearest_free(saturday.isoformat(), "09:00", n=1) == [((saturday - timedelta(days=1)).isoformat(), "16:30")]
+        assert engine.nearest_free((saturday + timedelta(days=1)).isoformat(), "09:00", n=1) == [
+            ((saturday + timedelta(days=2)).isoformat(), "09:00")]
+        engine.record(day, "10:30")
+        assert not engine.is_free(day, "10:30")  # second seat now taken
+        
+        # Closed days are turned away as soon as the date is given
+        holiday = (monday + timedelta(days=1)).isoformat()
+        form_handler = FormHandler(store=store, availability=AvailabilityEngine(holidays=[holiday]).load(store))
+        form_handler.start_form_collection()
+        for answer in ["Jane Doe", "(202) 555-0143", "jane@example.com"]:
+            form_handler.process_form_input(answer)
+        for closed, reason in ((saturday.isoformat(), "closed that day"), (holiday, "holiday")):
+            response = form_handler.process_form_input(closed)
+            assert reason in response and form_handler.current_field == 'appointment_date'
+        form_handler.process_form_input(day)
+        assert form_handler.current_field == 'appointment_time'
+        response = form_handler.process_form_input("2 PM")
+        print(f"  Suggestions: {form_handler.suggested_slots}")
+        assert "isn't available" in response and form_handler.current_field == 'appointment_time'
+        assert form_handler.suggested_slots[:2] == [(day, "13:30"), (day, "14:30")]
+        
+        form_handler.process_form_input("2")
+        assert form_handler.form_fields['appointment_time'] == "2:30 PM"
+        form_handler.process_form_input("Quarterly review")
+        assert form_handler.is_form_complete()
+        assert not form_handler.availability.is_free(day, "14:30")
+        
+        # The store, not the cached counts, has the last word on a full slot
+        try:
+            store.add({'name': "Late", 'appointment_date': day, 'appointment_time': "2:30 PM"}, capacity=1)
+            assert False, "slot was double-booked"
+        except SlotTaken:
+            pass
+        
+        # Two workers (own store and engine, one database) race for the same slot
+        other_store = AppointmentStore(store.path)
+        handlers = [FormHandler(store=s, availability=AvailabilityEngine().load(s)) for s in (store, other_store)]
+        for handler in handlers:
+            handler.start_form_collection()
+            for answer in ["Jane Doe", "(202) 555-0143", "jane@example.com", day, "3 PM"]:
+                handler.process_form_input(answer)
+        handlers[0].process_form_input("Quarterly review")
+        response = handlers[1].process_form_input("Quarterly review")
+        assert handlers[0].is_form_complete() and "just booked" in response
+        assert handlers[1].current_field == 'appointment_time' and (day, "15:00") not in handlers[1].suggested_slots
+        assert not handlers[1].availability.is_free(day, "15:00")  # refreshed from the store
+        
+        # Bulk imports bypass every engine, yet still block the slot
+        store.add_many([{'name': "Imported", 'appointment_date': day, 'appointment_time': "4:00 PM"}])
+        handlers[1].process_form_input("4 PM")
+        assert "just booked" in handlers[1].process_form_input("Quarterly review")
+        assert len(store.on_date(day)) == 7
+        
+        # Concurrent writers on both stores never overfill a slot
+        def race(i):
+            try:
+                return (store, other_store)[i % 2].add(
+                    {'name': f"Racer {i}", 'appointment_date': day, 'appointment_time': "11:00 AM"}, capacity=2)
+            except SlotTaken:
+                return None
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            booked = [result for result in pool.map(race, range(20)) if result is not None]
+        assert len(booked) == 2 and len(store.on_date(day)) == 9
+        other_store.close()
+        store.close()
+    
+    print("✅ Availability Engine test completed\n")
+
+def test_session_state():
+    """Test that a half-finished booking and the chat memory resume in a fresh process"""
+    print("💾 Testing Session State...")
+    
+    transcript = []
+    chatbot = ChatBot("test-key", form_handler=FormHandler(), cache_answers=False, memory_mode="summary",
+                      max_history_turns=1, transcript=transcript)
+    chatbot.llm = GenericFakeChatModel(messages=iter([AIMessage(content="User asked about pricing.")] * 3))
+    for question in ["What does it cost?", "Is there a trial?", "Who is it for?"]:
+        chatbot.memory.save_context({'input': question}, {'output': "See the pricing page."})
+    chatbot.form_handler.start_form_collection()
+    for answer in ["Jane Doe", "(202) 555-0143"]:
+        chatbot.form_handler.process_form_input(answer)
+    transcript[-1]['timing'] = {'ttft': 0.1, 'total': 0.4}
+    
+    snapshot = SessionSnapshot.capture(transcript, chatbot, chatbot.form_handler)
+    data = snapshot.to_bytes()
+    print(f"  Snapshot: {len(data)} bytes for {len(snapshot.messages)} messages")
+    assert SessionSnapshot.from_bytes(data) == snapshot
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in (MemorySessionBackend(), SQLiteSessionBackend(os.path.join(tmp, "sessions.db"))):
+            store = SessionStore(backend)
+            store.save("sid-1", SessionSnapshot.from_bytes(data))
+            restored = store.load("sid-1")
+            assert restored == snapshot and store.load("sid-2") is None
+            
+            # What a new worker does: rebuild the objects around the restored transcript
+            form_handler = FormHandler()
+            resumed = ChatBot("test-key", form_handler=form_handler, cache_answers=False, memory_mode="summary",
+                              max_history_turns=1, transcript=restored.messages)
+            restored.restore(resumed, form_handler)
+            assert resumed.memory.summary == "User asked about pricing."
+            assert resumed.memory.buffer_as_messages == chatbot.memory.buffer_as_messages
+            assert form_handler.current_field == 'email' and form_handler.form_fields['name'] == "Jane Doe"
+            assert "Perfect!" in form_handler.process_form_input("jane@example.com")
+            
+            store.delete("sid-1")
+            assert store.load("sid-1") is None
+            backend.set("expired", data, ttl=-1)
+            assert backend.get("expired") is None
+    
+    # Browser ids reach the browser as signed cookie tokens; guessed or forged ones are refused
+    store = SessionStore(MemorySessionBackend(), secret="shared-secret")
+    browser_id, token = store.new_browser()
+    assert store.browser_id(token) == browser_id and browser_id not in (store.new_browser()[0], "")
+    assert SessionStore(MemorySessionBackend(), secret="shared-secret").browser_id(token) == browser_id
+    assert SessionStore(MemorySessionBackend(), secret="other-secret").browser_id(token) is None
+    for forged in (None, "", browser_id, f"{browser_id}.{'0' * 64}", token[:-1] + "x", f"x{token}"):
+        assert store.browser_id(forged) is None
+    try:
+        SessionStore(MemorySessionBackend()).new_browser()
+        assert False, "token issued without a secret"
+    except RuntimeError:
+        pass
+    
+    # Two tabs on the same session id: the second save finds the first one's write and backs off
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in (MemorySessionBackend(), SQLiteSessionBackend(os.path.join(tmp, "sessions.db"))):
+            store = SessionStore(backend, secret="shared-secret")
+            key = store.session_key(browser_id, new_tab_id())
+            first, second = SessionSnapshot(messages=[{'role': 'user', 'content': "a"}]), SessionSnapshot()
+            store.save(key, first)
+            try:
+                store.save(key, second)
+                assert False, "stale tab overwrote the session"
+            except SessionConflict:
+                pass
+            store.save(key, first)  # the tab that wrote last may keep saving
+            assert store.load(key) == first and store.load(key).revision == first.revision == 2
+    
+    # The middleware sets the cookie on pages only, HttpOnly, and keeps a valid token
+    async def page(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/html')]})
+    
+    def cookies_set(headers):
+        sent = []
+        async def send(message):
+            sent.append(message)
+        asyncio.run(SessionCookieMiddleware(page, store)({'type': 'http', 'headers': headers}, None, send))
+        return [value.decode() for name, value in sent[0]['headers'] if name == b'set-cookie']
+    
+    issued, = cookies_set([])
+    assert "HttpOnly" in issued and "SameSite=Lax" in issued
+    assert store.browser_id(issued.split(';')[0].split('=', 1)[1]) is not None
+    kept, = cookies_set([(b'cookie', f"{SESSION_COOKIE}={token}".encode())])
+    assert kept.startswith(f"{SESSION_COOKIE}={token};")
+    
+    print("✅ Session State test completed\n")
+
+def test_file_parsers():
+    """Test parsing uploads from memory, alone and in the process pool"""
+    print("📄 Testing File Parsers...")
+    
+    pdf = make_pdf(["Refund policy overview", "Refunds take 14 days"])
+    pages = parse_file("policy.pdf", pdf)
+    assert [text.strip() for text, _ in pages] == ["Refund policy overview", "Refunds take 14 days"]
+    assert [metadata for _, metadata in pages] == [{'source': "policy.pdf", 'page': 0}, {'source': "policy.pdf", 'page': 1}]
+    
+    # Table cells are kept, tab-separated, after the paragraphs
+    (text, metadata), = parse_file("rates.docx", make_docx(["Rate card"], [["Plan", "Price"], ["Pro", "$20"]]))
+    assert text == "Rate card\nPlan\tPrice\nPro\t$20" and metadata == {'source': "rates.docx"}
+    assert parse_file("notes.txt", "Café hours".encode('latin-1'))[0][0] == "Café hours"
+    
+    # A broken file fails on its own; the files around it still load, in order
+    files = [UploadedFile("policy.pdf", pdf), UploadedFile("broken.pdf", b"not a pdf"),
+             UploadedFile("notes.txt", b"Parking is free.")]
+    for workers in (1, 2):
+        processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None, parse_workers=workers)
+        documents = processor.load_documents(files)
+        assert [doc.metadata['source'] for doc in documents] == ["policy.pdf", "policy.pdf", "notes.txt"]
+        assert sorted(processor.source_digests) == ["notes.txt", "policy.pdf"]
+    print(f"  Parsed {len(documents)} pages; broken.pdf isolated")
+    
+    print("✅ File Parsers test completed\n")
+
+def test_embedding_pipeline():
+    """Test batched embedding with the offline fake backend"""
+    print("🧮 Testing Embedding Pipeline...")
+    
+    embeddings = FakeEmbeddings()
+    pipeline = EmbeddingPipeline(embeddings, batch_size=4, max_concurrency=2)
+    texts = [f"chunk number {i}" for i in range(10)]
+    progress = []
+    
+    vectors = pipeline.embed_documents(texts, progress_callback=lambda done, total: progress.append(done))
+    print(f"  Embedded {len(vectors)} texts in {embeddings.calls} batches")
+    
+    assert vectors == embeddings.embed_documents(texts)
+    assert embeddings.calls == 4  # 3 pipeline batches + 1 direct call
+    assert sorted(progress)[-1] == len(texts)
+    
+    print("✅ Embedding Pipeline test completed\n")
+
+def test_chunk_deduplicator():
+    """Test exact and near-duplicate chunk elimination"""
+    print("✂️ Testing Chunk Deduplicator...")
+    
+    disclaimer = (
+        "This document contains confidential information intended only for the named recipient. "
+        "If you received it in error, notify the sender immediately and delete every copy. "
+        "Any review, retransmission, dissemination or other use of this information by persons "
+        "other than the intended recipient is prohibited and may be unlawful under applicable law."
+    )
+    chunks = [
+        Document(page_content=disclaimer, metadata={'source': 'a.pdf', 'page': 0}),
+        Document(page_content=disclaimer.upper(), metadata={'source': 'b.pdf', 'page': 4}),
+        Document(page_content=disclaimer.replace('immediately', 'promptly'), metadata={'source': 'c.pdf'}),
+        Document(page_content="Refunds are processed within 14 business days.", metadata={'source': 'a.pdf'}),
+    ]
+    
+    deduplicator = ChunkDeduplicator(threshold=0.8)
+    kept, kept_ids, duplicates = deduplicator.filter(chunks, ['1', '2', '3', '4'])
+    print(f"  Kept {kept_ids}, dropped {len(duplicates)} duplicates")
+    
+    assert kept_ids == ['1', '4']
+    assert [entry['source'] for entry in kept[0].metadata['sources']] == ['a.pdf', 'b.pdf', 'c.pdf']
+    
+    print("✅ Chunk Deduplicator test completed\n")
+
+def test_document_processor():
+    """Test indexing, caching and incremental updates with fake embeddings"""
+    print("📚 Testing Document Processor...")
+    
+    cache_dir = tempfile.mkdtemp()
+    files = [
+        UploadedFile("alpha.txt", b"Our office hours are 9am to 5pm. " * 60),
+        UploadedFile("beta.txt", b"Refunds are processed within 14 days. " * 60),
+    ]
+    
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=cache_dir)
+    processor.create_vector_store(processor.load_documents(files))
+    print(f"  Indexed sources: {processor.indexed_sources()}")
+    assert processor.indexed_sources() == ["alpha.txt", "beta.txt"]
+    
+    # Same files again should load from the on-disk cache without embedding
+    cached_embeddings = FakeEmbeddings()
+    cached = DocumentProcessor("test-key", embeddings=cached_embeddings, cache_dir=cache_dir)
+    cached.create_vector_store(cached.load_documents(files))
+    print(f"  Cache reload embedding calls: {cached_embeddings.calls}")
+    assert cached_embeddings.calls == 0
+    assert cached.indexed_sources() == processor.indexed_sources()
+
+    # A different dedup setting keeps a different set of chunks, so it must not reuse that index
+    for threshold in (0.5, None):
+        undeduped_embeddings = FakeEmbeddings()
+        undeduped = DocumentProcessor("test-key", embeddings=undeduped_embeddings, cache_dir=cache_dir,
+                                      dedup_threshold=threshold)
+        undeduped.create_vector_store(undeduped.load_documents(files))
+        assert undeduped_embeddings.calls > 0
+
+    # Swap beta for gamma; only gamma should be embedded
+    added, removed = processor.sync_files([files[0], UploadedFile("gamma.txt", b"Parking is free. " * 10)])
+    print(f"  Sync added {added}, removed {removed}")
+    assert (added, removed) == (["gamma.txt"], ["beta.txt"])
+    assert processor.indexed_sources() == ["alpha.txt", "gamma.txt"]
+    
+    # Streaming ingestion in small batches should index the same chunks
+    streamed = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None)
+    stats = streamed.ingest_files(files, batch_size=2)
+    print(f"  Streamed {stats['pages']} pages into {stats['chunks']} chunks")
+    assert stats['files_done'] == 2
+    assert stats['chunks'] == streamed.vector_store.index.ntotal == cached.vector_store.index.ntotal
+    assert streamed.indexed_sources() == ["alpha.txt", "beta.txt"]
+
+    # Every entry point reports progress as the same stats dict
+    def add_second(processor, callback):
+        processor.create_vector_store(processor.load_documents(files[:1]))
+        processor.add_documents(processor.load_documents(files[1:]), callback)
+    builds = {
+        'create_vector_store': lambda processor, callback: processor.create_vector_store(
+            processor.load_documents(files), callback),
+        'ingest_files': lambda processor, callback: processor.ingest_files(files, callback),
+        'add_documents': add_second,
+    }
+    for name, build in builds.items():
+        reports = []
+        build(DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None), reports.append)
+        assert reports and all(report.keys() == stats.keys() for report in reports), name
+        assert reports[-1]['files_done'] == reports[-1]['files_total'] and reports[-1]['chunks'] > 0, name
+
+    # Files parsed ahead in the pool stay within the byte budget (a bigger file goes alone)
+    uploads = [UploadedFile(f"part{i}.txt", f"Section {i} covers warranty terms. ".encode() * 30) for i in range(4)]
+    for budget, peak in ((2 * len(uploads[0].data), 2 * len(uploads[0].data)), (10, len(uploads[0].data))):
+        pooled = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None,
+                                   parse_workers=4, parse_budget_bytes=budget)
+        stats = pooled.ingest_files(uploads)
+        assert stats['files_done'] == 4 and stats['peak_parse_bytes'] == peak
+    
+    # Repeated questions are served from the retrieval caches until the index changes
+    first = streamed.get_relevant_documents("When are your office hours?")
+    again = streamed.get_relevant_documents("  when are your OFFICE hours ")
+    stats = streamed.cache_stats()
+    print(f"  Retrieval cache: {stats['results']}")
+    assert again == first and stats['results']['hits'] == 1
+    streamed.remove_source("beta.txt")
+    streamed.get_relevant_documents("When are your office hours?")
+    assert streamed.cache_stats()['results']['misses'] == 2
+    
+    # Exact codes are answered from BM25 alone, without embedding the query
+    streamed.ingest_files([UploadedFile("codes.txt", b"Policy PN-4471 covers accidental damage to rented equipment.")])
+    docs = streamed.get_relevant_documents("PN-4471", k=1)
+    print(f"  Retrieval paths: {streamed.cache_stats()['retrieval_paths']}")
+    assert docs[0].metadata['source'] == "codes.txt"
+    assert streamed.cache_stats()['retrieval_paths']['lexical'] == 1
+    
+    print("✅ Document Processor test completed\n")
+
+def test_ivf_streaming():
+    """Test that an explicit IVF index is trained on enough vectors, not the first batch"""
+    print("🗂️ Testing IVF Streaming...")
+    
+    # 40 topics with their own vocabulary, so the vectors have real cluster structure
+    rng = np.random.default_rng(7)
+    vocabulary = [[f"topic{t}word{w}" for w in range(30)] for t in range(40)]
+    lines = [" ".join(rng.choice(vocabulary[i % 40], size=8)) + "." for i in range(6000)]
+    files = [UploadedFile(f"part{i}.txt", "\n".join(lines[i::60]).encode()) for i in range(60)]
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None, chunk_size=120,
+                                  chunk_overlap=0, dedup_threshold=None, index_type='ivf', parse_workers=1)
+    stats = processor.ingest_files(files, batch_size=256)
+    
+    index = processor.vector_store.index
+    nlist = ann_index.list_count(index)
+    print(f"  {stats['chunks']} chunks streamed in batches of 256 -> {processor.index_stats()['index_type']}, nlist {nlist}")
+    assert processor.index_stats()['index_type'] == 'ivf' and index.ntotal == stats['chunks'] > 256
+    # Trained for the corpus it holds now (the first batch alone would only support a handful of lists)
+    assert ann_index.MIN_IVF_LISTS <= nlist and 2 * nlist > ann_index.ivf_lists(index.ntotal)
+    
+    # Recall@10 against exact search over the same vectors; bag-of-words vectors tie a lot,
+    # so a hit is any result at least as close as the true 10th neighbour
+    vectors = processor._originals.reconstruct_n(0, index.ntotal)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    queries = vectors[rng.choice(len(vectors), size=100, replace=False)]
+    truth, _ = exact.search(queries, 10)
+    found, _ = index.search(queries, 10)
+    recall = np.mean(found <= truth[:, -1:] + 1e-5)
+    print(f"  Recall@10 at nprobe {processor.search_params['nprobe']}: {recall:.2f}")
+    assert recall >= 0.9
+    
+    # Below the training size an explicit IVF type waits in a flat index
+    small = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None, index_type='ivf_pq')
+    small.ingest_files([UploadedFile("hours.txt", b"Our office hours are 9am to 5pm on weekdays.")])
+    assert small.index_stats()['index_type'] == 'flat'
+    
+    print("✅ IVF Streaming test completed\n")
+
+def test_index_tombstones():
+    """Test that removals from an HNSW index are tombstoned, skipped by search and compacted exactly"""
+    print("🪦 Testing Index Tombstones...")
+    
+    cache_dir = tempfile.mkdtemp()
+    files = [
+        UploadedFile(f"topic{t}.txt", "\n".join(f"topic{t}word{w} topic{t}word{w + 1}." for w in range(30)).encode())
+        for t in range(10)
+    ]
+    settings = dict(cache_dir=cache_dir, chunk_size=60, chunk_overlap=0, dedup_threshold=None,
+                    hybrid_search=False, index_type='hnsw_sq8', parse_workers=1)
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), **settings)
+    processor.ingest_files(files)
+    index = processor.vector_store.index
+    total = index.ntotal
+    embedded = processor._originals.reconstruct_n(0, total)
+    labels = {chunk_id: label for label, chunk_id in processor.vector_store.index_to_docstore_id.items()}
+    
+    # One removal is a tombstone: no rebuild, and its chunks never come back from search
+    removed = len(processor.source_chunk_ids["topic0.txt"])
+    processor.remove_source("topic0.txt")
+    stats = processor.index_stats()
+    print(f"  {total} vectors, {stats['tombstones']} tombstoned after one removal")
+    assert processor.vector_store.index is index and stats['vectors'] == total and stats['tombstones'] == removed
+    docs = processor.get_relevant_documents("topic0word3 topic0word4", k=10)
+    assert len(docs) == 10 and "topic0.txt" not in {doc.metadata['source'] for doc in docs}
+    
+    # Tombstones and the full-precision vectors survive the on-disk cache
+    reloaded_embeddings = FakeEmbeddings()
+    reloaded = DocumentProcessor("test-key", embeddings=reloaded_embeddings, **settings)
+    reloaded.ingest_files(files[1:])
+    assert reloaded_embeddings.calls == 0 and reloaded.index_stats()['tombstones'] == removed
+    
+    # Past compact_ratio the index is rebuilt from the vectors as embedded, not decoded from 8-bit codes
+    for name in ("topic1.txt", "topic2.txt"):
+        processor.remove_source(name)
+    stats = processor.index_stats()
+    print(f"  After compaction: {stats['vectors']} vectors, {stats['tombstones']} tombstoned")
+    assert processor.vector_store.index is not index and stats['index_type'] == 'hnsw_sq8'
+    assert stats['tombstones'] == 0 and stats['vectors'] == total - 3 * removed
+    for label, chunk_id in processor.vector_store.index_to_docstore_id.items():
+        assert np.array_equal(processor._originals.reconstruct(label), embedded[labels[chunk_id]])
+    assert processor.get_relevant_documents("topic5word3 topic5word4", k=1)[0].metadata['source'] == "topic5.txt"
+    
+    print("✅ Index Tombstones test completed\n")
+
+def test_shared_index():
+    """Test publishing a shared index, attaching sessions and hot-swapping versions"""
+    print("🔗 Testing Shared Index Registry...")
+    
+    registry = IndexRegistry(tempfile.mkdtemp())
+    publisher = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None)
+    publisher.ingest_files([UploadedFile("handbook.txt", b"Our office hours are 9am to 5pm. " * 60)])
+    assert publisher.publish_shared(registry, "kb") == 1
+    
+    # Sessions attached to the same version share one loaded index
+    sessions = [DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None) for _ in range(2)]
+    sessions[0].attach_shared(registry, "kb")
+    sessions[1].attach_shared(registry, "kb")
+    print(f"  Loaded: {registry.stats()}")
+    assert sessions[0].vector_store is sessions[1].vector_store
+    assert registry.stats()[0]['refcount'] == 2
+    assert sessions[0].get_relevant_documents("office hours", k=1)[0].metadata['source'] == "handbook.txt"
+    
+    try:
+        sessions[0].remove_source("handbook.txt")
+        assert False, "shared index should be read-only"
+    except RuntimeError:
+        pass
+    
+    # A new version is picked up on the next query; the old one unloads once nobody uses it
+    publisher.ingest_files([UploadedFile("parking.txt", b"Parking is free for visitors. " * 10)])
+    publisher.publish_shared(registry, "kb")
+    sessions[0].get_relevant_documents("parking", k=1)
+    sessions[1].get_relevant_documents("parking", k=1)
+    print(f"  After hot swap: {registry.stats()}")
+    assert [entry['version'] for entry in registry.stats()] == [2]
+    assert sessions[0].indexed_sources() == ["handbook.txt", "parking.txt"]
+    
+    # Detaching, or dropping the processor with its session, releases the index
+    sessions[0].detach_shared()
+    sessions.pop()
+    assert registry.stats()[0]['refcount'] == 0
+    
+    print("✅ Shared Index Registry test completed\n")
+
+def test_context_builder():
+    """Test merging, filtering and token-budget packing of retrieved chunks"""
+    print("🧩 Testing Context Builder...")
+    
+    text = " ".join(f"Clause {i}: refunds for order type {i} are issued within {i + 3} days." for i in range(30))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=60, add_start_index=True)
+    chunks = splitter.split_documents([Document(page_content=text, metadata={'source': 'policy.txt'})])
+    unrelated = Document(page_content="Parking is free for visitors.", metadata={'source': 'parking.txt'})
+    candidates = [(chunks[1], 0.9), (chunks[0], 0.8), (unrelated, 0.5), (chunks[5], 0.1)]
+    
+    # Overlapping neighbours merge into one piece; weak hits are cut by the score cutoff
+    context, stats = ContextBuilder().build(candidates)
+    print(f"  Stats: {stats}")
+    assert stats['selected'] == 2 and stats['merged'] == 1
+    assert text[:chunks[1].metadata['start_index'] + len(chunks[1].page_content)] in context
+    # Savings are measured against the old prompt: the top 3 chunks joined as is
+    assert stats['baseline_tokens'] == estimate_tokens("\n\n".join(doc.page_content for doc, _ in candidates[:3]))
+    assert 0 < stats['tokens_saved'] == stats['baseline_tokens'] - stats['context_tokens']
+    
+    # Fused scores are shares of the best attainable rank (0..1), and the packed context never outgrows the old join
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None, chunk_size=200)
+    processor.ingest_files([UploadedFile("policy.txt", text.encode()), UploadedFile("parking.txt", b"Parking is free for visitors.")])
+    scored = processor.get_scored_documents("How many days for refunds on order type 7?", k=3)
+    assert all(0 < score <= 1 for _, score in scored)
+    context, stats = ContextBuilder().build(scored)
+    assert stats['context_tokens'] <= stats['baseline_tokens'] <= 750
+    
+    # Chunks from an older index carry no offsets; the overlap is found in the text
+    plain = [(Document(page_content=doc.page_content, metadata={'source': 'policy.txt'}), score)
+             for doc, score in candidates[:2]]
+    assert ContextBuilder().build(plain)[1]['merged'] == 1
+    
+    # The packed context never exceeds the budget
+    context, stats = ContextBuilder(token_budget=60, min_piece_tokens=10, score_cutoff=0.5).build(candidates)
+    assert estimate_tokens(context) <= 60 and stats['context_tokens'] <= 60
+    
+    print("✅ Context Builder test completed\n")
+
+def test_intent_router():
+    """Test local routing of chat turns"""
+    print("🧭 Testing Intent Router...")
+    
+    router = IntentRouter()
+    labelled = [
+        ("Can you call me tomorrow?", "booking"),
+        ("Please book a meeting with sales", "booking"),
+        ("What does the document say about refunds?", "document"),
+        ("Summarize the key points", "document"),
+        ("Hello there!", "general"),
+        ("Thanks a lot", "general"),
+    ]
+    report = router.evaluate(labelled)
+    print(f"  Accuracy {report['accuracy']:.2f}, coverage {report['coverage']:.2f}")
+    assert report['accuracy'] == 1.0 and report['coverage'] == 1.0
+    
+    # Without documents there is nothing to route to DocumentQA
+    assert router.route("Summarize the uploaded files", has_documents=False)[0] != "document"
+    assert router.route("asdf qwerty")[0] == "agent"
+    
+    # Document-like questions about things the documents never mention go to the agent
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None)
+    processor.ingest_files([UploadedFile("hours.txt", b"Our office hours are 9am to 5pm on weekdays.")])
+    chatbot = ChatBot("test-key", document_processor=processor)
+    assert chatbot.route("What are the office hours?")[0] == "document"
+    assert chatbot.route("What is the capital of France?")[0] == "agent"
+    print(f"  Routing log: {chatbot.router.stats()}")
+    assert chatbot.router.stats()['turns'] == 2
+    
+    # Logged decisions leave out what the user typed unless asked to keep it
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "routing.jsonl")
+        IntentRouter(log_path=log_path).route("Call me at 202-555-0143")
+        decision = chatbot.router.decisions[-1]
+        with open(log_path) as f:
+            logged = f.read()
+        assert 'text' not in decision and "555" not in logged and '"method"' in logged
+        opted_in = IntentRouter(log_text=True)
+        opted_in.route("Call me at 202-555-0143")
+        assert opted_in.decisions[-1]['text'] == "Call me at 202-555-0143"
+    
+    # The agent keeps its reasoning (and the user's messages) off stdout unless asked
+    chatbot.llm = GenericFakeChatModel(messages=iter([]))
+    assert chatbot.agent.verbose is False
+    
+    print("✅ Intent Router test completed\n")
+
+def test_response_streaming():
+    """Test that routed answers stream piece by piece and are timed"""
+    print("📡 Testing Response Streaming...")
+    
+    chatbot = ChatBot("test-key", form_handler=FormHandler(), cache_answers=False)
+    chatbot.llm = GenericFakeChatModel(messages=iter([AIMessage(content="Hi! How can I help you today?")]))
+    
+    pieces = list(chatbot.get_response_stream("Hello there!"))
+    timing = chatbot.last_turn_timing
+    print(f"  {len(pieces)} pieces, first after {timing['ttft'] * 1000:.1f} ms, total {timing['total'] * 1000:.1f} ms")
+    assert len(pieces) > 1 and "".join(pieces) == "Hi! How can I help you today?"
+    assert timing['path'] == "general" and timing['ttft'] <= timing['total']
+    assert len(chatbot.get_conversation_history()) == 2
+    
+    # Form steps arrive in one piece
+    assert len(list(chatbot.get_response_stream("Please call me"))) == 1
+    assert chatbot.last_turn_timing['path'] == "form"
+    
+    print("✅ Response Streaming test completed\n")
+
+def test_routed_history():
+    """Test that turns routed past the agent still see the conversation"""
+    print("🧵 Testing Routed Follow-ups...")
+    
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None)
+    processor.ingest_files([UploadedFile("hours.txt", b"Our office hours are 9am to 5pm on weekdays. "
+                                                       b"On fridays the office closes at 3pm.")])
+    chatbot = ChatBot("test-key", document_processor=processor, form_handler=FormHandler(), cache_answers=False)
+    chatbot.llm = GenericFakeChatModel(messages=iter([AIMessage(content="9am to 5pm on weekdays.")] * 3))
+    prompts = []
+    stream = chatbot._stream_llm
+    chatbot._stream_llm = lambda prompt: prompts.append(prompt) or stream(prompt)
+    
+    chatbot.get_response("What are the office hours?")
+    assert chatbot.last_turn_timing['path'] == "document" and "Conversation so far" not in prompts[0]
+    
+    for follow_up, path in (("what did I just ask you?", "general"), ("and the office hours on fridays?", "document")):
+        chatbot.get_response(follow_up)
+        print(f"  '{follow_up}' -> {chatbot.last_turn_timing['path']}")
+        assert chatbot.last_turn_timing['path'] == path
+        assert "Human: What are the office hours?" in prompts[-1] and "AI: 9am to 5pm on weekdays." in prompts[-1]
+    
+    print("✅ Routed Follow-ups test completed\n")
+
+def test_async_chatbot():
+    """Test many conversations served concurrently on one event loop"""
+    print("⚡ Testing Async ChatBot...")
+    
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(latency=0.05), cache_dir=None, hybrid_search=False)
+    processor.ingest_files([UploadedFile("hours.txt", b"Our office hours are 9am to 5pm on weekdays.")])
+    
+    chatbots = []
+    for i in range(20):
+        chatbot = ChatBot("test-key", document_processor=processor, cache_answers=False)
+        chatbot.llm = GenericFakeChatModel(messages=iter([AIMessage(content=f"Answer {i}")]))
+        chatbots.append(chatbot)
+    
+    async def converse():
+        return await asyncio.gather(*[
+            chatbot.aget_response(f"Summarize the document, question {i}") for i, chatbot in enumerate(chatbots)
+        ])
+    
+    answers = asyncio.run(converse())
+    print(f"  {len(answers)} concurrent answers, e.g. {answers[0]!r}")
+    assert answers == [f"Answer {i}" for i in range(20)]
+    assert all(chatbot.last_turn_timing['path'] == "document" for chatbot in chatbots)
+    assert all(len(chatbot.get_conversation_history()) == 2 for chatbot in chatbots)
+    
+    # Form steps block on the appointment store, so they run off the event loop
+    def slow_step(user_input):
+        time.sleep(0.2)
+        return f"Got {user_input}"
+    form_bots = []
+    for _ in range(4):
+        form_handler = FormHandler()
+        form_handler.start_form_collection()
+        form_handler.process_form_input = slow_step
+        form_bots.append(ChatBot("test-key", form_handler=form_handler, cache_answers=False))
+    
+    async def fill_forms():
+        return await asyncio.gather(*[chatbot.aget_response("Jane Doe") for chatbot in form_bots])
+    
+    start = time.perf_counter()
+    assert asyncio.run(fill_forms()) == ["Got Jane Doe"] * 4
+    assert time.perf_counter() - start < 0.6
+    
+    print("✅ Async ChatBot test completed\n")
+
+def test_answer_cache():
+    """Test that reworded questions reuse answers until the documents change"""
+    print("💾 Testing Semantic Answer Cache...")
+    
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None)
+    processor.ingest_files([UploadedFile("hours.txt", b"Our office hours are 9am to 5pm on weekdays. "
+                                                      b"On fridays the office closes at 3pm.")])
+    cache = SemanticAnswerCache(threshold=0.8)
+    
+    def session(*answers):
+        chatbot = ChatBot("test-key", document_processor=processor, answer_cache=cache)
+        chatbot.llm = GenericFakeChatModel(messages=iter([AIMessage(content=answer) for answer in answers]))
+        return chatbot
+    
+    # Opening questions are shared between sessions
+    assert session("9am to 5pm.").get_response("What are the office hours?") == "9am to 5pm."
+    chatbot = session()
+    assert chatbot.get_response("what are the office hours") == "9am to 5pm."
+    assert chatbot.last_turn_timing['path'] == "cache"
+    
+    # New documents mean a new scope, so the old answer is not served
+    processor.ingest_files([UploadedFile("hours.txt", b"Our office hours are 8am to 4pm on weekdays. "
+                                                      b"On fridays the office closes at 3pm.")])
+    chatbot = session("8am to 4pm.")
+    assert chatbot.get_response("What are the office hours?") == "8am to 4pm."
+    print(f"  Stats: {cache.stats()}")
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+    
+    # Answers shaped by what a user said earlier stay in that user's conversation
+    alice = session("Nice to meet you, Alice.", "Alice, on fridays we close at 3pm.")
+    alice.get_response("Hello, I am Alice")
+    assert alice.get_response("and the office hours on fridays?") == "Alice, on fridays we close at 3pm."
+    assert alice.get_response("and the office hours on fridays?") == "Alice, on fridays we close at 3pm."
+    assert alice.last_turn_timing['path'] == "cache"
+    bob = session("On fridays we close at 3pm.")
+    assert bob.get_response("and the office hours on fridays?") == "On fridays we close at 3pm."
+    assert bob.last_turn_timing['path'] == "document"
+    
+    # General answers are cached too, matched by their text
+    assert session("Hi! How can I help?").get_response("Good morning!") == "Hi! How can I help?"
+    chatbot = session()
+    assert chatbot.get_response("good morning") == "Hi! How can I help?"
+    assert chatbot.last_turn_timing['path'] == "cache"
+
+    # Turns answered by BM25 alone are cached and matched by text, never embedded
+    processor.ingest_files([UploadedFile("codes.txt", b"In the policy, code PN-4471 covers accidental damage to rented equipment.")])
+    chatbot.llm = GenericFakeChatModel(messages=iter([AIMessage(content="Accidental damage.")]))
+    calls = processor.embeddings.calls
+    assert chatbot.get_response("PN-4471 in the policy") == "Accidental damage."
+    assert chatbot.get_response("pn-4471 in the policy") == "Accidental damage."
+    assert chatbot.last_turn_timing['path'] == "cache"
+    assert processor.embeddings.calls == calls
+
+    # Least recently used entries go once the memory cap is reached
+    small = SemanticAnswerCache(max_bytes=3000)
+    for i in range(10):
+        small.put(('general',), f"question {i}", FakeEmbeddings().embed_query(f"question {i}"), "x" * 100)
+    assert small.stats()['bytes'] <= 3000 and small.stats()['evictions'] > 0
+    
+    print("✅ Semantic Answer Cache test completed\n")
+
+def test_conversation_memory():
+    """Test that old turns fold into a summary and the transcript is shared with the UI"""
+    print("🧠 Testing Conversation Memory...")
+    
+    transcript = []
+    greetings = ["hello", "hi there", "good morning", "thanks", "how are you"]
+    chatbot = ChatBot("test-key", cache_answers=False, memory_mode="summary", transcript=transcript,
+                      max_history_turns=2, max_history_tokens=300)
+    chatbot.llm = GenericFakeChatModel(messages=iter([AIMessage(content=f"Answer {i}.") for i in range(len(greetings))]))
+    chatbot.memory.llm = GenericFakeChatModel(messages=iter([AIMessage(content="The user greeted twice.")]))
+    
+    for greeting in greetings:
+        chatbot.get_response(greeting)
+        assert chatbot.last_turn_timing['path'] == "general"
+        assert chatbot.last_turn_timing['prompt_tokens'] > 0
+    
+    # Every turn lands in the caller's list; only the last two stay verbatim
+    assert len(transcript) == 10 and transcript[-1] == {'role': 'assistant', 'content': "Answer 4."}
+    history = chatbot.memory.buffer_as_messages
+    print(f"  History: {len(history)} messages, {chatbot.history_tokens()} tokens")
+    assert history[0].content.endswith("The user greeted twice.")
+    assert [message.content for message in history[-2:]] == ["how are you", "Answer 4."]
+    assert chatbot.history_tokens() <= 300
+    
+    chatbot.reset_conversation()
+    assert transcript == [] and chatbot.history_tokens() == 0
+    
+    print("✅ Conversation Memory test completed\n")
+
+def test_retriever_swap():
+    """Test that documents can be added mid-conversation without losing memory"""
+    print("🔁 Testing Retriever Hot-Swap...")
+    
+    chatbot = ChatBot("test-key", cache_answers=False)
+    chatbot.llm = GenericFakeChatModel(messages=iter([
+        AIMessage(content="Hello!"), AIMessage(content="9am to 5pm."), AIMessage(content="Until 3pm.")
+    ]))
+    chatbot.get_response("hello")
+    assert [tool.name for tool in chatbot.tools] == ["GeneralChat"]
+    
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None)
+    processor.ingest_files([UploadedFile("hours.txt", b"Our office hours are 9am to 5pm on weekdays.")])
+    llm = chatbot.llm
+    chatbot.set_document_processor(processor)
+    assert "DocumentQA" in [tool.name for tool in chatbot.tools] and chatbot.llm is llm
+    
+    assert chatbot.get_response("What does the document say about office hours?") == "9am to 5pm."
+    assert chatbot.last_turn_timing['path'] == "document"
+    
+    # A replacement index takes effect on the next turn; the conversation carries on
+    updated = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None)
+    updated.ingest_files([UploadedFile("hours.txt", b"On Fridays the office hours end at 3pm.")])
+    chatbot.set_document_processor(updated)
+    chatbot.get_response("What does the document say about Fridays?")
+    assert chatbot.document_processor is updated
+    assert len(chatbot.get_conversation_history()) == 6
+    
+    print("✅ Retriever Hot-Swap test completed\n")
+
+def test_query_batcher():
+    """Test that concurrent query embeddings are sent as shared batches"""
+    print("📨 Testing Query Embedding Batcher...")
+    
+    backend = FakeQueryBackend(latency=0.02)
+    batcher = QueryEmbeddingBatcher(backend, max_batch_size=16, max_wait=0.01)
+    queries = [f"question number {i % 24}" for i in range(48)]
+    
+    with ThreadPoolExecutor(max_workers=48) as pool:
+        vectors = list(pool.map(batcher.embed_query, queries))
+    
+    stats = batcher.stats()
+    print(f"  Stats: {stats}, backend calls: {backend.embeddings.calls}")
+    assert vectors == FakeEmbeddings().embed_documents(queries)
+    assert stats['requests'] == 48 and stats['batches'] < 48 and backend.embeddings.calls == stats['batches']
+    
+    # Retrieval goes through an injected batcher, sync and async
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None, hybrid_search=False,
+                                  query_batcher=batcher)
+    processor.ingest_files([UploadedFile("hours.txt", b"Our office hours are 9am to 5pm on weekdays.")])
+    assert processor.get_relevant_documents("When is the office open?")
+    assert asyncio.run(processor.aget_relevant_documents("Is the office open on weekdays?"))
+    assert batcher.stats()['requests'] == 50
+    
+    print("✅ Query Embedding Batcher test completed\n")
+
+def test_metrics():
+    """Test per-turn spans, token counts and the JSON/Prometheus exports"""
+    print("📈 Testing Metrics...")
+    
+    metrics = Metrics()
+    processor = DocumentProcessor("test-key", embeddings=FakeEmbeddings(), cache_dir=None, hybrid_search=False,
+                                  metrics=metrics)
+    processor.ingest_files([UploadedFile("hours.txt", b"Our office hours are 9am to 5pm on weekdays.")])
+    chatbot = ChatBot("test-key", document_processor=processor, form_handler=FormHandler(), cache_answers=False,
+                      metrics=metrics)
+    chatbot.llm = GenericFakeChatModel(messages=iter([AIMessage(content="From 9am to 5pm.")]))
+    
+    chatbot.get_response("What does the document say about office hours?")
+    names = [span['name'] for span in chatbot.last_turn_spans]
+    print(f"  Spans: {names}")
+    assert names[0] == "route" and names[-1] == "turn"
+    assert {"embed_query", "vector_search", "llm"} <= set(names)
+    llm_span = next(span for span in chatbot.last_turn_spans if span['name'] == "llm")
+    assert llm_span['prompt_tokens'] > 0 and llm_span['completion_tokens'] > 0
+    
+    chatbot.get_response("call me")
+    assert [span['name'] for span in chatbot.last_turn_spans] == ["route", "form", "turn"]
+    
+    exported = metrics.to_dict()
+    assert exported['spans']['turn']['count'] == 2 and 'p95' in exported['spans']['llm']
+    prometheus = metrics.to_prometheus()
+    assert 'chatbot_span_seconds_bucket{span="llm",le="+Inf"} 1' in prometheus
+    assert 'chatbot_tokens_total{kind="completion"}' in prometheus
+    
+    print("✅ Metrics test completed\n")
+
+def test_lazy_imports():
+    """Test that the package and the chatbot load heavy dependencies only when needed"""
+    print("💤 Testing Lazy Imports...")
+    
+    script = (
+        "import sys, utils\n"
+        "from utils import FormHandler\n"
+        "assert 'langchain' not in sys.modules and 'streamlit' not in sys.modules\n"
+        "from utils import ChatBot\n"
+        "chatbot = ChatBot('test-key', cache_answers=False)\n"
+        "assert 'langchain_google_genai' not in sys.modules and chatbot._agent is None\n"
+    )
+    subprocess.run([sys.executable, "-W", "ignore", "-c", script], check=True)
+    
+    print("✅ Lazy Imports test completed\n")
+
 def test_environment():
     """Test environment setup"""
     print("🔧 Testing Environment...")
@@ -94,11 +1088,33 @@ def main():
     test_environment()
     test_date_extractor()
     test_form_handler()
+    test_validators()
+    test_appointment_store()
+    test_availability()
+    test_session_state()
+    test_file_parsers()
+    test_embedding_pipeline()
+    test_chunk_deduplicator()
+    test_document_processor()
+    test_ivf_streaming()
+    test_index_tombstones()
+    test_shared_index()
+    test_context_builder()
+    test_intent_router()
+    test_response_streaming()
+    test_routed_history()
+    test_async_chatbot()
+    test_answer_cache()
+    test_conversation_memory()
+    test_retriever_swap()
+    test_query_batcher()
+    test_metrics()
+    test_lazy_imports()
     
     print("🎉 All tests completed!")
     print("\nNext steps:")
     print("1. Make sure you have your Google Gemini API key")
-    print("2. Run: streamlit run app.py")
+    print("2. Run: streamlit run server.py")
     print("3. Upload some documents and start chatting!")
 
 if __name__ == "__main__":
@@ -7,18 +7,35 @@ This package contains the core modules for the ML chatbot application:
 - chatbot: Main chatbot logic and agent orchestration  
 - form_handler: Conversational form collection and validation
 - date_extractor: Natural language date parsing and validation
+
+Submodules are imported on first attribute access, so importing one light
+module (e.g. utils.date_extractor) does not pull in LangChain, FAISS and
+Streamlit through the package.
 """
 
-from .document_processor import DocumentProcessor
-from .chatbot import ChatBot
-from .form_handler import FormHandler
-from .date_extractor import DateExtractor
-
-__all__ = [
-    'DocumentProcessor',
-    'ChatBot', 
-    'FormHandler',
-    'DateExtractor'
-]
+import importlib
+
+# Public name -> submodule that defines it
+_EXPORTS = {
+    'DocumentProcessor': 'document_processor',
+    'ChatBot': 'chatbot',
+    'FormHandler': 'form_handler',
+    'DateExtractor': 'date_extractor'
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
 
 __version__ = "1.0.0"
\ No newline at end of file
@@ -0,0 +1,170 @@
+# utils/ann_index.py
+"""
+FAISS index construction for the document store.
+
+Index types map to faiss.index_factory descriptions:
+- flat:      exact brute-force search (LangChain's default)
+- sq8:       exact scan over 8-bit scalar-quantized vectors (4x smaller)
+- hnsw:      graph-based ANN, fastest queries, highest memory
+- hnsw_sq8:  HNSW graph over 8-bit vectors
+- ivf:       inverted lists over k-means cells, full vectors
+- ivf_sq8:   inverted lists over 8-bit vectors
+- ivf_pq:    inverted lists with product quantization (tens of bytes per vector)
+
+HNSW and IVF types are wrapped in an IndexIDMap, so vectors are addressed by
+label rather than position and can be tombstoned instead of removed.
+"""
+
+import math
+import faiss
+import numpy as np
+
+INDEX_TYPES = ('flat', 'sq8', 'hnsw', 'hnsw_sq8', 'ivf', 'ivf_sq8', 'ivf_pq')
+
+# (max vectors, index type) in increasing corpus size
+AUTO_THRESHOLDS = (
+    (20000, 'flat'),
+    (100000, 'hnsw'),
+    (1000000, 'ivf_sq8'),
+)
+
+# IVF types are only trained once there are enough vectors for this many lists;
+# smaller corpora stay in a flat index until then
+MIN_IVF_LISTS = 64
+TRAINING_POINTS_PER_CENTROID = 39
+
+def choose_index_type(num_vectors):
+    """Pick an index type appropriate for the corpus size"""
+    for max_vectors, index_type in AUTO_THRESHOLDS:
+        if num_vectors < max_vectors:
+            return index_type
+    return 'ivf_pq'
+
+def factory_string(index_type, dimensions, num_vectors, hnsw_m=32, nlist=None, pq_m=None, pq_bits=8):
+    """Build the faiss.index_factory description for an index type"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose from: {', '.join(INDEX_TYPES)}")
+
+    if index_type == 'flat':
+        return "Flat"
+    if index_type == 'sq8':
+        return "SQ8"
+    if index_type == 'hnsw':
+        return f"HNSW{hnsw_m}"
+    if index_type == 'hnsw_sq8':
+        return f"HNSW{hnsw_m}_SQ8"
+
+    nlist = ivf_lists(num_vectors, nlist)
+
+    if index_type == 'ivf':
+        return f"IVF{nlist},Flat"
+    if index_type == 'ivf_sq8':
+        return f"IVF{nlist},SQ8"
+
+    # ivf_pq: sub-quantizer count must divide the dimension; default to ~8 dims per code
+    pq_m = pq_m or _largest_divisor_at_most(dimensions, max(1, dimensions // 8))
+    pq_bits = max(1, min(pq_bits, int(math.log2(max(num_vectors // TRAINING_POINTS_PER_CENTROID, 2)))))
+    return f"IVF{nlist},PQ{pq_m}x{pq_bits}"
+
+def ivf_lists(num_vectors, nlist=None):
+    """Inverted list count for a corpus: nlist (default 4 * sqrt(n)), capped by what n vectors can train"""
+    # k-means wants ~39 training points per centroid
+    nlist = nlist or int(4 * math.sqrt(max(num_vectors, 1)))
+    return max(1, min(nlist, num_vectors // TRAINING_POINTS_PER_CENTROID or 1))
+
+def training_size(index_type, nlist=None, pq_bits=8, **params):
+    """Vectors needed before index_type is worth training (0 if it needs no training)"""
+    if not index_type.startswith('ivf'):
+        return 0
+    size = TRAINING_POINTS_PER_CENTROID * min(nlist or MIN_IVF_LISTS, MIN_IVF_LISTS)
+    if index_type == 'ivf_pq':
+        # Each PQ sub-quantizer is a k-means over 2**pq_bits centroids
+        size = max(size, TRAINING_POINTS_PER_CENTROID * 2 ** pq_bits)
+    return size
+
+def build_index(vectors, index_type='auto', **params):
+    """Create and train an empty index suited to the given vectors.
+
+    The vectors are only used for training; callers add them afterwards.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    num_vectors, dimensions = vectors.shape
+    if index_type == 'auto':
+        index_type = choose_index_type(num_vectors)
+
+    index = faiss.index_factory(dimensions, factory_string(index_type, dimensions, num_vectors, **params))
+    if not index.is_trained:
+        index.train(vectors)
+    if not removes_in_place(index):
+        index = faiss.IndexIDMap(index)
+    return index
+
+def base_index(index):
+    """The index inside an IndexIDMap wrapper, or the index itself"""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+def labels_of(index):
+    """Every label stored in an ID-mapped index, tombstoned or not"""
+    return faiss.vector_to_array(index.id_map)
+
+def index_type_of(index):
+    """Best-effort reverse mapping from a faiss index object to an index type name"""
+    index = base_index(index)
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw_sq8'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return 'ivf_sq8'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return 'sq8'
+    return 'flat'
+
+def list_count(index):
+    """nlist of an IVF index, None for other types"""
+    index = base_index(index)
+    return index.nlist if isinstance(index, faiss.IndexIVF) else None
+
+def removes_in_place(index):
+    """Whether remove_ids compacts positions the way LangChain's FAISS.delete expects.
+
+    Flat-code indexes shift later vectors down; IVF removal scans every list
+    and HNSW cannot remove at all, so those are ID-mapped and tombstoned.
+    """
+    return isinstance(index, faiss.IndexFlatCodes)
+
+def tune_index(index, nprobe=None, ef_search=None):
+    """Apply recall/latency knobs that make sense for this index type"""
+    index = base_index(index)
+    parameters = faiss.ParameterSpace()
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        parameters.set_index_parameter(index, 'nprobe', min(nprobe, index.nlist))
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        parameters.set_index_parameter(index, 'efSearch', ef_search)
+
+def search_excluding(index, labels):
+    """SearchParameters that skip labels of an ID-mapped index, keeping its tuned nprobe/efSearch"""
+    # The parameters hold references to the selectors, so they live as long as it does
+    selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.fromiter(labels, dtype=np.int64)))
+    base = base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def index_memory_bytes(index):
+    """Approximate in-memory size of an index (its serialized size)"""
+    return int(faiss.serialize_index(index).nbytes)
+
+def _largest_divisor_at_most(number, limit):
+    for candidate in range(limit, 0, -1):
+        if number % candidate == 0:
+            return candidate
+    return 1
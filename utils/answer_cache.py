@@ -0,0 +1,146 @@
+# utils/answer_cache.py
+import threading
+from collections import OrderedDict
+import numpy as np
+from .query_cache import normalize_query
+
+# Rough per-entry bookkeeping cost on top of the vector and strings
+_ENTRY_OVERHEAD = 256
+
+
+class SemanticAnswerCache:
+    """LLM answers looked up by question text or meaning.
+
+    get_exact finds a question asked before in the same normalized wording,
+    with no embedding needed. get hits when a cached question's embedding
+    has cosine similarity of at least threshold with the new one; entries
+    stored without an embedding only match exactly. Entries live in scopes (for
+    example one per document index version), so answers never leak across
+    indexes or survive a rebuild. Least recently used entries are evicted
+    once the cache holds more than max_bytes.
+    """
+
+    def __init__(self, threshold=0.92, max_bytes=32 * 1024 ** 2):
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # entry id -> (scope, query, answer, nbytes)
+        self._scopes = {}              # scope -> {entry id: unit vector}
+        self._matrices = {}            # scope -> (entry ids, stacked vectors), dropped on change
+        self._exact = {}               # (scope, normalized query) -> entry id
+        self._bytes = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get_exact(self, scope, query):
+        """Return the answer to the same normalized question, or None.
+
+        Only hits are counted, since a miss here is normally followed by get.
+        """
+        with self._lock:
+            entry_id = self._exact.get((scope, normalize_query(query)))
+            if entry_id is None:
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return self._entries[entry_id][2]
+
+    def get(self, scope, embedding):
+        """Return (answer, similarity) for the closest cached question, or None.
+
+        Without an embedding there is nothing to compare, so it is a miss.
+        """
+        if embedding is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        vector = self._unit(embedding)
+        with self._lock:
+            ids, matrix = self._matrix(scope)
+            if ids:
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    return self._entries[ids[best]][2], float(similarities[best])
+            self.misses += 1
+            return None
+
+    def put(self, scope, query, embedding, answer):
+        """Cache an answer to query under scope; embedding may be None (exact matches only)"""
+        vector = self._unit(embedding) if embedding is not None else None
+        nbytes = (vector.nbytes if vector is not None else 0) + len(query.encode()) + len(answer.encode()) + _ENTRY_OVERHEAD
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            key = (scope, normalize_query(query))
+            if key in self._exact:
+                self._remove(self._exact[key])
+            self._entries[entry_id] = (scope, query, answer, nbytes)
+            self._exact[key] = entry_id
+            if vector is not None:
+                self._scopes.setdefault(scope, {})[entry_id] = vector
+                self._matrices.pop(scope, None)
+            self._bytes += nbytes
+
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, entry_id):
+        scope, query, _, nbytes = self._entries.pop(entry_id)
+        del self._exact[(scope, normalize_query(query))]
+        vectors = self._scopes.get(scope, {})
+        if vectors.pop(entry_id, None) is not None:
+            if not vectors:
+                del self._scopes[scope]
+            self._matrices.pop(scope, None)
+        self._bytes -= nbytes
+
+    def _matrix(self, scope):
+        if scope not in self._matrices:
+            vectors = self._scopes.get(scope, {})
+            ids = list(vectors)
+            self._matrices[scope] = (ids, np.stack([vectors[i] for i in ids]) if ids else None)
+        return self._matrices[scope]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._exact.clear()
+            self._scopes.clear()
+            self._matrices.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss counters, size and memory use"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'bytes': self._bytes,
+                'evictions': self.evictions
+            }
+
+
+# Scopes keep sessions' private documents apart, so the answer cache can be process-wide
+_answer_cache = SemanticAnswerCache()
+
+def get_answer_cache():
+    """Return the process-wide semantic answer cache"""
+    return _answer_cache
@@ -0,0 +1,264 @@
+# utils/appointment_store.py
+"""
+Persistent appointment bookings in SQLite.
+
+The database runs in WAL mode, so readers never block the writer or each
+other. Every session's bookings go through one writer thread, which groups
+whatever is waiting into a single transaction (group commit). Concurrent
+sessions therefore never contend for the write lock, and a burst of
+bookings costs one fsync instead of one each. Reads use one connection per
+thread.
+
+A booking submitted with a capacity is only inserted if its slot holds fewer
+bookings than that. The count runs inside the writer's BEGIN IMMEDIATE
+transaction, so it also sees bookings from other processes and imports,
+and none can land between the check and the insert.
+"""
+
+import re
+import time
+import sqlite3
+import threading
+from concurrent.futures import Future
+from .validators import get_validators
+
+COLUMNS = ('name', 'phone', 'email', 'appointment_date', 'appointment_time', 'purpose')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS appointments (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    phone TEXT,
+    email TEXT,
+    appointment_date TEXT,      -- YYYY-MM-DD
+    appointment_time TEXT,      -- as the user gave it, e.g. "2:30 PM"
+    sort_time TEXT,             -- HH:MM, so a day's calls list in order
+    purpose TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS appointments_when ON appointments (appointment_date, sort_time);
+CREATE INDEX IF NOT EXISTS appointments_email ON appointments (email);
+CREATE INDEX IF NOT EXISTS appointments_phone ON appointments (phone);
+"""
+
+_TIME = re.compile(r'^(\d{1,2})(?::(\d{2}))?\s?(AM|PM)?$', re.IGNORECASE)
+
+
+def sort_time(text):
+    """'2:30 PM' / '14:30' / '2 PM' -> '14:30'; None if unrecognized"""
+    match = _TIME.match((text or "").strip())
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), (match.group(3) or "").upper()
+    if meridiem == 'PM' and hour < 12:
+        hour += 12
+    elif meridiem == 'AM' and hour == 12:
+        hour = 0
+    return f"{hour:02d}:{minute:02d}"
+
+
+class SlotTaken(Exception):
+    """The requested slot already holds as many bookings as its capacity allows"""
+
+
+def normalize_phone(phone):
+    """Phone as the validators format it ('202-555-0143' -> '(202) 555-0143'); unparseable ones just stripped"""
+    if not phone:
+        return phone
+    normalized, error = get_validators().validate_phone(phone)
+    return phone.strip() if error else normalized
+
+
+class AppointmentStore:
+    """Appointment repository with batched writes and indexed range queries"""
+
+    def __init__(self, path="appointments.db", batch_size=256, max_wait=0.002):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.writes = 0
+        self.transactions = 0
+        self._pending = []  # (row, capacity, future)
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self._closed = False
+
+        self._writer_connection = self._connect()
+        self._writer_connection.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="appointment-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last commits on power loss, never corruption
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _reader(self):
+        """This thread's read connection"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    # Writes
+
+    def submit(self, appointment, capacity=None):
+        """Queue a booking (dict of form fields); returns a Future of its id.
+
+        With a capacity, the Future raises SlotTaken instead if the slot is full.
+        """
+        for column in COLUMNS:
+            value = appointment.get(column)
+            if value is not None and not isinstance(value, str):
+                raise TypeError(f"{column} must be a string, not {type(value).__name__}")
+        # Imports may carry phones in any format; store them the way lookups will ask
+        row = tuple(normalize_phone(appointment.get(column)) if column == 'phone' else appointment.get(column)
+                    for column in COLUMNS)
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Appointment store is closed")
+            self._pending.append((row, capacity, future))
+            self._condition.notify()
+        return future
+
+    def add(self, appointment, capacity=None):
+        """Save a booking and return its id once it is committed (SlotTaken if the slot is full)"""
+        return self.submit(appointment, capacity).result()
+
+    def add_many(self, appointments):
+        """Save many bookings (e.g. an import); returns their ids in order"""
+        futures = [self.submit(appointment) for appointment in appointments]
+        return [future.result() for future in futures]
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                # Give concurrent sessions a moment to join this transaction
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+            self._write(batch)
+
+    def _write(self, batch):
+        now = time.time()
+        results = []
+        try:
+            with self._writer_connection as connection:
+                # Take the write lock before counting, so no other process can fill a slot in between
+                connection.execute("BEGIN IMMEDIATE")
+                for row, capacity, _ in batch:
+                    try:
+                        results.append(self._insert(connection, row, capacity, now))
+                    except sqlite3.OperationalError:
+                        # Locking or I/O trouble spoils the whole transaction
+                        raise
+                    except Exception as e:
+                        # A bad row (full slot, constraint violation) fails alone; the rest still commit
+                        results.append(e)
+        except Exception as e:
+            # Whatever went wrong, every waiting session hears about it and the writer keeps running
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.writes += sum(not isinstance(result, Exception) for result in results)
+        self.transactions += 1
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _insert(connection, row, capacity, now):
+        """Insert one row inside the writer's transaction; returns its id (SlotTaken if the slot is full)"""
+        start = sort_time(row[4])
+        if capacity is not None and start is not None and connection.execute(
+            "SELECT COUNT(*) FROM appointments WHERE appointment_date = ? AND sort_time = ?",
+            (row[3], start)
+        ).fetchone()[0] >= capacity:
+            raise SlotTaken(f"{row[3]} {start} is fully booked")
+        return connection.execute(
+            "INSERT INTO appointments (name, phone, email, appointment_date, appointment_time, "
+            "purpose, sort_time, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            row + (start, now)
+        ).lastrowid
+
+    # Reads
+
+    def _query(self, where, params, limit=None):
+        sql = f"SELECT * FROM appointments WHERE {where} ORDER BY appointment_date, sort_time, id"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self._reader().execute(sql, params)]
+
+    def get(self, appointment_id):
+        rows = self._query("id = ?", (appointment_id,))
+        return rows[0] if rows else None
+
+    def on_date(self, date):
+        """All bookings on a YYYY-MM-DD date, in time order"""
+        return self._query("appointment_date = ?", (date,))
+
+    def between(self, start_date, end_date, limit=None):
+        """Bookings from start_date to end_date inclusive"""
+        return self._query("appointment_date BETWEEN ? AND ?", (start_date, end_date), limit)
+
+    def by_email(self, email):
+        return self._query("email = ?", (email.strip().lower(),))
+
+    def by_phone(self, phone):
+        """Bookings for a phone number in any format the validators accept"""
+        return self._query("phone = ?", (normalize_phone(phone),))
+
+    def slot_counts(self, start_date):
+        """(date, HH:MM, bookings) for every booked time from start_date on"""
+        return self._reader().execute(
+            "SELECT appointment_date, sort_time, COUNT(*) FROM appointments "
+            "WHERE appointment_date >= ? AND sort_time IS NOT NULL "
+            "GROUP BY appointment_date, sort_time",
+            (start_date,)
+        ).fetchall()
+
+    def count(self):
+        return self._reader().execute("SELECT COUNT(*) FROM appointments").fetchone()[0]
+
+    def stats(self):
+        return {
+            'writes': self.writes,
+            'transactions': self.transactions,
+            'rows_per_transaction': self.writes / self.transactions if self.transactions else 0.0
+        }
+
+    def close(self):
+        """Commit what is queued and stop the writer"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._writer.join()
+        self._writer_connection.close()
+
+
+# Sessions share one store (and writer thread) per database file
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_appointment_store(path="appointments.db"):
+    """Return the process-wide store for path"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = AppointmentStore(path)
+        return _stores[path]
@@ -0,0 +1,157 @@
+# utils/availability.py
+"""
+Bookable call slots: business hours, staff capacity and existing bookings.
+
+Each business day is split into fixed slots (30 minutes by default) and
+holds one array of booking counts, so checking a slot is a single index
+lookup however many appointments are loaded. A slot is free while its count
+is below the number of staff. Counts are loaded from the appointment store
+with one grouped, indexed query.
+
+The counts are a cache for conflict checks and suggestions. Other workers
+and imports write to the same database without updating them, so the
+appointment store enforces capacity when it inserts (see
+AppointmentStore.submit). When it rejects a slot, the engine is reloaded.
+"""
+
+import threading
+from array import array
+from datetime import date, datetime, time, timedelta
+from .appointment_store import get_appointment_store
+
+WORKDAYS = (0, 1, 2, 3, 4)  # Monday to Friday
+
+
+def _minutes(hhmm):
+    hour, minute = hhmm.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def format_slot(day, start):
+    """('2024-01-15', '14:30') -> 'Monday, January 15 at 2:30 PM'"""
+    when = datetime.combine(date.fromisoformat(day), time.fromisoformat(start))
+    return f"{when.strftime('%A, %B')} {when.day} at {when.strftime('%I:%M %p').lstrip('0')}"
+
+
+class AvailabilityEngine:
+    """Per-day slot occupancy with conflict checks and nearest-free-slot search"""
+
+    def __init__(self, open_time="09:00", close_time="17:00", slot_minutes=30, capacity=1,
+                 workdays=WORKDAYS, holidays=()):
+        self.open_minute = _minutes(open_time)
+        self.close_minute = _minutes(close_time)
+        self.slot_minutes = slot_minutes
+        self.slots_per_day = (self.close_minute - self.open_minute) // slot_minutes
+        self.capacity = capacity
+        self.workdays = frozenset(workdays)
+        self.holidays = frozenset(holidays)  # YYYY-MM-DD
+        self._days = {}  # YYYY-MM-DD -> array of booking counts, one per slot
+        self._lock = threading.Lock()
+
+    def load(self, store, start_date=None):
+        """Replace the counts with the store's bookings from start_date (today) on"""
+        days = {}
+        for day, start, count in store.slot_counts(start_date or date.today().isoformat()):
+            index = self._slot_index(start)
+            if index is not None:
+                counts = days.setdefault(day, array('H', bytes(2 * self.slots_per_day)))
+                counts[index] = min(counts[index] + count, 0xFFFF)
+        with self._lock:
+            self._days = days
+        return self
+
+    def _slot_index(self, start):
+        """Slot containing an HH:MM start time, or None outside business hours"""
+        offset = _minutes(start) - self.open_minute
+        if offset < 0 or offset >= self.slots_per_day * self.slot_minutes:
+            return None
+        return offset // self.slot_minutes
+
+    def _slot_start(self, index):
+        minute = self.open_minute + index * self.slot_minutes
+        return f"{minute // 60:02d}:{minute % 60:02d}"
+
+    def is_open(self, day):
+        return date.fromisoformat(day).weekday() in self.workdays and day not in self.holidays
+
+    def check(self, day, start):
+        """None if (YYYY-MM-DD, HH:MM) can be booked, otherwise the reason it cannot"""
+        if not self.is_open(day):
+            return "we're closed that day"
+        index = self._slot_index(start)
+        if index is None:
+            return f"that's outside our hours ({self._slot_start(0)} to {self.close_minute // 60:02d}:{self.close_minute % 60:02d})"
+        if (_minutes(start) - self.open_minute) % self.slot_minutes:
+            return f"calls start every {self.slot_minutes} minutes from {self._slot_start(0)}"
+        if datetime.combine(date.fromisoformat(day), time.fromisoformat(start)) <= datetime.now():
+            return "that time has already passed"
+        counts = self._days.get(day)
+        if counts is not None and counts[index] >= self.capacity:
+            return "that slot is already booked"
+        return None
+
+    def is_free(self, day, start):
+        return self.check(day, start) is None
+
+    def record(self, day, start):
+        """Count a booking the store has committed"""
+        index = self._slot_index(start)
+        if index is None:
+            return
+        with self._lock:
+            counts = self._days.setdefault(day, array('H', bytes(2 * self.slots_per_day)))
+            counts[index] = min(counts[index] + 1, 0xFFFF)
+
+    def free_slots(self, day):
+        """HH:MM starts of the free slots on a day, in order"""
+        if not self.is_open(day):
+            return []
+        counts = self._days.get(day)
+        starts = [self._slot_start(i) for i in range(self.slots_per_day)
+                  if counts is None or counts[i] < self.capacity]
+        if day == date.today().isoformat():
+            now = datetime.now().strftime('%H:%M')
+            starts = [start for start in starts if start > now]
+        return starts
+
+    def nearest_free(self, day, start, n=3, horizon_days=14):
+        """Up to n free (YYYY-MM-DD, HH:MM) slots closest to the requested time"""
+        requested_day = date.fromisoformat(day)
+        target = datetime.combine(requested_day, time.fromisoformat(start))
+        today = date.today()
+        found = []
+        for offset in range(horizon_days + 1):
+            for candidate in {requested_day + timedelta(days=offset), requested_day - timedelta(days=offset)}:
+                if candidate < today:
+                    continue
+                candidate_day = candidate.isoformat()
+                for slot in self.free_slots(candidate_day):
+                    distance = abs(datetime.combine(candidate, time.fromisoformat(slot)) - target)
+                    found.append((distance, candidate_day, slot))
+            # Slots on days further out are at least offset days away
+            if len(found) >= n:
+                found.sort()
+                if found[n - 1][0] <= timedelta(days=offset):
+                    break
+        found.sort()
+        return [(candidate_day, slot) for _, candidate_day, slot in found[:n]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'days': len(self._days),
+                'booked_seats': sum(sum(counts) for counts in self._days.values())
+            }
+
+
+# One engine per store, so every session books against the same counts
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_availability(store=None):
+    """Return the process-wide engine for store (the shared appointments.db store by default)"""
+    store = store or get_appointment_store()
+    with _engines_lock:
+        if store.path not in _engines:
+            _engines[store.path] = AvailabilityEngine().load(store)
+        return _engines[store.path]
@@ -1,148 +1,546 @@
 # utils/chatbot.py
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.tools import Tool
-from langchain.agents import initialize_agent, AgentType
 from langchain.memory import ConversationBufferMemory
 from langchain.schema import HumanMessage, AIMessage
+from langchain_core.messages import get_buffer_string
+from .context_builder import ContextBuilder
+from .conversation_memory import TranscriptHistory, RollingSummaryMemory
+from .tokens import estimate_tokens
+from .metrics import get_metrics, MetricsCallbackHandler
+from .intent_router import IntentRouter, BOOKING, DOCUMENT, GENERAL
+from .query_cache import normalize_query
+from .answer_cache import get_answer_cache
 import re
+import time
+import uuid
+import asyncio
+
+NO_DOCUMENTS_ANSWER = "I don't have any relevant information in the uploaded documents to answer this question."
+CHAT_MODEL = "gemini-1.5-flash"
+
+def _history_section(history):
+    """Prompt block with the conversation so far, so routed follow-ups keep their context"""
+    if not history:
+        return ""
+    return f"""
+        Conversation so far (use it to resolve follow-ups like "what about ..." or "what did I ask"):
+        {history}
+        """
 
 class ChatBot:
-    def __init__(self, api_key, document_processor=None, form_handler=None):
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            google_api_key=api_key,
-            temperature=0.7
-        )
+    def __init__(self, api_key, document_processor=None, form_handler=None, context_builder=None, router=None,
+                 answer_cache=None, cache_answers=True, memory_mode="buffer",
+                 max_history_turns=6, max_history_tokens=1500, transcript=None, metrics=None, verbose=False):
+        # The Gemini client and the agent are built on first use (see the llm and agent properties)
+        self._llm = None
+        self._agent = None
         
+        self.api_key = api_key
+        # Print the agent's reasoning steps to stdout (user messages and tool output included)
+        self.verbose = verbose
         self.document_processor = document_processor
         self.form_handler = form_handler
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
+        # Packs retrieved chunks into the DocumentQA prompt within a token budget
+        self.context_builder = context_builder or ContextBuilder()
+        self.last_context_stats = None
+        # Sends obvious turns straight to a tool; unclear ones still go through the agent
+        self.router = router or IntentRouter()
+        # {'path', 'ttft', 'total'} in seconds for the most recent turn, plus its
+        # 'prompt_tokens' and the 'history_tokens' of memory sent along with it
+        self.last_turn_timing = None
+        # Retrievals started ahead of an agent turn, by normalized query
+        self._prefetched = {}
+        # Answers to repeated or reworded questions are reused, skipping the LLM. Entries made
+        # once the conversation has history are kept under this conversation's own key.
+        self.answer_cache = (answer_cache or get_answer_cache()) if cache_answers else None
+        self.conversation_key = uuid.uuid4().hex
+        self.memory = self._create_memory(memory_mode, max_history_turns, max_history_tokens, transcript)
         
-        # Initialize agent with tools
+        # Spans for routing, form steps, LLM calls and agent iterations, with token counts;
+        # last_turn_spans lists the ones recorded during the most recent turn
+        self.metrics = metrics or get_metrics()
+        self.callbacks = [MetricsCallbackHandler(self.metrics)]
+        self.last_turn_spans = []
+        
+        # Tools are cheap to build; the agent around them is created lazily
         self.tools = self._create_tools()
-        self.agent = self._create_agent()
+    
+    @property
+    def llm(self):
+        """Gemini chat model, created on first use"""
+        if self._llm is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            self.llm = ChatGoogleGenerativeAI(
+                model=CHAT_MODEL,
+                google_api_key=self.api_key,
+                temperature=0.7
+            )
+        return self._llm
+    
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+        # The agent is bound to the model it was built with
+        self._agent = None
+        if isinstance(self.memory, RollingSummaryMemory) and self.memory.llm is None:
+            self.memory.llm = llm
+    
+    @property
+    def agent(self):
+        """ReAct agent over the tools, created on first use"""
+        if self._agent is None:
+            self._agent = self._create_agent()
+        return self._agent
+    
+    def _create_memory(self, memory_mode, max_turns, max_tokens, transcript):
+        """Conversation memory backed by transcript (a list of role/content dicts).
         
+        Passing the list the UI renders from means the chat display and the
+        agent's memory are one buffer. 'summary' mode keeps the last max_turns
+        turns verbatim and folds older ones into a summary within max_tokens;
+        'buffer' mode re-sends the whole conversation every turn.
+        """
+        history = TranscriptHistory(transcript)
+        if memory_mode == "summary":
+            # Summarizes with the chat model once that exists (see the llm setter)
+            return RollingSummaryMemory(
+                chat_memory=history,
+                memory_key="chat_history",
+                return_messages=True,
+                max_turns=max_turns,
+                max_tokens=max_tokens
+            )
+        return ConversationBufferMemory(
+            chat_memory=history,
+            memory_key="chat_history",
+            return_messages=True
+        )
+    
     def _create_tools(self):
         """Create tools for the agent"""
         tools = []
         
         # Document Q&A tool
         if self.document_processor:
-            def document_qa(query: str) -> str:
-                """Answer questions based on uploaded documents"""
-                relevant_docs = self.document_processor.get_relevant_documents(query)
-                
-                if not relevant_docs:
-                    return "I don't have any relevant information in the uploaded documents to answer this question."
-                
-                context = "\n\n".join([doc.page_content for doc in relevant_docs])
-                
-                prompt = f"""
-                Based on the following context from uploaded documents, answer the question:
-                
-                Context:
-                {context}
-                
-                Question: {query}
-                
-                Please provide a comprehensive answer based only on the information provided in the context.
-                If the context doesn't contain enough information to answer the question, say so.
-                """
-                
-                response = self.llm.invoke(prompt)
-                return response.content
-            
             tools.append(Tool(
                 name="DocumentQA",
                 description="Use this tool to answer questions based on uploaded documents",
-                func=document_qa
+                func=self._document_qa,
+                coroutine=self._adocument_qa
             ))
         
         # Appointment booking tool
         if self.form_handler:
-            def book_appointment(query: str) -> str:
-                """Handle appointment booking and form collection"""
-                
-                # Check if user wants to book appointment or be called
-                booking_keywords = ['call me', 'book appointment', 'schedule call', 'contact me', 'arrange call']
-                if any(keyword in query.lower() for keyword in booking_keywords):
-                    if not self.form_handler.is_collecting():
-                        return self.form_handler.start_form_collection()
-                
-                # If currently collecting form data
-                if self.form_handler.is_collecting():
-                    return self.form_handler.process_form_input(query)
-                
-                return "I can help you schedule an appointment. Just say 'call me' or 'book appointment' to get started!"
-            
             tools.append(Tool(
                 name="AppointmentBooking",
                 description="Use this tool when user wants to book an appointment, schedule a call, or be contacted",
-                func=book_appointment
+                func=self._book_appointment
             ))
         
         # General information tool
-        def general_chat(query: str) -> str:
-            """Handle general conversation and questions"""
-            prompt = f"""
-            You are a helpful AI assistant. Answer the following question in a friendly and informative way:
-            
-            Question: {query}
-            
-            Provide a helpful response. If the user seems to want to book an appointment or be contacted, 
-            suggest they can say "call me" or "book appointment".
-            """
-            
-            response = self.llm.invoke(prompt)
-            return response.content
-        
         tools.append(Tool(
             name="GeneralChat",
             description="Use this tool for general conversation and questions not related to documents or appointments",
-            func=general_chat
+            func=self._general_chat,
+            coroutine=self._ageneral_chat
         ))
         
         return tools
     
+    def _document_qa(self, query: str) -> str:
+        """Answer questions based on uploaded documents"""
+        prompt = self._document_prompt(query)
+        if prompt is None:
+            return NO_DOCUMENTS_ANSWER
+        
+        response = self.llm.invoke(prompt, config={'callbacks': self.callbacks})
+        return response.content
+    
+    def _document_prompt(self, query, history=""):
+        """Build the DocumentQA prompt, or None when nothing relevant was retrieved"""
+        scored_docs = self.document_processor.get_scored_documents(query, k=self.context_builder.max_k)
+        
+        if not scored_docs:
+            return None
+        
+        context, self.last_context_stats = self.context_builder.build(scored_docs)
+        return self._qa_prompt(context, query, history)
+    
+    async def _adocument_qa(self, query: str) -> str:
+        """Async DocumentQA tool"""
+        prompt = await self._adocument_prompt(query)
+        if prompt is None:
+            return NO_DOCUMENTS_ANSWER
+        
+        response = await self.llm.ainvoke(prompt, config={'callbacks': self.callbacks})
+        return response.content
+    
+    async def _adocument_prompt(self, query, history=""):
+        """Async _document_prompt; picks up a retrieval already in flight for the same query"""
+        pending = self._prefetched.pop(normalize_query(query), None)
+        if pending is not None:
+            scored_docs = await pending
+        else:
+            scored_docs = await self.document_processor.aget_scored_documents(query, k=self.context_builder.max_k)
+        
+        if not scored_docs:
+            return None
+        
+        context, self.last_context_stats = self.context_builder.build(scored_docs)
+        return self._qa_prompt(context, query, history)
+    
+    @staticmethod
+    def _qa_prompt(context, query, history=""):
+        return f"""
+        Based on the following context from uploaded documents, answer the question:
+        
+        Context:
+        {context}
+        {_history_section(history)}
+        Question: {query}
+        
+        Please provide a comprehensive answer based only on the information provided in the context.
+        If the context doesn't contain enough information to answer the question, say so.
+        """
+    
+    def _book_appointment(self, query: str) -> str:
+        """Handle appointment booking and form collection"""
+        
+        # Check if user wants to book appointment or be called
+        if self.router.match_keywords(query, BOOKING):
+            if not self.form_handler.is_collecting():
+                return self.form_handler.start_form_collection()
+        
+        # If currently collecting form data
+        if self.form_handler.is_collecting():
+            return self.form_handler.process_form_input(query)
+        
+        return "I can help you schedule an appointment. Just say 'call me' or 'book appointment' to get started!"
+    
+    def _general_chat(self, query: str) -> str:
+        """Handle general conversation and questions"""
+        response = self.llm.invoke(self._general_prompt(query), config={'callbacks': self.callbacks})
+        return response.content
+    
+    async def _ageneral_chat(self, query: str) -> str:
+        """Async GeneralChat tool"""
+        response = await self.llm.ainvoke(self._general_prompt(query), config={'callbacks': self.callbacks})
+        return response.content
+    
+    @staticmethod
+    def _general_prompt(query, history=""):
+        return f"""
+        You are a helpful AI assistant. Answer the following question in a friendly and informative way:
+        {_history_section(history)}
+        Question: {query}
+        
+        Provide a helpful response. If the user seems to want to book an appointment or be contacted, 
+        suggest they can say "call me" or "book appointment".
+        """
+    
     def _create_agent(self):
         """Create the conversational agent"""
+        from langchain.agents import initialize_agent, AgentType
+        
         return initialize_agent(
             tools=self.tools,
             llm=self.llm,
             agent=AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
             memory=self.memory,
-            verbose=True,
+            verbose=self.verbose,
             handle_parsing_errors=True
         )
     
     def get_response(self, user_input):
         """Get response from the chatbot"""
-        try:
-            # Check if we're in the middle of form collection
-            if self.form_handler and self.form_handler.is_collecting():
-                response = self.form_handler.process_form_input(user_input)
-                return response
-            
-            # Check for appointment booking intent
-            booking_keywords = ['call me', 'book appointment', 'schedule call', 'contact me', 'arrange call']
-            if any(keyword in user_input.lower() for keyword in booking_keywords):
-                if self.form_handler:
-                    response = self.form_handler.start_form_collection()
-                    return response
+        return "".join(self.get_response_stream(user_input))
+    
+    def get_response_stream(self, user_input):
+        """Yield the response in pieces as the LLM produces them.
+        
+        Routed document and general answers stream token by token; form steps
+        and agent answers arrive in one piece. Time to first token and total
+        time of the turn are left in last_turn_timing.
+        """
+        start = time.perf_counter()
+        timing = self._new_timing()
+        self.last_turn_timing = timing
+        
+        with self.metrics.trace() as spans:
+            self.last_turn_spans = spans
+            pieces = []
+            cache_entry = {}
+            try:
+                for piece in self._response_pieces(user_input, timing, cache_entry):
+                    if not piece:
+                        continue
+                    if timing['ttft'] is None:
+                        timing['ttft'] = time.perf_counter() - start
+                    pieces.append(piece)
+                    yield piece
             
-            # Use agent for other queries
-            response = self.agent.run(input=user_input)
-            return response
+                if timing['path'] != 'agent':
+                    # The agent records its own turns; every other turn is recorded here
+                    self.memory.save_context({'input': user_input}, {'output': "".join(pieces)})
+                self._store_answer(user_input, "".join(pieces), cache_entry)
+                
+            except Exception as e:
+                if timing['ttft'] is None:
+                    timing['ttft'] = time.perf_counter() - start
+                apology = f"I apologize, but I encountered an error: {str(e)}. Please try rephrasing your question."
+                self.memory.chat_memory.add_messages([HumanMessage(content=user_input), AIMessage(content=apology)])
+                yield apology
+            finally:
+                timing['total'] = time.perf_counter() - start
+                self.metrics.record('turn', timing['total'], path=timing['path'])
+    
+    def _response_pieces(self, user_input, timing, cache_entry):
+        # Check if we're in the middle of form collection
+        if self.form_handler and self.form_handler.is_collecting():
+            timing['path'] = 'form'
+            with self.metrics.span('form'):
+                answer = self.form_handler.process_form_input(user_input)
+            yield answer
+            return
+        
+        intent, _, _ = self.route(user_input)
+        
+        # Check for appointment booking intent
+        if intent == BOOKING and self.form_handler:
+            timing['path'] = 'form'
+            with self.metrics.span('form'):
+                answer = self.form_handler.start_form_collection()
+            yield answer
+            return
+        
+        # Obvious document/general turns skip the agent's tool-choosing LLM call.
+        # Routed turns skip the agent, so they carry the conversation themselves.
+        history = self.conversation_history()
+        if intent == DOCUMENT:
+            timing['path'] = DOCUMENT
+            # A question asked before in the same words is answered without retrieval
+            answer = self._exact_answer(user_input, DOCUMENT, history, cache_entry)
+            if answer is None:
+                prompt = self._document_prompt(user_input, history)
+                # Retrieval embedded the question unless BM25 answered it; reuse that vector
+                answer = self._similar_answer(user_input, cache_entry) if prompt else None
+            if answer is not None:
+                timing['path'] = 'cache'
+                yield answer
+            elif prompt is None:
+                yield NO_DOCUMENTS_ANSWER
+            else:
+                timing['prompt_tokens'] = estimate_tokens(prompt)
+                yield from self._stream_llm(prompt)
+                cache_entry['store'] = True
+            return
+        if intent == GENERAL:
+            timing['path'] = GENERAL
+            answer = self._exact_answer(user_input, GENERAL, history, cache_entry)
+            if answer is not None:
+                timing['path'] = 'cache'
+                yield answer
+                return
+            prompt = self._general_prompt(user_input, history)
+            timing['prompt_tokens'] = estimate_tokens(prompt)
+            yield from self._stream_llm(prompt)
+            cache_entry['store'] = True
+            return
+        
+        # Use agent for other queries
+        timing['path'] = 'agent'
+        timing['prompt_tokens'] = timing['history_tokens'] + estimate_tokens(user_input)
+        yield self.agent.run(input=user_input, callbacks=self.callbacks)
+    
+    def _new_timing(self):
+        return {'path': None, 'ttft': None, 'total': None, 'prompt_tokens': None,
+                'history_tokens': self.history_tokens()}
+    
+    def conversation_history(self):
+        """The memory's summary and recent turns as text, as the agent would see them"""
+        return get_buffer_string(self.memory.buffer_as_messages)
+    
+    def history_tokens(self):
+        """Tokens of conversation history sent with each agent or routed prompt"""
+        return sum(estimate_tokens(message.content) for message in self.memory.buffer_as_messages)
+    
+    def _stream_llm(self, prompt):
+        for chunk in self.llm.stream(prompt, config={'callbacks': self.callbacks}):
+            yield chunk.content
+    
+    async def aget_response(self, user_input):
+        """Async get_response; one event loop can serve many conversations"""
+        return "".join([piece async for piece in self.aget_response_stream(user_input)])
+    
+    async def aget_response_stream(self, user_input):
+        """Async get_response_stream, built on the LLM's and embedding client's async APIs"""
+        start = time.perf_counter()
+        timing = self._new_timing()
+        self.last_turn_timing = timing
+        
+        with self.metrics.trace() as spans:
+            self.last_turn_spans = spans
+            pieces = []
+            cache_entry = {}
+            try:
+                async for piece in self._aresponse_pieces(user_input, timing, cache_entry):
+                    if not piece:
+                        continue
+                    if timing['ttft'] is None:
+                        timing['ttft'] = time.perf_counter() - start
+                    pieces.append(piece)
+                    yield piece
             
-        except Exception as e:
-            return f"I apologize, but I encountered an error: {str(e)}. Please try rephrasing your question."
+                if timing['path'] != 'agent':
+                    await self.memory.asave_context({'input': user_input}, {'output': "".join(pieces)})
+                self._store_answer(user_input, "".join(pieces), cache_entry)
+                
+            except Exception as e:
+                if timing['ttft'] is None:
+                    timing['ttft'] = time.perf_counter() - start
+                apology = f"I apologize, but I encountered an error: {str(e)}. Please try rephrasing your question."
+                self.memory.chat_memory.add_messages([HumanMessage(content=user_input), AIMessage(content=apology)])
+                yield apology
+            finally:
+                timing['total'] = time.perf_counter() - start
+                self.metrics.record('turn', timing['total'], path=timing['path'])
+                for pending in self._prefetched.values():
+                    pending.cancel()
+                self._prefetched.clear()
+    
+    async def _aresponse_pieces(self, user_input, timing, cache_entry):
+        if self.form_handler and self.form_handler.is_collecting():
+            timing['path'] = 'form'
+            with self.metrics.span('form'):
+                # The last step waits on the appointment store's SQLite writer; keep the loop free
+                answer = await asyncio.to_thread(self.form_handler.process_form_input, user_input)
+            yield answer
+            return
+        
+        intent, _, _ = self.route(user_input)
+        
+        if intent == BOOKING and self.form_handler:
+            timing['path'] = 'form'
+            with self.metrics.span('form'):
+                answer = self.form_handler.start_form_collection()
+            yield answer
+            return
+        
+        history = self.conversation_history()
+        if intent == DOCUMENT:
+            timing['path'] = DOCUMENT
+            answer = self._exact_answer(user_input, DOCUMENT, history, cache_entry)
+            if answer is None:
+                prompt = await self._adocument_prompt(user_input, history)
+                answer = self._similar_answer(user_input, cache_entry) if prompt else None
+            if answer is not None:
+                timing['path'] = 'cache'
+                yield answer
+            elif prompt is None:
+                yield NO_DOCUMENTS_ANSWER
+            else:
+                timing['prompt_tokens'] = estimate_tokens(prompt)
+                async for piece in self._astream_llm(prompt):
+                    yield piece
+                cache_entry['store'] = True
+            return
+        if intent == GENERAL:
+            timing['path'] = GENERAL
+            answer = self._exact_answer(user_input, GENERAL, history, cache_entry)
+            if answer is not None:
+                timing['path'] = 'cache'
+                yield answer
+                return
+            prompt = self._general_prompt(user_input, history)
+            timing['prompt_tokens'] = estimate_tokens(prompt)
+            async for piece in self._astream_llm(prompt):
+                yield piece
+            cache_entry['store'] = True
+            return
+        
+        timing['path'] = 'agent'
+        timing['prompt_tokens'] = timing['history_tokens'] + estimate_tokens(user_input)
+        # The agent usually hands the question to DocumentQA as is, so retrieve it
+        # while the agent's first LLM call is still deciding on a tool
+        if self.document_processor and self.document_processor.vector_store:
+            self._prefetched[normalize_query(user_input)] = asyncio.ensure_future(
+                self.document_processor.aget_scored_documents(user_input, k=self.context_builder.max_k)
+            )
+        yield await self.agent.arun(input=user_input, callbacks=self.callbacks)
+    
+    async def _astream_llm(self, prompt):
+        async for chunk in self.llm.astream(prompt, config={'callbacks': self.callbacks}):
+            yield chunk.content
+    
+    def _exact_answer(self, user_input, intent, history, cache_entry):
+        """Answer cached for the same normalized question, or None.
+        
+        An answer to a conversation's first question depends only on the question
+        (and the documents), so every session shares it. Later prompts carry the
+        conversation, which may hold the user's own details, so those answers are
+        only reused within this conversation. The scope is kept in cache_entry so a
+        new answer can be stored under it.
+        """
+        if self.answer_cache is None:
+            return None
+        if intent == DOCUMENT:
+            processor = self.document_processor
+            # Answers from documents are only valid for the exact index they came from
+            scope = ('documents', f"{type(processor.embeddings).__name__}:{processor.embedding_model}") \
+                + processor.cache_scope()
+        else:
+            scope = ('general', CHAT_MODEL)
+        if history:
+            scope += ('conversation', self.conversation_key)
+        cache_entry['scope'] = scope
+        return self.answer_cache.get_exact(scope, user_input)
+    
+    def _similar_answer(self, user_input, cache_entry):
+        """Answer cached for a reworded question, matched by the vector retrieval computed.
+        
+        Turns that BM25 answered were never embedded; they only match exactly.
+        """
+        if self.answer_cache is None:
+            return None
+        cache_entry['embedding'] = self.document_processor.cached_query_embedding(user_input)
+        hit = self.answer_cache.get(cache_entry['scope'], cache_entry['embedding'])
+        return hit[0] if hit else None
+    
+    def _store_answer(self, user_input, answer, cache_entry):
+        # Only routed answers have a scope; the agent's depend on memory the cache cannot see.
+        # General answers have no retrieval vector, so they are only matched by text.
+        if cache_entry.get('store') and 'scope' in cache_entry and answer:
+            self.answer_cache.put(cache_entry['scope'], user_input, cache_entry.get('embedding'), answer)
+    
+    def route(self, user_input):
+        """Decide which handler a turn goes to: (intent, confidence, method)"""
+        with self.metrics.span('route') as attributes:
+            has_documents = bool(self.document_processor and self.document_processor.vector_store)
+            document_match = self.document_processor.document_match(user_input) if has_documents else None
+            intent, confidence, method = self.router.route(user_input, has_documents, document_match)
+            attributes.update(intent=intent, method=method)
+        return intent, confidence, method
+    
+    def set_document_processor(self, document_processor):
+        """Swap the retriever DocumentQA reads from, keeping the conversation.
+        
+        The tools look the processor up on every call, so a new or updated
+        index takes effect on the next turn. The agent is only rebuilt (on
+        first use) when DocumentQA has to be added or removed; memory and the
+        LLM client are kept either way.
+        """
+        had_documents = self.document_processor is not None
+        self.document_processor = document_processor
+        self._prefetched.clear()
+        
+        if had_documents != (document_processor is not None):
+            self.tools = self._create_tools()
+            self._agent = None
     
     def reset_conversation(self):
         """Reset the conversation history"""
         self.memory.clear()
+        self.conversation_key = uuid.uuid4().hex
         if self.form_handler:
             self.form_handler.reset_form()
     
@@ -0,0 +1,153 @@
+# utils/chunk_dedup.py
+import re
+import hashlib
+from collections import defaultdict
+import numpy as np
+
+# Mersenne prime used for the MinHash permutations; 31-bit shingle hashes keep a*x+b inside int64
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 31) - 1
+
+
+def chunk_sources(chunk):
+    """Every source a chunk stands for, including merged duplicates"""
+    sources = [entry['source'] for entry in chunk.metadata.get('sources', [])]
+    if not sources:
+        sources = [chunk.metadata.get('source', 'unknown')]
+    return list(dict.fromkeys(sources))
+
+
+class ChunkDeduplicator:
+    """Drop exact and near-duplicate chunks before they are embedded.
+
+    Exact duplicates are found by hashing normalized text, near-duplicates
+    by MinHash signatures over word shingles bucketed with LSH. Every
+    surviving chunk lists the sources it stands for in metadata['sources'].
+    State persists across calls, so later uploads are checked against
+    chunks that are already indexed.
+    """
+
+    def __init__(self, threshold=0.9, num_perm=64, shingle_size=5, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = self._choose_bands(threshold, num_perm)
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MAX_HASH, size=num_perm, dtype=np.int64)
+        self._b = rng.randint(0, _MAX_HASH, size=num_perm, dtype=np.int64)
+
+        self.clear()
+
+    def clear(self):
+        """Forget every registered chunk"""
+        self._exact = {}          # text digest -> chunk id
+        self._digests = {}        # chunk id -> text digest
+        self._signatures = {}     # chunk id -> MinHash signature
+        self._buckets = [defaultdict(set) for _ in range(self.bands)]
+
+    def filter(self, chunks, ids):
+        """Split chunks into survivors and duplicates.
+
+        Returns (kept_chunks, kept_ids, duplicates) where duplicates is a list
+        of (source_entry, survivor_id) for every dropped chunk.
+        """
+        kept_chunks, kept_ids, duplicates = [], [], []
+        kept_by_id = {}
+
+        for chunk, chunk_id in zip(chunks, ids):
+            entry = self._source_entry(chunk)
+            digest, signature = self._fingerprint(chunk.page_content)
+            survivor_id = self._exact.get(digest) or self._find_similar(signature)
+
+            if survivor_id is None:
+                chunk.metadata['sources'] = [entry]
+                self._register(chunk_id, digest, signature)
+                kept_chunks.append(chunk)
+                kept_ids.append(chunk_id)
+                kept_by_id[chunk_id] = chunk
+                continue
+
+            if survivor_id in kept_by_id:
+                # Survivor is in this batch, so its metadata can be updated before embedding
+                sources = kept_by_id[survivor_id].metadata['sources']
+                if entry not in sources:
+                    sources.append(entry)
+            duplicates.append((entry, survivor_id))
+
+        return kept_chunks, kept_ids, duplicates
+
+    def register(self, chunk_id, text):
+        """Record an already-indexed chunk, e.g. after loading an index from cache"""
+        digest, signature = self._fingerprint(text)
+        self._register(chunk_id, digest, signature)
+
+    def discard(self, chunk_id):
+        """Forget a chunk that was deleted from the index"""
+        digest = self._digests.pop(chunk_id, None)
+        if digest is not None and self._exact.get(digest) == chunk_id:
+            del self._exact[digest]
+
+        signature = self._signatures.pop(chunk_id, None)
+        if signature is not None:
+            for band, key in enumerate(self._band_keys(signature)):
+                self._buckets[band][key].discard(chunk_id)
+
+    def _register(self, chunk_id, digest, signature):
+        self._exact.setdefault(digest, chunk_id)
+        self._digests[chunk_id] = digest
+        self._signatures[chunk_id] = signature
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band][key].add(chunk_id)
+
+    def _find_similar(self, signature):
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self._buckets[band].get(key, ()))
+
+        best_id, best_score = None, self.threshold
+        for candidate_id in candidates:
+            # Fraction of equal MinHash values estimates Jaccard similarity
+            score = float(np.mean(self._signatures[candidate_id] == signature))
+            if score >= best_score:
+                best_id, best_score = candidate_id, score
+        return best_id
+
+    def _fingerprint(self, text):
+        normalized = " ".join(re.findall(r'\w+', text.lower()))
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+
+        words = normalized.split()
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'little') & _MAX_HASH for s in shingles],
+            dtype=np.int64
+        )
+
+        # One row per permutation; the minimum over shingles is the signature value
+        signature = ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1)
+        return digest, signature
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    @staticmethod
+    def _choose_bands(threshold, num_perm):
+        """Pick the LSH band/row split whose S-curve midpoint is closest to the threshold"""
+        best = None
+        for rows in range(1, num_perm + 1):
+            if num_perm % rows:
+                continue
+            bands = num_perm // rows
+            midpoint = (1.0 / bands) ** (1.0 / rows)
+            if best is None or abs(midpoint - threshold) < best[0]:
+                best = (abs(midpoint - threshold), bands, rows)
+        return best[1], best[2]
+
+    @staticmethod
+    def _source_entry(chunk):
+        entry = {'source': chunk.metadata.get('source', 'unknown')}
+        if 'page' in chunk.metadata:
+            entry['page'] = chunk.metadata['page']
+        return entry
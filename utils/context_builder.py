@@ -0,0 +1,188 @@
+# utils/context_builder.py
+"""
+Token-budgeted context assembly for document Q&A.
+
+Retrieved chunks go through four steps before they reach the prompt:
+1. adaptive k: drop hits scoring below score_cutoff x the best score (fused
+   scores are shares of the best attainable rank, so hits that only one
+   retriever found fall away)
+2. MMR: order the rest to balance relevance against redundancy
+3. merge: stitch overlapping or adjacent chunks of the same source page together
+4. pack: fill the token budget in MMR order, truncating the last piece if needed
+"""
+
+from langchain.schema import Document
+from .lexical_index import tokenize
+from .tokens import estimate_tokens, truncate_to_tokens
+
+
+class ContextBuilder:
+    """Turn scored retrieval hits into a compact context string"""
+
+    # The defaults never send more than the plain top-3 join this replaced (3 chunks of ~250 tokens)
+    def __init__(self, token_budget=750, max_k=3, min_k=1, score_cutoff=0.75, mmr_lambda=0.7,
+                 min_overlap=20, max_gap=4, min_piece_tokens=50, separator="\n\n", baseline_k=3):
+        self.token_budget = token_budget
+        self.max_k = max_k
+        self.min_k = min_k
+        self.score_cutoff = score_cutoff
+        self.mmr_lambda = mmr_lambda
+        self.min_overlap = min_overlap      # shortest shared text that counts as a chunk overlap
+        self.max_gap = max_gap              # characters the splitter may strip between adjacent chunks
+        self.min_piece_tokens = min_piece_tokens
+        self.separator = separator
+        self.baseline_k = baseline_k        # the previous prompt: top baseline_k chunks joined as is
+
+    def build(self, candidates):
+        """Assemble context from (Document, score) pairs.
+
+        Returns (context, stats); stats compare the packed context with the
+        previous prompt, which joined the top baseline_k candidates.
+        """
+        top = sorted(candidates, key=lambda item: item[1], reverse=True)[:self.baseline_k]
+        baseline_tokens = estimate_tokens(self.separator.join(doc.page_content for doc, _ in top))
+
+        selected = self._mmr(self._adaptive_k(candidates))
+        pieces = self._merge([doc for doc, _ in selected])
+        context, used = self._pack(pieces)
+
+        context_tokens = estimate_tokens(context)
+        stats = {
+            'candidates': len(candidates),
+            'selected': len(selected),
+            'merged': len(selected) - len(pieces),
+            'pieces': used,
+            'baseline_tokens': baseline_tokens,
+            'context_tokens': context_tokens,
+            'tokens_saved': max(baseline_tokens - context_tokens, 0),
+            'token_budget': self.token_budget
+        }
+        return context, stats
+
+    def _adaptive_k(self, candidates):
+        """Keep hits within score_cutoff of the best one, between min_k and max_k of them"""
+        if not candidates:
+            return []
+
+        ranked = sorted(candidates, key=lambda item: item[1], reverse=True)[:self.max_k]
+        threshold = self.score_cutoff * ranked[0][1]
+        kept = sum(1 for _, score in ranked if score >= threshold)
+        return ranked[:max(kept, self.min_k)]
+
+    def _mmr(self, ranked):
+        """Maximal marginal relevance order, using word overlap as the redundancy measure"""
+        if len(ranked) < 2:
+            return list(ranked)
+
+        top_score = ranked[0][1] or 1.0
+        terms = [set(tokenize(doc.page_content)) for doc, _ in ranked]
+        remaining = list(range(len(ranked)))
+        order = []
+
+        def marginal_relevance(i):
+            redundancy = max((self._jaccard(terms[i], terms[j]) for j in order), default=0.0)
+            return self.mmr_lambda * ranked[i][1] / top_score - (1 - self.mmr_lambda) * redundancy
+
+        while remaining:
+            best = max(remaining, key=marginal_relevance)
+            order.append(best)
+            remaining.remove(best)
+        return [ranked[i] for i in order]
+
+    @staticmethod
+    def _jaccard(first, second):
+        if not first or not second:
+            return 0.0
+        return len(first & second) / len(first | second)
+
+    def _merge(self, docs):
+        """Stitch chunks of the same source page that overlap or touch into single pieces"""
+        pieces = list(docs)
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(pieces)):
+                for j in range(i + 1, len(pieces)):
+                    if not self._same_place(pieces[i], pieces[j]):
+                        continue
+                    stitched = self._stitch(pieces[i], pieces[j])
+                    if stitched is not None:
+                        # The merged piece takes the rank of its better-ranked part
+                        pieces[i] = stitched
+                        del pieces[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return pieces
+
+    @staticmethod
+    def _same_place(first, second):
+        return (first.metadata.get('source') == second.metadata.get('source')
+                and first.metadata.get('page') == second.metadata.get('page'))
+
+    def _stitch(self, first, second):
+        """Join two chunks into one Document, or return None if they are not neighbours"""
+        a, b = first.page_content, second.page_content
+        if b in a:
+            return first
+        if a in b:
+            return second
+
+        start_a, start_b = first.metadata.get('start_index'), second.metadata.get('start_index')
+        if start_a is not None and start_b is not None:
+            if start_b < start_a:
+                (a, start_a), (b, start_b) = (b, start_b), (a, start_a)
+            gap = start_b - (start_a + len(a))
+            if gap <= 0:
+                text = a + b[-gap:]
+            elif gap <= self.max_gap:
+                text = a + "\n" + b
+            else:
+                return None
+        else:
+            # Chunks indexed without offsets: look for the splitter's overlap in the text itself
+            overlap = self._overlap(a, b)
+            if overlap >= self.min_overlap:
+                text = a + b[overlap:]
+            else:
+                overlap = self._overlap(b, a)
+                if overlap < self.min_overlap:
+                    return None
+                text = b + a[overlap:]
+
+        metadata = dict(first.metadata)
+        if start_a is not None:
+            metadata['start_index'] = min(start_a, start_b)
+        return Document(page_content=text, metadata=metadata)
+
+    def _overlap(self, first, second):
+        """Length of the longest suffix of first that is a prefix of second"""
+        prefix = second[:self.min_overlap]
+        start = first.find(prefix, max(len(first) - len(second), 0))
+        while start != -1:
+            if second.startswith(first[start:]):
+                return len(first) - start
+            start = first.find(prefix, start + 1)
+        return 0
+
+    def _pack(self, pieces):
+        """Join pieces in order until the token budget is spent; returns (context, pieces used)"""
+        separator_tokens = estimate_tokens(self.separator)
+        parts = []
+        used_tokens = 0
+
+        for piece in pieces:
+            cost = estimate_tokens(piece.page_content) + (separator_tokens if parts else 0)
+            if used_tokens + cost <= self.token_budget:
+                parts.append(piece.page_content)
+                used_tokens += cost
+                continue
+
+            # A truncated piece is only worth sending if a useful amount of it fits
+            room = self.token_budget - used_tokens - (separator_tokens if parts else 0)
+            if room > 0 and (room >= self.min_piece_tokens or not parts):
+                parts.append(truncate_to_tokens(piece.page_content, room))
+            break
+
+        return self.separator.join(parts), len(parts)
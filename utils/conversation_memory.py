@@ -0,0 +1,141 @@
+# utils/conversation_memory.py
+"""
+Conversation history for the chatbot.
+
+TranscriptHistory keeps the messages in a plain list of
+{'role': 'user' | 'assistant', 'content': ...} dicts. That is the same
+format app.py renders from st.session_state.messages, so the UI and the
+agent's memory share one buffer instead of keeping two copies.
+
+RollingSummaryMemory bounds what the agent re-sends every turn: the last
+max_turns turns stay verbatim, older turns are folded into a running
+summary, and the whole history stays under max_tokens.
+"""
+
+from typing import Any, Optional
+from langchain.memory import ConversationBufferMemory
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import get_buffer_string
+from .tokens import estimate_tokens, truncate_to_tokens
+
+SUMMARY_PROMPT = """Progressively summarize the conversation below, adding to the previous summary.
+Keep names, dates, numbers and open requests. Reply with the new summary only, in at most {words} words.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+
+class TranscriptHistory(BaseChatMessageHistory):
+    """Chat message history stored in a caller-owned list of role/content dicts"""
+
+    def __init__(self, transcript=None):
+        self.transcript = transcript if transcript is not None else []
+
+    @property
+    def messages(self):
+        return [
+            HumanMessage(content=entry['content']) if entry['role'] == 'user' else AIMessage(content=entry['content'])
+            for entry in self.transcript
+        ]
+
+    def add_message(self, message):
+        role = 'user' if isinstance(message, HumanMessage) else 'assistant'
+        self.transcript.append({'role': role, 'content': message.content})
+
+    def clear(self):
+        # In place, so everyone holding the list sees the same (empty) history
+        del self.transcript[:]
+
+
+class RollingSummaryMemory(ConversationBufferMemory):
+    """Last max_turns turns verbatim plus an LLM-written summary of everything older"""
+
+    llm: Optional[Any] = None
+    max_turns: int = 6
+    max_tokens: int = 1500
+    fold_batch: int = 2        # turns folded per summarization call, so not every turn pays for one
+    summary: str = ""
+    summarized: int = 0        # leading transcript messages already folded into the summary
+
+    @property
+    def summary_tokens(self):
+        return self.max_tokens // 3
+
+    @property
+    def buffer_as_messages(self):
+        messages = self.chat_memory.messages
+        if self.summarized > len(messages):
+            # The transcript was cleared or replaced underneath us
+            self.summary, self.summarized = "", 0
+        # Between summarizations up to fold_batch - 1 extra turns wait here, unsummarized
+        recent = messages[self.summarized:]
+
+        history = [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")] if self.summary else []
+        budget = self.max_tokens - sum(estimate_tokens(message.content) for message in history)
+
+        # Hard cap: whatever does not fit is dropped from the oldest end
+        kept = []
+        for message in reversed(recent):
+            cost = estimate_tokens(message.content)
+            if cost > budget:
+                break
+            kept.append(message)
+            budget -= cost
+        return history + kept[::-1]
+
+    def save_context(self, inputs, outputs):
+        super().save_context(inputs, outputs)
+        messages = self._messages_to_fold()
+        if messages:
+            prompt = self._summary_prompt(messages)
+            self._set_summary(self.llm.invoke(prompt).content if self.llm else prompt, len(messages))
+
+    async def asave_context(self, inputs, outputs):
+        await super().asave_context(inputs, outputs)
+        messages = self._messages_to_fold()
+        if messages:
+            prompt = self._summary_prompt(messages)
+            self._set_summary((await self.llm.ainvoke(prompt)).content if self.llm else prompt, len(messages))
+
+    def _messages_to_fold(self):
+        """Older messages that should now move into the summary (possibly none)"""
+        messages = self.chat_memory.messages
+        if self.summarized > len(messages):
+            self.summary, self.summarized = "", 0
+        pending = messages[self.summarized:]
+
+        overflow = max(len(pending) - 2 * self.max_turns, 0)
+        # Also fold early when the verbatim turns alone would break the token budget
+        recent_tokens = sum(estimate_tokens(message.content) for message in pending[overflow:])
+        while recent_tokens > self.max_tokens - self.summary_tokens and overflow < len(pending) - 2:
+            recent_tokens -= sum(estimate_tokens(message.content) for message in pending[overflow:overflow + 2])
+            overflow += 2
+
+        if overflow < 2 * self.fold_batch and recent_tokens <= self.max_tokens - self.summary_tokens:
+            return []
+        return pending[:overflow]
+
+    def _summary_prompt(self, messages):
+        lines = get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        if self.llm is None:
+            # Without a model the "summary" is the older text itself, clipped below
+            return f"{self.summary}\n{lines}".strip()
+        return SUMMARY_PROMPT.format(
+            words=self.summary_tokens * 3 // 4,
+            summary=self.summary or "(none)",
+            lines=lines
+        )
+
+    def _set_summary(self, text, folded):
+        self.summary = truncate_to_tokens(text.strip(), self.summary_tokens)
+        self.summarized += folded
+
+    def clear(self):
+        super().clear()
+        self.summary, self.summarized = "", 0
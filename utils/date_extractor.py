@@ -4,87 +4,157 @@ from datetime import datetime, timedelta
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
 
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+WEEKDAY_INDEX = {day: i for i, day in enumerate(WEEKDAYS)}
+
+MONTHS = {
+    'january': 1, 'jan': 1, 'february': 2, 'feb': 2, 'march': 3, 'mar': 3, 'april': 4, 'apr': 4,
+    'may': 5, 'june': 6, 'jun': 6, 'july': 7, 'jul': 7, 'august': 8, 'aug': 8,
+    'september': 9, 'sept': 9, 'sep': 9, 'october': 10, 'oct': 10, 'november': 11, 'nov': 11,
+    'december': 12, 'dec': 12
+}
+
+NUMBER_WORDS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12
+}
+
+RELATIVE_DAYS = {'today': 0, 'tonight': 0, 'tomorrow': 1, 'tmrw': 1, 'yesterday': -1}
+
+
+def _words(words):
+    # Longest first, so "sept" is not cut short by "sep"
+    return '|'.join(sorted(words, key=len, reverse=True))
+
+_WEEKDAY = _words(WEEKDAYS)
+_MONTH = _words(MONTHS)
+_COUNT = r'\d+|' + _words(NUMBER_WORDS)
+_UNIT = r'day|week|month|year'
+_ORDINAL = r'(?:st|nd|rd|th)?'
+
+# One alternation over every supported form. Each top-level group names its
+# handler in DateExtractor._DISPATCH; the leftmost match in the text wins.
+DATE_GRAMMAR = re.compile(rf"""
+    (?P<day_after>\bday\ after\ tomorrow\b)
+  | (?P<relative_day>\b(?P<relative_word>{_words(RELATIVE_DAYS)})\b)
+  | (?P<offset>\bin\s+(?P<offset_count>{_COUNT})\s+(?P<offset_unit>{_UNIT})s?\b)
+  | (?P<offset_from>\b(?P<from_count>{_COUNT})\s+(?P<from_unit>{_UNIT})s?\s+from\s+(?:now|today)\b)
+  | (?P<next_period>\bnext\s+(?P<period_unit>{_UNIT})\b)
+  | (?P<qualified_weekday>\b(?P<qualifier>next|this|coming)\s+(?P<qualified_day>{_WEEKDAY})\b)
+  | (?P<iso>\b(?P<iso_year>\d{{4}})-(?P<iso_month>\d{{1,2}})-(?P<iso_day>\d{{1,2}})\b)
+  | (?P<numeric>\b(?P<numeric_month>\d{{1,2}})[/-](?P<numeric_day>\d{{1,2}})[/-](?P<numeric_year>\d{{4}})\b)
+  | (?P<month_day>\b(?P<md_month>{_MONTH})\.?\s+(?P<md_day>\d{{1,2}}){_ORDINAL}(?:,?\s+(?P<md_year>\d{{4}}))?\b)
+  | (?P<day_month>\b(?P<dm_day>\d{{1,2}}){_ORDINAL}\s+(?:of\s+)?(?P<dm_month>{_MONTH})\.?(?:,?\s+(?P<dm_year>\d{{4}}))?\b)
+  | (?P<weekday>\b(?P<weekday_name>{_WEEKDAY})\b)
+""", re.VERBOSE)
+
+
 class DateExtractor:
     def __init__(self):
         self.today = datetime.now().date()
-        
+    
     def extract_date(self, text):
         """Extract date from natural language text"""
         text = text.lower().strip()
         
-        # Handle relative dates
-        if 'today' in text:
-            return self.today.strftime('%Y-%m-%d')
-        elif 'tomorrow' in text:
-            return (self.today + timedelta(days=1)).strftime('%Y-%m-%d')
-        elif 'yesterday' in text:
-            return (self.today - timedelta(days=1)).strftime('%Y-%m-%d')
-        
-        # Handle "next" dates
-        if 'next' in text:
-            return self._handle_next_dates(text)
-        
-        # Handle "this" dates
-        if 'this' in text:
-            return self._handle_this_dates(text)
+        for match in DATE_GRAMMAR.finditer(text):
+            date = self._DISPATCH[match.lastgroup](self, match)
+            if date is not None:
+                return date.isoformat()
         
-        # Handle specific weekdays
-        weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-        for i, day in enumerate(weekdays):
-            if day in text:
-                return self._get_next_weekday(i)
-        
-        # Try to parse absolute dates
+        # Last resort for phrasings the grammar does not cover
         try:
-            # Look for date patterns
-            date_patterns = [
-                r'\d{4}-\d{2}-\d{2}',  # YYYY-MM-DD
-                r'\d{2}/\d{2}/\d{4}',  # MM/DD/YYYY
-                r'\d{2}-\d{2}-\d{4}',  # MM-DD-YYYY
-                r'\d{1,2}/\d{1,2}/\d{4}',  # M/D/YYYY
-            ]
-            
-            for pattern in date_patterns:
-                matches = re.findall(pattern, text)
-                if matches:
-                    try:
-                        parsed_date = parse(matches[0])
-                        return parsed_date.strftime('%Y-%m-%d')
-                    except:
-                        continue
-            
-            # Try general parsing
-            parsed_date = parse(text, fuzzy=True)
-            return parsed_date.strftime('%Y-%m-%d')
-            
-        except:
+            return parse(text, fuzzy=True).strftime('%Y-%m-%d')
+        except (ValueError, OverflowError):
             return None
     
-    def _handle_next_dates(self, text):
-        """Handle 'next' relative dates"""
-        if 'next week' in text:
-            return (self.today + timedelta(weeks=1)).strftime('%Y-%m-%d')
-        elif 'next month' in text:
-            return (self.today + relativedelta(months=1)).strftime('%Y-%m-%d')
-        elif 'next year' in text:
-            return (self.today + relativedelta(years=1)).strftime('%Y-%m-%d')
-        
-        # Handle next specific weekday
-        weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-        for i, day in enumerate(weekdays):
-            if f'next {day}' in text:
-                return self._get_next_weekday(i, next_week=True)
-        
-        return None
-    
-    def _handle_this_dates(self, text):
-        """Handle 'this' relative dates"""
-        weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-        for i, day in enumerate(weekdays):
-            if f'this {day}' in text:
-                return self._get_this_weekday(i)
+    def extract_dates(self, texts):
+        """Extract dates from many texts at once, e.g. a bulk lead import.
         
-        return None
+        Repeated phrasings are resolved once; returns one YYYY-MM-DD string
+        (or None) per input, in order.
+        """
+        resolved = {}
+        results = []
+        for text in texts:
+            key = text.lower().strip() if text else ""
+            if key not in resolved:
+                resolved[key] = self.extract_date(key) if key else None
+            results.append(resolved[key])
+        return results
+    
+    # Handlers: match -> date, or None when the matched text is not a real date
+    
+    def _day_after(self, match):
+        return self.today + timedelta(days=2)
+    
+    def _relative_day(self, match):
+        return self.today + timedelta(days=RELATIVE_DAYS[match.group('relative_word')])
+    
+    def _offset(self, match):
+        return self._shift(match.group('offset_count'), match.group('offset_unit'))
+    
+    def _offset_from(self, match):
+        return self._shift(match.group('from_count'), match.group('from_unit'))
+    
+    def _next_period(self, match):
+        return self._shift(1, match.group('period_unit'))
+    
+    def _shift(self, count, unit):
+        count = NUMBER_WORDS[count] if count in NUMBER_WORDS else int(count)
+        try:
+            if unit == 'day':
+                return self.today + timedelta(days=count)
+            if unit == 'week':
+                return self.today + timedelta(weeks=count)
+            if unit == 'month':
+                return self.today + relativedelta(months=count)
+            return self.today + relativedelta(years=count)
+        except (OverflowError, ValueError):
+            return None
+    
+    def _qualified_weekday(self, match):
+        weekday = WEEKDAY_INDEX[match.group('qualified_day')]
+        if match.group('qualifier') == 'next':
+            return self._get_next_weekday(weekday, next_week=True)
+        return self._get_this_weekday(weekday)
+    
+    def _weekday(self, match):
+        return self._get_next_weekday(WEEKDAY_INDEX[match.group('weekday_name')])
+    
+    def _iso(self, match):
+        return self._date(match.group('iso_year'), match.group('iso_month'), match.group('iso_day'))
+    
+    def _numeric(self, match):
+        # Month first, as in the US-style forms users type (and dateutil's default)
+        return self._date(match.group('numeric_year'), match.group('numeric_month'), match.group('numeric_day'))
+    
+    def _month_day(self, match):
+        return self._date(match.group('md_year'), MONTHS[match.group('md_month')], match.group('md_day'))
+    
+    def _day_month(self, match):
+        return self._date(match.group('dm_year'), MONTHS[match.group('dm_month')], match.group('dm_day'))
+    
+    def _date(self, year, month, day):
+        """Build a date, defaulting to the current year; None if it does not exist"""
+        try:
+            return datetime(int(year) if year else self.today.year, int(month), int(day)).date()
+        except ValueError:
+            return None
+    
+    _DISPATCH = {
+        'day_after': _day_after,
+        'relative_day': _relative_day,
+        'offset': _offset,
+        'offset_from': _offset_from,
+        'next_period': _next_period,
+        'qualified_weekday': _qualified_weekday,
+        'weekday': _weekday,
+        'iso': _iso,
+        'numeric': _numeric,
+        'month_day': _month_day,
+        'day_month': _day_month
+    }
     
     def _get_next_weekday(self, weekday, next_week=False):
         """Get the next occurrence of a specific weekday"""
@@ -93,8 +163,7 @@ class DateExtractor:
         if days_ahead <= 0 or next_week:  # Target day already happened this week or explicitly next week
             days_ahead += 7
         
-        target_date = self.today + timedelta(days=days_ahead)
-        return target_date.strftime('%Y-%m-%d')
+        return self.today + timedelta(days=days_ahead)
     
     def _get_this_weekday(self, weekday):
         """Get this week's occurrence of a specific weekday"""
@@ -103,8 +172,7 @@ class DateExtractor:
         if days_ahead < 0:  # If the day already passed this week, get next week
             days_ahead += 7
         
-        target_date = self.today + timedelta(days=days_ahead)
-        return target_date.strftime('%Y-%m-%d')
+        return self.today + timedelta(days=days_ahead)
     
     def validate_date(self, date_string):
         """Validate if a date string is in correct format and not in the past"""
@@ -124,4 +192,4 @@ class DateExtractor:
             date_obj = datetime.strptime(date_string, '%Y-%m-%d')
             return date_obj.strftime('%B %d, %Y')  # e.g., "January 15, 2024"
         except:
-            return date_string
\ No newline at end of file
+            return date_string
@@ -1,86 +1,1026 @@
 # utils/document_processor.py
 import os
+import time
+import uuid
+import hashlib
+import threading
+import weakref
+from collections import deque
+import faiss
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import streamlit as st
-from langchain.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
+from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-import tempfile
+from langchain.docstore.in_memory import InMemoryDocstore
+from .index_cache import IndexCache
+from .embedding_pipeline import EmbeddingPipeline
+from .file_parsers import is_supported, iter_file_pages, parse_file
+from .chunk_dedup import ChunkDeduplicator, chunk_sources
+from .query_cache import (
+    TTLCache, get_query_embedding_cache, normalize_query, embed_query_cached, aembed_query_cached,
+    cached_query_embedding
+)
+from .query_batcher import LangChainQueryBackend, get_query_batcher
+from .metrics import get_metrics
+from .lexical_index import BM25Index, STOPWORDS, RRF_K, reciprocal_rank_fusion, tokenize
+from . import ann_index
+
+# Process pool for CPU-bound parsing, shared by every session in this process
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def _get_parse_pool(max_workers):
+    """Return the shared parsing pool, or None if processes cannot be started"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            try:
+                # spawn avoids forking the Streamlit server's threads
+                _parse_pool = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            except (OSError, NotImplementedError):
+                return None
+        return _parse_pool
+
+class IngestProgress:
+    """Running ingest counts, passed as a dict to progress_callback(stats) after each step"""
+
+    def __init__(self, progress_callback, files_total, pages=0):
+        self.progress_callback = progress_callback
+        self.stats = {
+            'files_total': files_total, 'files_done': 0, 'pages': pages, 'chunks': 0, 'duplicates': 0,
+            'peak_parse_bytes': 0, 'elapsed': 0.0, 'pages_per_sec': 0.0, 'chunks_per_sec': 0.0
+        }
+        self.start = time.perf_counter()
+
+    def report(self):
+        stats = self.stats
+        stats['elapsed'] = time.perf_counter() - self.start
+        if stats['elapsed'] > 0:
+            stats['pages_per_sec'] = stats['pages'] / stats['elapsed']
+            stats['chunks_per_sec'] = stats['chunks'] / stats['elapsed']
+        if self.progress_callback:
+            self.progress_callback(dict(stats))
+
+    def embedded(self, done, total):
+        """EmbeddingPipeline hook: count chunks as their embeddings arrive"""
+        self.stats['chunks'] = done
+        self.report()
+
+    def indexed(self, chunks, added):
+        """Finish a batch of already-parsed documents"""
+        self.stats.update(files_done=self.stats['files_total'], chunks=added, duplicates=chunks - added)
+        self.report()
+
 
 class DocumentProcessor:
-    def __init__(self, api_key):
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=api_key
+    def __init__(self, api_key, embedding_model="models/embedding-001", chunk_size=1000,
+                 chunk_overlap=200, cache_dir=".index_cache", cache_max_bytes=2 * 1024 ** 3,
+                 embeddings=None, batch_size=64, max_concurrency=4, requests_per_minute=None,
+                 parse_workers=None, parse_budget_bytes=64 * 1024 ** 2, dedup_threshold=0.9, result_cache_size=1024, result_cache_ttl=600,
+                 hybrid_search=True, lexical_confidence=0.9, lexical_margin=1.5,
+                 index_type='auto', index_params=None, nprobe=16, ef_search=64, compact_ratio=0.2,
+                 batch_queries=True, query_batch_size=32, query_batch_wait=0.005, query_batcher=None,
+                 metrics=None):
+        self.api_key = api_key
+        self.embedding_model = embedding_model
+        # Any LangChain Embeddings can be injected, e.g. FakeEmbeddings for offline runs.
+        # Otherwise the Gemini client and the pipeline around it are created on first use.
+        self._embeddings = embeddings
+        self._embedding_pipeline = None
+        self._pipeline_settings = {
+            'batch_size': batch_size,
+            'max_concurrency': max_concurrency,
+            'requests_per_minute': requests_per_minute
+        }
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            add_start_index=True  # lets the context builder stitch neighbouring chunks back together
         )
         self.vector_store = None
-        
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        # Upload bytes parsed ahead in the pool at once; parsed pages are held until consumed
+        self.parse_budget_bytes = parse_budget_bytes
+
+        # FAISS index layout: 'auto' picks by corpus size and upgrades as the corpus grows.
+        # index_params go to ann_index.factory_string (hnsw_m, nlist, pq_m, pq_bits).
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.search_params = {'nprobe': nprobe, 'ef_search': ef_search}
+
+        # HNSW/IVF indexes are ID-mapped: removed chunks leave tombstoned labels that searches
+        # skip, and the index is rebuilt once they pass compact_ratio of its vectors. Rebuilds
+        # read full-precision copies of the vectors (row = label), never quantized codes.
+        self.compact_ratio = compact_ratio
+        self._originals = None
+        self._tombstones = set()
+        self._chunk_labels = {}
+        self._search_filter = None
+
+        # On-disk index cache keyed by file contents; pass cache_dir=None to disable
+        self.index_cache = IndexCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+        # Per-source bookkeeping: file name -> content digest / docstore chunk ids
+        self.source_digests = {}
+        self.source_chunk_ids = {}
+
+        # Exact/near-duplicate chunk filter; pass dedup_threshold=None to disable
+        self.deduplicator = ChunkDeduplicator(threshold=dedup_threshold) if dedup_threshold else None
+
+        # Retrieval caches: query embeddings are shared process-wide, top-k results are
+        # per index and keyed by index_version, which bumps on every change to the index
+        self.index_id = uuid.uuid4().hex
+        self.index_version = 0
+        self.query_embedding_cache = get_query_embedding_cache()
+
+        # Query embeddings that miss the cache are micro-batched with other sessions' queries.
+        # Processors that build their own client share one batcher per model and API key;
+        # with injected embeddings, pass a query_batcher explicitly to batch.
+        self.batch_queries = batch_queries and embeddings is None
+        self._query_batcher = query_batcher
+        self._query_batch_settings = {'max_batch_size': query_batch_size, 'max_wait': query_batch_wait}
+        self.result_cache = TTLCache(maxsize=result_cache_size, ttl=result_cache_ttl)
+
+        # BM25 index over the same chunks, fused with FAISS results by reciprocal rank.
+        # When the top lexical hit covers the query well enough (lexical_confidence) and
+        # clearly beats the runner-up (lexical_margin), the query is never embedded.
+        self.lexical_index = BM25Index() if hybrid_search else None
+        self.lexical_confidence = lexical_confidence
+        self.lexical_margin = lexical_margin
+        self.retrieval_paths = {'lexical': 0, 'hybrid': 0, 'vector': 0}
+
+        # Latency histograms for query embedding and vector search
+        self.metrics = metrics or get_metrics()
+
+        # Read-only attachment to an index published through an IndexRegistry
+        self.shared_index = None
+        self._shared_registry = None
+        self._shared_release = None
+
+    @property
+    def embeddings(self):
+        """Embedding client, created on first use"""
+        if self._embeddings is None:
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+            self._embeddings = GoogleGenerativeAIEmbeddings(
+                model=self.embedding_model,
+                google_api_key=self.api_key
+            )
+        return self._embeddings
+
+    @property
+    def embedding_pipeline(self):
+        """Batched, rate-limited embedding of document chunks"""
+        if self._embedding_pipeline is None:
+            self._embedding_pipeline = EmbeddingPipeline(self.embeddings, **self._pipeline_settings)
+        return self._embedding_pipeline
+
+    @property
+    def query_batcher(self):
+        """Shared QueryEmbeddingBatcher for this client's queries, or None to embed directly"""
+        if self._query_batcher is None and self.batch_queries:
+            self._query_batcher = get_query_batcher(
+                (self.embedding_model, self.api_key),
+                lambda: LangChainQueryBackend(self.embeddings),
+                **self._query_batch_settings
+            )
+        return self._query_batcher
+
     def load_documents(self, uploaded_files):
         """Load and process uploaded documents"""
-        documents = []
-        
+        jobs = []
         for uploaded_file in uploaded_files:
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_file_path = tmp_file.name
-            
+            if not is_supported(uploaded_file.name):
+                st.warning(f"Unsupported file type: {uploaded_file.name}")
+                continue
+            jobs.append((uploaded_file.name, uploaded_file.getvalue()))
+
+        documents = []
+        for (file_name, data), result in zip(jobs, self._parse_files(jobs)):
+            if isinstance(result, Exception):
+                st.error(f"Error loading {file_name}: {str(result)}")
+                continue
+
+            documents.extend(Document(page_content=text, metadata=metadata) for text, metadata in result)
+            self.source_digests[file_name] = hashlib.sha256(data).hexdigest()
+
+        return documents
+
+    def _parse_files(self, jobs):
+        """Parse (name, bytes) jobs, in parallel when there is more than one file.
+
+        Returns one entry per job: a list of (text, metadata) pages, or the
+        exception raised while parsing that file.
+        """
+        if len(jobs) > 1 and self.parse_workers > 1:
+            pool = _get_parse_pool(self.parse_workers)
+            if pool is not None:
+                futures = [pool.submit(parse_file, file_name, data) for file_name, data in jobs]
+                results = []
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append(e)
+                return results
+
+        results = []
+        for file_name, data in jobs:
             try:
-                # Load document based on file type
-                if uploaded_file.name.endswith('.pdf'):
-                    loader = PyPDFLoader(tmp_file_path)
-                elif uploaded_file.name.endswith('.docx'):
-                    loader = Docx2txtLoader(tmp_file_path)
-                elif uploaded_file.name.endswith('.txt'):
-                    loader = TextLoader(tmp_file_path)
-                else:
-                    st.warning(f"Unsupported file type: {uploaded_file.name}")
-                    continue
-                
-                docs = loader.load()
-                documents.extend(docs)
-                
+                results.append(parse_file(file_name, data))
             except Exception as e:
-                st.error(f"Error loading {uploaded_file.name}: {str(e)}")
-            finally:
-                # Clean up temporary file
-                os.unlink(tmp_file_path)
-        
-        return documents
-    
-    def create_vector_store(self, documents):
-        """Create vector store from documents"""
+                results.append(e)
+        return results
+
+    def create_vector_store(self, documents, progress_callback=None):
+        """Create vector store from documents.
+
+        progress_callback(stats) gets the same running counts as ingest_files.
+        """
         if not documents:
             return None
-            
+        self._check_writable()
+        progress = IngestProgress(progress_callback, len(self._sources_of(documents)), pages=len(documents))
+
+        # Reuse a previously built index for the same files and settings
+        cache_key = self._cache_key(self._sources_of(documents), documents)
+        if self.index_cache and self._load_cached(cache_key):
+            progress.stats['files_done'] = progress.stats['files_total']
+            progress.report()
+            return self.vector_store
+
         # Split documents into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
-        
-        chunks = text_splitter.split_documents(documents)
-        
+        chunks = self.text_splitter.split_documents(documents)
+
         try:
-            # Create vector store
-            self.vector_store = FAISS.from_documents(
-                chunks,
-                self.embeddings
-            )
+            # Create vector store from batched embeddings
+            self.vector_store = None
+            self.source_chunk_ids = {}
+            if self.deduplicator:
+                self.deduplicator.clear()
+            if self.lexical_index is not None:
+                self.lexical_index.clear()
+            progress.indexed(len(chunks), self._index_chunks(chunks, progress.embedded))
+
+            self._save_to_cache(cache_key)
             return self.vector_store
         except Exception as e:
             st.error(f"Error creating vector store: {str(e)}")
             return None
-    
+
+    def add_documents(self, documents, progress_callback=None):
+        """Embed and append documents to the existing vector store.
+
+        Sources that are already indexed are replaced, so re-uploading an
+        edited file does not leave its old chunks behind. progress_callback(stats)
+        gets the same running counts as ingest_files.
+        """
+        if not documents:
+            return 0
+        self._check_writable()
+
+        if not self.vector_store:
+            self.create_vector_store(documents, progress_callback)
+            return self.vector_store.index.ntotal if self.vector_store else 0
+
+        for source in self._sources_of(documents):
+            if source in self.source_chunk_ids:
+                self._delete_source_chunks(source)
+
+        chunks = self.text_splitter.split_documents(documents)
+        progress = IngestProgress(progress_callback, len(self._sources_of(documents)), pages=len(documents))
+
+        try:
+            added = self._index_chunks(chunks, progress.embedded)
+        except Exception as e:
+            st.error(f"Error adding documents: {str(e)}")
+            return 0
+        progress.indexed(len(chunks), added)
+
+        self._save_to_cache(self._cache_key(self.source_chunk_ids))
+        return added
+
+    def remove_source(self, source):
+        """Delete every chunk that came from a source document"""
+        self._check_writable()
+        if not self.vector_store or source not in self.source_chunk_ids:
+            return 0
+
+        try:
+            removed = self._delete_source_chunks(source)
+        except Exception as e:
+            st.error(f"Error removing {source}: {str(e)}")
+            return 0
+        self.source_digests.pop(source, None)
+
+        if self.source_chunk_ids:
+            self._save_to_cache(self._cache_key(self.source_chunk_ids))
+        return removed
+
+    def ingest_files(self, uploaded_files, progress_callback=None, batch_size=None):
+        """Stream uploads into the index: parse page -> split -> embed batch -> add.
+
+        Only one embedding batch of chunks is held at a time, and files parsed
+        ahead in the pool are capped by parse_budget_bytes, so peak memory
+        depends on those settings rather than on corpus size. Re-ingesting an
+        indexed file replaces its chunks. progress_callback(stats) receives
+        running counts plus pages/sec and chunks/sec; the final stats are
+        returned.
+        """
+        self._check_writable()
+        batch_size = batch_size or self.embedding_pipeline.batch_size * self.embedding_pipeline.max_concurrency
+
+        files = []
+        for uploaded_file in uploaded_files:
+            if is_supported(uploaded_file.name):
+                files.append(uploaded_file)
+            else:
+                st.warning(f"Unsupported file type: {uploaded_file.name}")
+
+        progress = IngestProgress(progress_callback, len(files))
+        stats, report = progress.stats, progress.report
+
+        digests = {uploaded_file.name: self._file_digest(uploaded_file) for uploaded_file in files}
+
+        # A fresh build of an already-seen file set can come straight from the cache
+        if not self.vector_store and self.index_cache and files:
+            if self._load_cached(self._digest_key(digests.values())):
+                self.source_digests.update(digests)
+                stats['files_done'] = len(files)
+                report()
+                return stats
+
+        pending = []
+        for file_name, pages in self._iter_file_pages(files, stats):
+            if file_name in self.source_chunk_ids:
+                self._delete_source_chunks(file_name)
+
+            try:
+                if isinstance(pages, Exception):
+                    raise pages
+                for text, metadata in pages:
+                    page = Document(page_content=text, metadata=metadata)
+                    pending.extend(self.text_splitter.split_documents([page]))
+                    stats['pages'] += 1
+
+                    if len(pending) >= batch_size:
+                        added = self._index_chunks(pending)
+                        stats['chunks'] += added
+                        stats['duplicates'] += len(pending) - added
+                        pending = []
+                        report()
+            except Exception as e:
+                # Drop whatever part of the broken file already made it in
+                st.error(f"Error loading {file_name}: {str(e)}")
+                pending = [chunk for chunk in pending if chunk.metadata.get('source') != file_name]
+                if file_name in self.source_chunk_ids:
+                    self._delete_source_chunks(file_name)
+                continue
+
+            self.source_digests[file_name] = digests[file_name]
+            stats['files_done'] += 1
+            report()
+
+        if pending:
+            added = self._index_chunks(pending)
+            stats['chunks'] += added
+            stats['duplicates'] += len(pending) - added
+            report()
+
+        if self.vector_store and self.source_chunk_ids:
+            self._save_to_cache(self._cache_key(self.source_chunk_ids))
+        return stats
+
+    def _iter_file_pages(self, files, stats=None):
+        """Yield (file_name, pages) per file in upload order.
+
+        With several files, up to parse_workers of them are parsed ahead in
+        the process pool, as long as their combined size stays within
+        parse_budget_bytes (a larger file is parsed on its own). Otherwise
+        pages are produced lazily in-process. The largest number of upload
+        bytes held in parsing at once goes to stats['peak_parse_bytes'].
+        """
+        pool = _get_parse_pool(self.parse_workers) if len(files) > 1 and self.parse_workers > 1 else None
+
+        if pool is None:
+            for uploaded_file in files:
+                yield uploaded_file.name, iter_file_pages(uploaded_file.name, uploaded_file.getvalue())
+            return
+
+        remaining = deque(files)
+        window = deque()  # (file_name, size, future)
+        in_flight = 0
+
+        def fill():
+            nonlocal in_flight
+            while remaining and len(window) < self.parse_workers:
+                data = remaining[0].getvalue()
+                if in_flight and in_flight + len(data) > self.parse_budget_bytes:
+                    break
+                uploaded_file = remaining.popleft()
+                window.append((uploaded_file.name, len(data), pool.submit(parse_file, uploaded_file.name, data)))
+                in_flight += len(data)
+            if stats is not None:
+                stats['peak_parse_bytes'] = max(stats['peak_parse_bytes'], in_flight)
+
+        fill()
+        while window:
+            file_name, size, future = window.popleft()
+            try:
+                pages = future.result()
+            except Exception as e:
+                pages = e
+            # This file's pages count against the budget until they have been split and embedded
+            fill()
+            yield file_name, pages
+            pages = None
+            in_flight -= size
+            fill()
+
+    def sync_files(self, uploaded_files, progress_callback=None):
+        """Bring the index in line with the current uploads, embedding only the delta.
+
+        New or changed files are streamed in through ingest_files. Returns
+        the lists of added and removed source names.
+        """
+        self._check_writable()
+        uploaded = {uploaded_file.name: uploaded_file for uploaded_file in uploaded_files}
+
+        changed_files = [
+            uploaded_file for name, uploaded_file in uploaded.items()
+            if name not in self.source_chunk_ids
+            or self.source_digests.get(name) != self._file_digest(uploaded_file)
+        ]
+        removed_sources = [source for source in self.source_chunk_ids if source not in uploaded]
+
+        for source in removed_sources:
+            self.remove_source(source)
+
+        if changed_files:
+            self.ingest_files(changed_files, progress_callback)
+        added_sources = sorted(
+            uploaded_file.name for uploaded_file in changed_files
+            if uploaded_file.name in self.source_chunk_ids
+        )
+
+        return added_sources, removed_sources
+
+    def indexed_sources(self):
+        """List the source documents currently in the vector store"""
+        return sorted(self.source_chunk_ids)
+
+    def _index_chunks(self, chunks, embed_progress=None):
+        """Embed chunks and add them to the vector store, creating it if needed.
+
+        Duplicates are dropped first and credited to the chunk that survives.
+        Returns the number of chunks actually embedded.
+        """
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        duplicates = []
+        if self.deduplicator:
+            chunks, ids, duplicates = self.deduplicator.filter(chunks, ids)
+
+        if chunks:
+            try:
+                self._embed_and_add(chunks, ids, embed_progress)
+            except Exception:
+                # Nothing was indexed, so the filter must not treat these chunks as seen
+                if self.deduplicator:
+                    for chunk_id in ids:
+                        self.deduplicator.discard(chunk_id)
+                raise
+
+        for entry, survivor_id in duplicates:
+            self._credit_duplicate(entry, survivor_id)
+        return len(chunks)
+
+    def _embed_and_add(self, chunks, ids, embed_progress=None):
+        texts = [chunk.page_content for chunk in chunks]
+        metadatas = [chunk.metadata for chunk in chunks]
+        vectors = self.embedding_pipeline.embed_documents(texts, progress_callback=embed_progress)
+
+        if self.vector_store is None:
+            index_type = self.index_type
+            if index_type == 'auto':
+                index_type = ann_index.choose_index_type(len(vectors))
+            if len(vectors) < ann_index.training_size(index_type, **self.index_params):
+                # Too few vectors to train a quantizer on; stage in a flat index until there are
+                index_type = 'flat'
+            index = ann_index.build_index(vectors, index_type, **self.index_params)
+            self.vector_store = FAISS(self.embeddings, index, InMemoryDocstore(), {})
+            self._originals, self._tombstones, self._chunk_labels = None, set(), {}
+            self.tune_search()
+        self.vector_store.docstore.add({
+            chunk_id: Document(page_content=text, metadata=metadata)
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        })
+        self._add_vectors(vectors, ids)
+        self._maybe_upgrade_index()
+        self._track_chunks(chunks, ids)
+        if self.lexical_index is not None:
+            for chunk_id, text in zip(ids, texts):
+                self.lexical_index.add(chunk_id, text)
+        self.index_version += 1
+
+    def _add_vectors(self, vectors, chunk_ids):
+        """Add vectors for chunks already in the docstore: by position in a flat index, by label otherwise"""
+        index = self.vector_store.index
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if ann_index.removes_in_place(index):
+            start = index.ntotal
+            index.add(vectors)
+            self.vector_store.index_to_docstore_id.update(enumerate(chunk_ids, start))
+            return
+
+        if self._originals is None:
+            self._originals = faiss.IndexFlatL2(index.d)
+        start = self._originals.ntotal
+        self._originals.add(vectors)
+        index.add_with_ids(vectors, np.arange(start, start + len(vectors), dtype=np.int64))
+        for label, chunk_id in enumerate(chunk_ids, start):
+            self.vector_store.index_to_docstore_id[label] = chunk_id
+            self._chunk_labels[chunk_id] = label
+
+    def _delete_chunks(self, chunk_ids):
+        index = self.vector_store.index
+        if ann_index.removes_in_place(index):
+            self.vector_store.delete(chunk_ids)
+            return
+
+        # The vectors stay in the index under tombstoned labels until it is compacted
+        for chunk_id in chunk_ids:
+            label = self._chunk_labels.pop(chunk_id)
+            del self.vector_store.index_to_docstore_id[label]
+            self._tombstones.add(label)
+        self.vector_store.docstore.delete(chunk_ids)
+        self._search_filter = None
+
+        if len(self._tombstones) > self.compact_ratio * index.ntotal:
+            self._compact()
+
+    def _compact(self):
+        """Rebuild the index without its tombstoned vectors"""
+        target = ann_index.index_type_of(self.vector_store.index)
+        if len(self.vector_store.index_to_docstore_id) < ann_index.training_size(target, **self.index_params):
+            # Too few vectors left to retrain on; stage in a flat index until the corpus grows back
+            target = 'flat'
+        self._rebuild_index(target)
+
+    def _maybe_upgrade_index(self):
+        """Rebuild the index once the corpus outgrows it.
+
+        'auto' moves up a tier as the corpus grows. An explicit IVF type is
+        built once enough vectors have arrived to train it (the flat staging
+        index before that), and retrained whenever the list count that suits
+        the corpus has doubled, so the quantizer is not stuck with the first
+        batch's clusters.
+        """
+        index = self.vector_store.index
+        ntotal = len(self.vector_store.index_to_docstore_id)
+        current = ann_index.index_type_of(index)
+
+        if self.index_type == 'auto':
+            tiers = [index_type for _, index_type in ann_index.AUTO_THRESHOLDS] + ['ivf_pq']
+            target = ann_index.choose_index_type(ntotal)
+            if current in tiers and tiers.index(target) > tiers.index(current):
+                self._rebuild_index(target)
+                return
+            target = current
+        else:
+            target = self.index_type
+            if current != target:
+                if ntotal >= ann_index.training_size(target, **self.index_params):
+                    self._rebuild_index(target)
+                return
+
+        nlist = ann_index.list_count(index)
+        if nlist and ann_index.ivf_lists(ntotal, self.index_params.get('nlist')) >= 2 * nlist:
+            self._rebuild_index(target)
+
+    def _rebuild_index(self, index_type):
+        """Rebuild the FAISS index as index_type from the live chunks' full-precision vectors.
+
+        They come from the originals kept beside an ID-mapped index, or from a
+        flat index itself, never from quantized codes. Tombstones are dropped.
+        """
+        index_to_id = self.vector_store.index_to_docstore_id
+        labels = sorted(index_to_id)
+        chunk_ids = [index_to_id[label] for label in labels]
+        source = self._originals if self._originals is not None else self.vector_store.index
+        vectors = source.reconstruct_batch(np.array(labels, dtype=np.int64)) if labels else \
+            np.empty((0, source.d), dtype=np.float32)
+
+        self.vector_store.index = ann_index.build_index(vectors, index_type, **self.index_params)
+        self.vector_store.index_to_docstore_id = {}
+        self._originals, self._tombstones, self._chunk_labels = None, set(), {}
+        self._add_vectors(vectors, chunk_ids)
+        self.tune_search()
+
+    def tune_search(self, nprobe=None, ef_search=None):
+        """Set recall/latency knobs (IVF nprobe, HNSW efSearch) on the current index.
+
+        A shared index keeps the settings it was published with.
+        """
+        if nprobe is not None:
+            self.search_params['nprobe'] = nprobe
+        if ef_search is not None:
+            self.search_params['ef_search'] = ef_search
+
+        if self.vector_store is not None and self.shared_index is None:
+            ann_index.tune_index(self.vector_store.index, **self.search_params)
+            self._search_filter = None
+            self.index_version += 1
+
+    def index_stats(self):
+        """Describe the FAISS index: type, size and memory footprint"""
+        if self.vector_store is None:
+            return {'index_type': None, 'vectors': 0, 'memory_bytes': 0, 'bytes_per_vector': 0.0,
+                    'tombstones': 0, 'originals_bytes': 0}
+
+        index = self.vector_store.index
+        memory_bytes = ann_index.index_memory_bytes(index)
+        return {
+            'index_type': ann_index.index_type_of(index),
+            'vectors': index.ntotal,
+            'memory_bytes': memory_bytes,
+            'bytes_per_vector': memory_bytes / index.ntotal if index.ntotal else 0.0,
+            # Removed vectors awaiting compaction, and the full-precision copies kept for rebuilds
+            'tombstones': len(self._tombstones),
+            'originals_bytes': self._originals.ntotal * self._originals.d * 4 if self._originals is not None else 0,
+            **self.search_params
+        }
+
+    def publish_shared(self, registry, name):
+        """Publish the current index to a registry so other sessions can attach to it.
+
+        Returns the published version number.
+        """
+        if not self.vector_store:
+            raise ValueError("No documents have been indexed yet")
+        if self._tombstones:
+            # Attached sessions search without a filter, so publish only live vectors
+            self._compact()
+
+        settings = {
+            'model': self._model_name(),
+            'chunk_size': self.chunk_size,
+            'chunk_overlap': self.chunk_overlap,
+            **self.search_params
+        }
+        return registry.publish(name, self.vector_store, settings)
+
+    def attach_shared(self, registry, name):
+        """Serve queries from a published index instead of a private one.
+
+        The index is memory-mapped, read-only and shared with every other
+        session in the process. Queries switch to newer versions as they are
+        published. Returns the attached version number.
+        """
+        shared = registry.acquire(name, self.embeddings)
+        if shared.settings.get('model', self._model_name()) != self._model_name():
+            registry.release(shared)
+            raise ValueError(f"'{name}' was built with {shared.settings['model']}, not {self._model_name()}")
+
+        self.detach_shared()
+        self.shared_index = shared
+        self._shared_registry = registry
+        # Also released if the session drops this processor without detaching
+        self._shared_release = weakref.finalize(self, registry.release, shared)
+
+        self.vector_store = shared.vector_store
+        self._originals, self._tombstones, self._chunk_labels, self._search_filter = None, set(), {}, None
+        self.source_chunk_ids = shared.source_chunk_ids
+        self.source_digests = {}
+        if self.lexical_index is not None:
+            self.lexical_index = shared.lexical_index
+        self.index_version += 1
+        return shared.version
+
+    def detach_shared(self):
+        """Let go of the shared index and start over with an empty private one"""
+        if self.shared_index is None:
+            return
+
+        self._shared_release()
+        self.shared_index = None
+        self._shared_registry = None
+        self._shared_release = None
+
+        self.vector_store = None
+        self._originals, self._tombstones, self._chunk_labels, self._search_filter = None, set(), {}, None
+        self.source_chunk_ids = {}
+        if self.lexical_index is not None:
+            self.lexical_index = BM25Index()
+        self.index_version += 1
+
+    def _refresh_shared(self):
+        """Hot-swap to the newest published version of the attached index"""
+        name = self.shared_index.name
+        version = self._shared_registry.current_version(name)
+        if version is None or version == self.shared_index.version:
+            return
+
+        try:
+            self.attach_shared(self._shared_registry, name)
+        except Exception as e:
+            st.warning(f"Could not load version {version} of {name}, still using version "
+                       f"{self.shared_index.version}: {str(e)}")
+
+    def _check_writable(self):
+        if self.shared_index is not None:
+            raise RuntimeError(
+                f"'{self.shared_index.name}' is a shared read-only index; call detach_shared() before changing documents"
+            )
+
+    def _credit_duplicate(self, entry, survivor_id):
+        """Record that a dropped duplicate from entry['source'] is represented by survivor_id"""
+        ids = self.source_chunk_ids.setdefault(entry['source'], [])
+        if survivor_id not in ids:
+            ids.append(survivor_id)
+
+        survivor = self.vector_store.docstore.search(survivor_id)
+        sources = survivor.metadata.setdefault('sources', [])
+        if entry not in sources:
+            sources.append(entry)
+
+    def _delete_source_chunks(self, source):
+        ids = self.source_chunk_ids.pop(source)
+
+        # Chunks that also stand for another source stay, minus this citation
+        still_used = {chunk_id for other_ids in self.source_chunk_ids.values() for chunk_id in other_ids}
+        for chunk_id in ids:
+            if chunk_id in still_used:
+                chunk = self.vector_store.docstore.search(chunk_id)
+                chunk.metadata['sources'] = [
+                    entry for entry in chunk.metadata.get('sources', []) if entry['source'] != source
+                ]
+                if chunk.metadata.get('source') == source and chunk.metadata['sources']:
+                    chunk.metadata['source'] = chunk.metadata['sources'][0]['source']
+
+        orphaned = [chunk_id for chunk_id in ids if chunk_id not in still_used]
+        if orphaned:
+            self._delete_chunks(orphaned)
+        self.index_version += 1
+        for chunk_id in orphaned:
+            if self.deduplicator:
+                self.deduplicator.discard(chunk_id)
+            if self.lexical_index is not None:
+                self.lexical_index.remove(chunk_id)
+        return len(orphaned)
+
+    def _track_chunks(self, chunks, ids):
+        for chunk, chunk_id in zip(chunks, ids):
+            for source in chunk_sources(chunk):
+                self.source_chunk_ids.setdefault(source, []).append(chunk_id)
+
+    def _rebuild_source_index(self):
+        """Recover the source -> chunk id mapping from a loaded vector store"""
+        self.source_chunk_ids = {}
+        if self.deduplicator:
+            self.deduplicator.clear()
+        if self.lexical_index is not None:
+            self.lexical_index.clear()
+
+        # Labels the saved docstore no longer maps were tombstoned before the save
+        index_to_id = self.vector_store.index_to_docstore_id
+        self._search_filter = None
+        if ann_index.removes_in_place(self.vector_store.index):
+            self._tombstones, self._chunk_labels = set(), {}
+        else:
+            self._tombstones = set(ann_index.labels_of(self.vector_store.index).tolist()) - set(index_to_id)
+            self._chunk_labels = {chunk_id: label for label, chunk_id in index_to_id.items()}
+
+        docstore = self.vector_store.docstore
+        for chunk_id in index_to_id.values():
+            doc = docstore.search(chunk_id)
+            for source in chunk_sources(doc):
+                self.source_chunk_ids.setdefault(source, []).append(chunk_id)
+            if self.deduplicator:
+                self.deduplicator.register(chunk_id, doc.page_content)
+            if self.lexical_index is not None:
+                self.lexical_index.add(chunk_id, doc.page_content)
+
+    def _load_cached(self, cache_key):
+        """Switch to the cached index for cache_key; False on a miss"""
+        vector_store = self.index_cache.get(cache_key, self.embeddings)
+        if vector_store is None:
+            return False
+
+        originals = None
+        if not ann_index.removes_in_place(vector_store.index):
+            # Without its full-precision vectors the index could only be rebuilt from lossy codes
+            originals = self.index_cache.get_originals(cache_key)
+            if originals is None:
+                return False
+
+        self.vector_store = vector_store
+        self._originals = originals
+        self._rebuild_source_index()
+        self.tune_search()
+        return True
+
+    def _save_to_cache(self, cache_key):
+        if not self.index_cache or cache_key is None:
+            return
+        try:
+            self.index_cache.put(cache_key, self.vector_store, self._originals)
+        except OSError as e:
+            st.warning(f"Could not cache vector store: {str(e)}")
+
+    @staticmethod
+    def _file_digest(uploaded_file):
+        return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+    @staticmethod
+    def _sources_of(documents):
+        return {doc.metadata.get('source', 'unknown') for doc in documents}
+
+    def _cache_key(self, sources, documents=()):
+        """Build the index cache key for a set of source documents"""
+        if all(source in self.source_digests for source in sources):
+            digests = [self.source_digests[source] for source in sources]
+        elif documents:
+            # Documents did not come through load_documents, so hash their text instead
+            digests = [hashlib.sha256(doc.page_content.encode()).hexdigest() for doc in documents]
+        else:
+            return None
+
+        return self._digest_key(digests)
+
+    def _digest_key(self, digests):
+        # Dedup drops chunks before indexing, so a different threshold is a different index
+        index_layout = {'index_type': self.index_type, **self.index_params,
+                        'dedup_threshold': self.deduplicator.threshold if self.deduplicator else None}
+        return IndexCache.make_key(digests, self.chunk_size, self.chunk_overlap, self._model_name(), index_layout)
+
+    def _model_name(self):
+        return f"{type(self.embeddings).__name__}:{self.embedding_model}"
+
     def get_relevant_documents(self, query, k=3):
         """Retrieve relevant documents for a query"""
-        if not self.vector_store:
+        return [doc for doc, _ in self.get_scored_documents(query, k)]
+
+    async def aget_relevant_documents(self, query, k=3):
+        """Async get_relevant_documents"""
+        return [doc for doc, _ in await self.aget_scored_documents(query, k)]
+
+    def get_scored_documents(self, query, k=3):
+        """Retrieve (document, score) pairs for a query, best first.
+
+        Scores come from whichever retrieval path answered (BM25, fused rank
+        or vector similarity), so only compare them within one result list.
+        """
+        cache_key, results = self._cached_results(query, k)
+        if results is not None:
+            return results
+
+        try:
+            return self._store_results(cache_key, self._retrieve(query, k))
+        except Exception as e:
+            st.error(f"Error retrieving documents: {str(e)}")
             return []
-        
+
+    async def aget_scored_documents(self, query, k=3):
+        """Async get_scored_documents; only the query embedding call is awaited,
+        the in-memory BM25 and FAISS lookups are fast enough to run inline.
+        """
+        cache_key, results = self._cached_results(query, k)
+        if results is not None:
+            return results
+
         try:
-            docs = self.vector_store.similarity_search(query, k=k)
-            return docs
+            lexical, fetch_k, ranked = self._lexical_stage(query, k)
+            if ranked is None:
+                ranked = self._fuse(self._vector_search(await self.aembed_query(query), fetch_k), lexical, k)
+            return self._store_results(cache_key, ranked)
         except Exception as e:
             st.error(f"Error retrieving documents: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+
+    def _cached_results(self, query, k):
+        """Return (cache_key, results); results is [] with no index and None on a cache miss"""
+        if self.shared_index is not None:
+            self._refresh_shared()
+        if not self.vector_store:
+            return None, []
+
+        cache_key = (normalize_query(query), k, self.index_version)
+        results = self.result_cache.get(cache_key)
+        return cache_key, list(results) if results is not None else None
+
+    def _store_results(self, cache_key, ranked):
+        docstore = self.vector_store.docstore
+        results = [(docstore.search(chunk_id), score) for chunk_id, score in ranked]
+        self.result_cache.put(cache_key, results)
+        return list(results)
+
+    def _retrieve(self, query, k):
+        """Rank chunk ids for a query as (chunk_id, score) pairs, best first"""
+        lexical, fetch_k, ranked = self._lexical_stage(query, k)
+        if ranked is None:
+            ranked = self._fuse(self._vector_search(self.embed_query(query), fetch_k), lexical, k)
+        return ranked
+
+    def _lexical_stage(self, query, k):
+        """Keyword half of retrieval.
+
+        Returns (lexical hits, k for the vector search, ranking). The ranking
+        is only set when the lexical fast path already answered the query.
+        """
+        if self.lexical_index is None or not len(self.lexical_index):
+            self.retrieval_paths['vector'] += 1
+            return None, k, None
+
+        fetch_k = max(k * 4, 20)
+        lexical = self.lexical_index.search(query, fetch_k)
+
+        # Lexical fast path: a strong, unambiguous keyword match skips the embedding call
+        if lexical and self.lexical_confidence is not None:
+            top_id, top_score = lexical[0]
+            runner_up = lexical[1][1] if len(lexical) > 1 else 0.0
+            if (self.lexical_index.coverage(query, top_id) >= self.lexical_confidence
+                    and top_score >= self.lexical_margin * runner_up):
+                self.retrieval_paths['lexical'] += 1
+                return lexical, fetch_k, lexical[:k]
+
+        self.retrieval_paths['hybrid'] += 1
+        return lexical, fetch_k, None
+
+    @staticmethod
+    def _fuse(dense, lexical, k):
+        if lexical is None:
+            return dense[:k]
+        fused = reciprocal_rank_fusion([
+            [chunk_id for chunk_id, _ in dense],
+            [chunk_id for chunk_id, _ in lexical]
+        ])
+        # Raw fused scores all sit near 1/61; as a share of the best attainable (first in both
+        # lists) they run 0..1, and a hit only one retriever found scores at most 0.5
+        best_possible = 2.0 / (RRF_K + 1)
+        return [(chunk_id, score / best_possible) for chunk_id, score in fused[:k]]
+
+    def _vector_search(self, embedding, k):
+        index = self.vector_store.index
+        if self._tombstones and self._search_filter is None:
+            self._search_filter = ann_index.search_excluding(index, self._tombstones)
+        with self.metrics.span('vector_search', k=k):
+            scores, indices = index.search(np.array([embedding], dtype=np.float32), k,
+                                           params=self._search_filter if self._tombstones else None)
+        index_to_id = self.vector_store.index_to_docstore_id
+
+        # FAISS returns L2 distances; map them to a higher-is-better similarity
+        return [(index_to_id[i], 1.0 / (1.0 + float(distance))) for distance, i in zip(scores[0], indices[0])
+                if i in index_to_id]
+
+    def document_match(self, query):
+        """IDF-weighted share of the query's content words found in its best keyword match (0..1).
+
+        None when there is no keyword index or the query has no content words.
+        """
+        if self.lexical_index is None or not len(self.lexical_index):
+            return None
+        content = " ".join(term for term in tokenize(query) if term not in STOPWORDS)
+        if not content:
+            return None
+        hits = self.lexical_index.search(content, 1)
+        return self.lexical_index.coverage(content, hits[0][0]) if hits else 0.0
+
+    def embed_query(self, query):
+        """Embed a query, reusing the vector for previously seen phrasings"""
+        with self.metrics.span('embed_query'):
+            return embed_query_cached(self.embeddings, self.embedding_model, query, self.query_embedding_cache,
+                                      self.query_batcher)
+
+    async def aembed_query(self, query):
+        """Async embed_query, using the embedding client's async API"""
+        with self.metrics.span('embed_query'):
+            return await aembed_query_cached(self.embeddings, self.embedding_model, query, self.query_embedding_cache,
+                                             self.query_batcher)
+
+    def cached_query_embedding(self, query):
+        """The query's vector if it has been embedded already (e.g. by retrieval), else None"""
+        return cached_query_embedding(self.embeddings, self.embedding_model, query, self.query_embedding_cache)
+
+    def cache_scope(self):
+        """Identify the current index contents, for caches of answers derived from them"""
+        if self.shared_index is not None:
+            return ('shared', self.shared_index.name, self.shared_index.version)
+        return (self.index_id, self.index_version)
+
+    def cache_stats(self):
+        """Hit/miss counters for the query embedding and retrieval result caches"""
+        return {
+            'query_embeddings': self.query_embedding_cache.stats(),
+            'results': self.result_cache.stats(),
+            'retrieval_paths': dict(self.retrieval_paths),
+            'index_version': self.index_version
+        }
@@ -0,0 +1,131 @@
+# utils/embedding_pipeline.py
+import re
+import math
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from langchain.embeddings.base import Embeddings
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic local embedding backend for offline runs and benchmarks.
+
+    Words are hashed into a fixed number of buckets, so texts that share
+    vocabulary get similar vectors. `latency` simulates the per-request
+    round-trip of a remote API.
+    """
+
+    def __init__(self, dimensions=256, latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.calls = 0
+
+    def _embed(self, text):
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r'\w+', text.lower()):
+            bucket = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), 'little')
+            vector[bucket % self.dimensions] += 1.0
+
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class TokenBucket:
+    """Thread-safe token bucket that blocks callers until a token is available"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_rate_limit_error(error):
+    """Check whether an exception from an embedding client means we were throttled"""
+    status = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    if status == 429:
+        return True
+
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in ('429', 'resourceexhausted', 'resource exhausted', 'rate limit', 'quota'))
+
+
+class EmbeddingPipeline:
+    """Embed texts in batches with bounded concurrency, rate limiting and retries"""
+
+    def __init__(self, embeddings, batch_size=64, max_concurrency=4, requests_per_minute=None,
+                 max_retries=5, initial_backoff=1.0, max_backoff=60.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = TokenBucket(requests_per_minute / 60.0) if requests_per_minute else None
+
+    def embed_documents(self, texts, progress_callback=None):
+        """Embed texts and return their vectors in input order.
+
+        progress_callback(done_texts, total_texts) is invoked on the calling
+        thread after each batch, so it is safe to update Streamlit widgets.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        results = [None] * len(batches)
+        done = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {executor.submit(self._embed_batch, batch): index for index, batch in enumerate(batches)}
+            for future in as_completed(futures):
+                index = futures[future]
+                results[index] = future.result()
+                done += len(batches[index])
+                if progress_callback:
+                    progress_callback(done, len(texts))
+
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def _embed_batch(self, batch):
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+
+            try:
+                return self.embeddings.embed_documents(batch)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+
+                # Exponential backoff with jitter so throttled workers do not retry in lockstep
+                delay = min(self.max_backoff, self.initial_backoff * (2 ** attempt))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                attempt += 1
@@ -0,0 +1,57 @@
+# utils/file_parsers.py
+"""
+Parse uploaded files straight from their bytes.
+
+Kept free of langchain/streamlit imports so process-pool workers start quickly.
+Each parser yields (text, metadata) tuples, one per page for PDFs.
+"""
+
+import io
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.txt')
+
+def is_supported(file_name):
+    """Check whether a file type can be parsed"""
+    return file_name.lower().endswith(SUPPORTED_EXTENSIONS)
+
+def iter_file_pages(file_name, data):
+    """Yield (text, metadata) for each page of a file without touching disk"""
+    name = file_name.lower()
+    if name.endswith('.pdf'):
+        return _iter_pdf_pages(file_name, data)
+    elif name.endswith('.docx'):
+        return _iter_docx(file_name, data)
+    elif name.endswith('.txt'):
+        return _iter_txt(file_name, data)
+    raise ValueError(f"Unsupported file type: {file_name}")
+
+def parse_file(file_name, data):
+    """Parse a whole file into a list of (text, metadata) pages"""
+    return list(iter_file_pages(file_name, data))
+
+def _iter_pdf_pages(file_name, data):
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(io.BytesIO(data))
+    for page_number, page in enumerate(reader.pages):
+        yield page.extract_text() or "", {'source': file_name, 'page': page_number}
+
+def _iter_docx(file_name, data):
+    import docx
+
+    document = docx.Document(io.BytesIO(data))
+    parts = [paragraph.text for paragraph in document.paragraphs]
+
+    # Table text is not part of document.paragraphs
+    for table in document.tables:
+        for row in table.rows:
+            parts.append("\t".join(cell.text for cell in row.cells))
+
+    yield "\n".join(parts), {'source': file_name}
+
+def _iter_txt(file_name, data):
+    try:
+        text = bytes(data).decode('utf-8')
+    except UnicodeDecodeError:
+        text = bytes(data).decode('latin-1')
+    yield text, {'source': file_name}
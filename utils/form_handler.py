@@ -1,18 +1,35 @@
 # utils/form_handler.py
-import re
-import phonenumbers
-from email_validator import validate_email, EmailNotValidError
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from .validators import get_validators
+from .appointment_store import get_appointment_store, sort_time, SlotTaken
+from .availability import get_availability, format_slot
+
+FIELDS = ('name', 'phone', 'email', 'appointment_date', 'appointment_time', 'purpose')
+
+
+@dataclass(slots=True)
+class FormState:
+    """Everything needed to resume a form in another process (see utils/session_state.py)"""
+    state: str = 'idle'
+    current_field: str = None
+    fields: tuple = (None,) * len(FIELDS)  # values in FIELDS order
+    appointment_id: int = None
+    suggested_slots: tuple = ()
+
 
 class FormHandler:
-    def __init__(self):
-        self.form_fields = {
-            'name': None,
-            'phone': None,
-            'email': None,
-            'appointment_date': None,
-            'appointment_time': None,
-            'purpose': None
-        }
+    def __init__(self, validators=None, store=None, availability=None):
+        # Shared, memoized field rules (see utils/validators.py)
+        self.validators = validators or get_validators()
+        # Completed bookings are saved here; the shared appointments.db store by default
+        self.store = store
+        # Cached slot occupancy for checks and suggestions; the engine shared by every session on the store by default
+        self.availability = availability
+        self.suggested_slots = []  # (YYYY-MM-DD, HH:MM) offered when the requested time was taken
+        self.appointment_id = None
+        self.form_fields = dict.fromkeys(FIELDS)
         self.form_state = 'idle'  # idle, collecting, complete
         self.current_field = None
         
@@ -44,13 +61,9 @@ class FormHandler:
     
     def _process_name(self, name):
         """Process and validate name input"""
-        name = name.strip()
-        
-        if len(name) < 2:
-            return "Please provide your full name (at least 2 characters)."
-        
-        if not re.match(r'^[a-zA-Z\s\-\.\']+$', name):
-            return "Please provide a valid name using only letters, spaces, hyphens, dots, and apostrophes."
+        name, error = self.validators.validate_name(name)
+        if error:
+            return error
         
         self.form_fields['name'] = name
         self.current_field = 'phone'
@@ -58,94 +71,108 @@ class FormHandler:
     
     def _process_phone(self, phone):
         """Process and validate phone number"""
-        phone = phone.strip()
+        formatted_phone, error = self.validators.validate_phone(phone)
+        if error:
+            return error
         
-        try:
-            # Try to parse phone number
-            parsed_phone = phonenumbers.parse(phone, "US")  # Default to US, can be adjusted
-            
-            if not phonenumbers.is_valid_number(parsed_phone):
-                return "Please provide a valid phone number."
-            
-            # Format phone number
-            formatted_phone = phonenumbers.format_number(parsed_phone, phonenumbers.PhoneNumberFormat.NATIONAL)
-            
-            self.form_fields['phone'] = formatted_phone
-            self.current_field = 'email'
-            return f"Got it! Your phone number is {formatted_phone}. What's your email address?"
-            
-        except phonenumbers.NumberParseException:
-            return "Please provide a valid phone number (e.g., +1-234-567-8900 or (234) 567-8900)."
+        self.form_fields['phone'] = formatted_phone
+        self.current_field = 'email'
+        return f"Got it! Your phone number is {formatted_phone}. What's your email address?"
     
     def _process_email(self, email):
         """Process and validate email address"""
-        email = email.strip().lower()
+        normalized_email, error = self.validators.validate_email(email)
+        if error:
+            return error
         
-        try:
-            # Validate email
-            validated_email = validate_email(email)
-            normalized_email = validated_email.email
-            
-            self.form_fields['email'] = normalized_email
-            self.current_field = 'appointment_date'
-            return f"Perfect! Your email is {normalized_email}. When would you like to schedule the appointment? (You can say things like 'next Monday', 'tomorrow', or provide a specific date)"
-            
-        except EmailNotValidError:
-            return "Please provide a valid email address (e.g., john@example.com)."
+        self.form_fields['email'] = normalized_email
+        self.current_field = 'appointment_date'
+        return f"Perfect! Your email is {normalized_email}. When would you like to schedule the appointment? (You can say things like 'next Monday', 'tomorrow', or provide a specific date)"
     
     def _process_appointment_date(self, date_input):
         """Process appointment date with date extraction"""
-        from .date_extractor import DateExtractor
-        
-        date_extractor = DateExtractor()
-        extracted_date = date_extractor.extract_date(date_input)
-        
-        if not extracted_date:
-            return "I couldn't understand the date. Please provide a date like 'next Monday', 'tomorrow', or in YYYY-MM-DD format."
-        
-        is_valid, message = date_extractor.validate_date(extracted_date)
+        extracted_date, error = self.validators.validate_date(date_input)
+        if error:
+            return error
         
-        if not is_valid:
-            return f"Invalid date: {message}. Please provide a future date."
+        formatted_date = self.validators.date_extractor().format_date_display(extracted_date)
+        try:
+            availability = self._availability()
+        except sqlite3.Error:
+            return "Sorry, I couldn't check the calendar just now. Please send the date again."
+        # Catch weekends and holidays now rather than after the user has picked a time
+        if not availability.is_open(extracted_date):
+            reason = "that's a holiday" if extracted_date in availability.holidays else "we're closed that day"
+            return f"Sorry, {formatted_date} doesn't work: {reason}. Which other day would suit you?"
         
         self.form_fields['appointment_date'] = extracted_date
-        formatted_date = date_extractor.format_date_display(extracted_date)
         
         self.current_field = 'appointment_time'
         return f"Great! I've scheduled it for {formatted_date}. What time would you prefer? (e.g., 10:00 AM, 2:30 PM)"
     
     def _process_appointment_time(self, time_input):
-        """Process and validate appointment time"""
-        time_input = time_input.strip().upper()
-        
-        # Basic time validation patterns
-        time_patterns = [
-            r'^([0-9]|1[0-2]):[0-5][0-9]\s?(AM|PM)$',  # 12-hour format
-            r'^([0-9]|1[0-9]|2[0-3]):[0-5][0-9]$',     # 24-hour format
-            r'^([0-9]|1[0-2])\s?(AM|PM)$',             # Hour only 12-hour
-        ]
-        
-        valid_time = False
-        for pattern in time_patterns:
-            if re.match(pattern, time_input):
-                valid_time = True
-                break
-        
-        if not valid_time:
-            return "Please provide a valid time format (e.g., 10:00 AM, 14:30, or 2 PM)."
+        """Process and validate appointment time, offering the nearest free slots if it is taken"""
+        choice = time_input.strip().rstrip('.')
+        if choice.isdigit() and 1 <= int(choice) <= len(self.suggested_slots):
+            # The user picked one of the slots offered last turn, possibly on another day
+            day, start = self.suggested_slots[int(choice) - 1]
+            self.form_fields['appointment_date'] = day
+            time_input = datetime.strptime(start, '%H:%M').strftime('%I:%M %p').lstrip('0')
+        else:
+            time_input, error = self.validators.validate_time(time_input)
+            if error:
+                return error
+            day, start = self.form_fields['appointment_date'], sort_time(time_input)
         
+        try:
+            availability = self._availability()
+        except sqlite3.Error:
+            return "Sorry, I couldn't check the calendar just now. Please send the time again."
+        reason = availability.check(day, start)
+        if reason:
+            self.suggested_slots = availability.nearest_free(day, start)
+            return self._suggest_slots(f"Sorry, {time_input} on {day} isn't available: {reason}.")
+        
+        self.suggested_slots = []
         self.form_fields['appointment_time'] = time_input
         self.current_field = 'purpose'
-        return f"Perfect! Time set for {time_input}. Finally, could you briefly tell me the purpose of this call or meeting?"
+        return f"Perfect! Time set for {time_input} on {day}. Finally, could you briefly tell me the purpose of this call or meeting?"
+    
+    def _suggest_slots(self, message):
+        """Append the offered alternatives (self.suggested_slots) to message"""
+        if not self.suggested_slots:
+            return f"{message} I couldn't find a free slot in the next two weeks; please try another time."
+        options = "\n".join(f"{i}. {format_slot(day, start)}" for i, (day, start) in enumerate(self.suggested_slots, 1))
+        return f"{message} The nearest free times are:\n{options}\nReply with a number to take one, or give me another time."
+    
+    def _availability(self):
+        return self.availability or get_availability(self.store)
     
     def _process_purpose(self, purpose):
         """Process the purpose of the appointment"""
-        purpose = purpose.strip()
-        
-        if len(purpose) < 5:
-            return "Please provide a brief description of the purpose (at least 5 characters)."
+        purpose, error = self.validators.validate_purpose(purpose)
+        if error:
+            return error
         
         self.form_fields['purpose'] = purpose
+        day, start = self.form_fields['appointment_date'], sort_time(self.form_fields['appointment_time'])
+        try:
+            availability = self._availability()
+            store = self.store or get_appointment_store()
+            try:
+                # The store re-checks the slot in its insert transaction, against every worker's bookings
+                self.appointment_id = store.add(self.form_fields, capacity=availability.capacity)
+            except SlotTaken:
+                # Taken since the time was accepted (another session, worker or import); catch up first
+                availability.load(store)
+                self.suggested_slots = availability.nearest_free(day, start)
+                self.current_field = 'appointment_time'
+                return self._suggest_slots("Sorry, that slot was just booked by someone else.")
+            availability.record(day, start)
+        except (sqlite3.Error, RuntimeError):
+            # Only confirm what was actually saved; the user can send the purpose again
+            return "Sorry, I couldn't save your appointment just now. Please send the purpose again to retry."
+        
         self.form_state = 'complete'
         self.current_field = None
         
@@ -156,7 +183,7 @@ class FormHandler:
         confirmation = f"""
 Perfect! I've collected all the information. Here's your appointment summary:
 
-📝 **Appointment Details:**
+📝 **Appointment Details:** (reference #{self.appointment_id})
 • **Name:** {self.form_fields['name']}
 • **Phone:** {self.form_fields['phone']}
 • **Email:** {self.form_fields['email']}
@@ -174,6 +201,8 @@ Is there anything else I can help you with?
     def reset_form(self):
         """Reset the form to initial state"""
         self.form_fields = {key: None for key in self.form_fields}
+        self.appointment_id = None
+        self.suggested_slots = []
         self.form_state = 'idle'
         self.current_field = None
     
@@ -185,6 +214,24 @@ Is there anything else I can help you with?
             'fields': self.form_fields.copy()
         }
     
+    def export_state(self):
+        """Snapshot of the form's progress as a FormState"""
+        return FormState(
+            state=self.form_state,
+            current_field=self.current_field,
+            fields=tuple(self.form_fields[field] for field in FIELDS),
+            appointment_id=self.appointment_id,
+            suggested_slots=tuple(tuple(slot) for slot in self.suggested_slots)
+        )
+    
+    def restore_state(self, state):
+        """Continue from a FormState, e.g. one saved by another worker"""
+        self.form_state = state.state
+        self.current_field = state.current_field
+        self.form_fields = dict(zip(FIELDS, state.fields))
+        self.appointment_id = state.appointment_id
+        self.suggested_slots = [tuple(slot) for slot in state.suggested_slots]
+    
     def is_form_complete(self):
         """Check if form collection is complete"""
         return self.form_state == 'complete'
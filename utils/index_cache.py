@@ -0,0 +1,123 @@
+# utils/index_cache.py
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import faiss
+from langchain.vectorstores import FAISS
+
+# Full-precision vectors saved beside an ID-mapped index, so it can be rebuilt after loading
+ORIGINALS_FILE = "originals.faiss"
+
+
+class IndexCache:
+    """Content-addressed on-disk cache of FAISS indexes with LRU eviction"""
+
+    def __init__(self, cache_dir=".index_cache", max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_digests, chunk_size, chunk_overlap, model_name, index_layout=None):
+        """Build a cache key from file contents and the settings that shape the index"""
+        hasher = hashlib.sha256()
+
+        # Upload order does not change what ends up in the index
+        for digest in sorted(file_digests):
+            hasher.update(digest.encode())
+
+        settings = {
+            'chunk_size': chunk_size,
+            'chunk_overlap': chunk_overlap,
+            'model': model_name,
+            'index_layout': index_layout or {}
+        }
+        hasher.update(json.dumps(settings, sort_keys=True).encode())
+        return hasher.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, embeddings):
+        """Load a cached index, or return None on a miss"""
+        path = self._entry_path(key)
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            vector_store = FAISS.load_local(
+                path,
+                embeddings,
+                allow_dangerous_deserialization=True
+            )
+        except Exception:
+            # A corrupt or partial entry is treated as a miss and dropped
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        # Directory mtime doubles as the last-used timestamp for LRU
+        os.utime(path)
+        return vector_store
+
+    def get_originals(self, key):
+        """Load the full-precision vectors saved with an index, or return None"""
+        path = os.path.join(self._entry_path(key), ORIGINALS_FILE)
+        try:
+            return faiss.read_index(path)
+        except RuntimeError:
+            return None
+
+    def put(self, key, vector_store, originals=None):
+        """Save an index (and its original vectors, if given) under the given key and enforce the disk budget"""
+        path = self._entry_path(key)
+
+        # Write to a scratch directory first so readers never see a half-written entry
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            vector_store.save_local(tmp_path)
+            if originals is not None:
+                faiss.write_index(originals, os.path.join(tmp_path, ORIGINALS_FILE))
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            path = self._entry_path(name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = self._dir_size(path)
+            entries.append((os.path.getmtime(path), name, size))
+            total += size
+
+        entries.sort()
+        for _, name, size in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self._entry_path(name), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every cached index"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _dir_size(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for file_name in files:
+                size += os.path.getsize(os.path.join(root, file_name))
+        return size
@@ -0,0 +1,220 @@
+# utils/index_registry.py
+"""
+Published, read-only vector indexes shared across sessions and processes.
+
+A published index lives on disk as numbered versions:
+
+    <root_dir>/<name>/v<N>/index.faiss   FAISS index (memory-mapped on load)
+    <root_dir>/<name>/v<N>/index.pkl     (docstore, index_to_docstore_id), as FAISS.save_local writes it
+    <root_dir>/<name>/v<N>/settings.json model and search settings of the publisher
+    <root_dir>/<name>/CURRENT            number of the live version
+
+Each process loads a version once and every attached session shares it.
+The FAISS index is opened with mmap, so its vectors live in the OS page
+cache and are shared by every worker process on the machine as well.
+"""
+
+import os
+import json
+import pickle
+import shutil
+import tempfile
+import threading
+import faiss
+from langchain.vectorstores import FAISS
+from .lexical_index import BM25Index
+from .chunk_dedup import chunk_sources
+from . import ann_index
+
+# Zero-copy, read-only mapping of the index file
+MMAP_FLAGS = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+
+class SharedIndex:
+    """One loaded version of a published index; treat every attribute as read-only"""
+
+    def __init__(self, name, version, vector_store, lexical_index, source_chunk_ids, settings):
+        self.name = name
+        self.version = version
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.source_chunk_ids = source_chunk_ids
+        self.settings = settings
+        self.refcount = 0
+
+
+class IndexRegistry:
+    """Publish indexes to disk and hand out refcounted, memory-mapped views of them"""
+
+    def __init__(self, root_dir=".shared_indexes", keep_versions=2):
+        self.root_dir = root_dir
+        self.keep_versions = keep_versions
+        self._loaded = {}    # (name, version) -> SharedIndex
+        self._current = {}   # name -> ((inode, mtime), version) of the CURRENT file
+        self._lock = threading.Lock()
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _index_dir(self, name):
+        return os.path.join(self.root_dir, name)
+
+    def _version_dir(self, name, version):
+        return os.path.join(self._index_dir(name), f"v{version}")
+
+    def versions(self, name):
+        """Version numbers of an index that exist on disk, oldest first"""
+        index_dir = self._index_dir(name)
+        if not os.path.isdir(index_dir):
+            return []
+        return sorted(
+            int(entry[1:]) for entry in os.listdir(index_dir)
+            if entry.startswith('v') and entry[1:].isdigit()
+        )
+
+    def current_version(self, name):
+        """Version that new attachments get, or None if nothing is published"""
+        pointer = os.path.join(self._index_dir(name), 'CURRENT')
+        try:
+            stat = os.stat(pointer)
+        except FileNotFoundError:
+            return None
+
+        # CURRENT is replaced rather than rewritten, so a new inode means a new version
+        signature = (stat.st_ino, stat.st_mtime_ns)
+        cached = self._current.get(name)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        with open(pointer) as f:
+            version = int(f.read().strip())
+        self._current[name] = (signature, version)
+        return version
+
+    def publish(self, name, vector_store, settings=None):
+        """Write vector_store as the next version of name and make it current.
+
+        Sessions already attached keep their version until they refresh.
+        Returns the new version number.
+        """
+        index_dir = self._index_dir(name)
+        os.makedirs(index_dir, exist_ok=True)
+
+        tmp_path = tempfile.mkdtemp(dir=index_dir, prefix=".tmp-")
+        try:
+            faiss.write_index(vector_store.index, os.path.join(tmp_path, 'index.faiss'))
+            with open(os.path.join(tmp_path, 'index.pkl'), 'wb') as f:
+                pickle.dump((vector_store.docstore, vector_store.index_to_docstore_id), f)
+            with open(os.path.join(tmp_path, 'settings.json'), 'w') as f:
+                json.dump(settings or {}, f)
+
+            # Another publisher may claim a version number first; take the next one
+            version = max(self.versions(name), default=0) + 1
+            while True:
+                try:
+                    os.rename(tmp_path, self._version_dir(name, version))
+                    break
+                except OSError:
+                    if not os.path.exists(self._version_dir(name, version)):
+                        raise
+                    version += 1
+        finally:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+        fd, pointer_tmp = tempfile.mkstemp(dir=index_dir, prefix=".tmp-")
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(version))
+        os.replace(pointer_tmp, os.path.join(index_dir, 'CURRENT'))
+
+        self._prune(name, version)
+        return version
+
+    def acquire(self, name, embeddings):
+        """Attach to the current version of a published index.
+
+        The version is loaded on first use in this process and shared after
+        that. Pair every acquire with a release.
+        """
+        version = self.current_version(name)
+        if version is None:
+            raise KeyError(f"No published index named '{name}'")
+
+        with self._lock:
+            shared = self._loaded.get((name, version))
+            if shared is None:
+                shared = self._load(name, version, embeddings)
+                self._loaded[(name, version)] = shared
+            shared.refcount += 1
+            self._unload_unused(name, keep=version)
+            return shared
+
+    def release(self, shared):
+        """Detach from a shared index; old versions are unloaded once unused"""
+        with self._lock:
+            shared.refcount = max(shared.refcount - 1, 0)
+            self._unload_unused(shared.name, keep=self.current_version(shared.name))
+
+    def stats(self):
+        """Loaded versions with their vector count and number of attached sessions"""
+        with self._lock:
+            return [
+                {
+                    'name': shared.name,
+                    'version': shared.version,
+                    'vectors': shared.vector_store.index.ntotal,
+                    'refcount': shared.refcount
+                }
+                for shared in self._loaded.values()
+            ]
+
+    def _load(self, name, version, embeddings):
+        path = self._version_dir(name, version)
+        index = faiss.read_index(os.path.join(path, 'index.faiss'), MMAP_FLAGS)
+        with open(os.path.join(path, 'index.pkl'), 'rb') as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        with open(os.path.join(path, 'settings.json')) as f:
+            settings = json.load(f)
+
+        # Search knobs are per-object attributes, so set them once for every session
+        ann_index.tune_index(index, settings.get('nprobe'), settings.get('ef_search'))
+        vector_store = FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+        lexical_index = BM25Index()
+        source_chunk_ids = {}
+        for chunk_id in index_to_docstore_id.values():
+            doc = docstore.search(chunk_id)
+            lexical_index.add(chunk_id, doc.page_content)
+            for source in chunk_sources(doc):
+                source_chunk_ids.setdefault(source, []).append(chunk_id)
+
+        return SharedIndex(name, version, vector_store, lexical_index, source_chunk_ids, settings)
+
+    def _unload_unused(self, name, keep):
+        for key, shared in list(self._loaded.items()):
+            if key[0] == name and key[1] != keep and shared.refcount == 0:
+                del self._loaded[key]
+
+    def _prune(self, name, current):
+        """Delete old versions beyond keep_versions that this process is not using.
+
+        Other processes may still have them mapped; on POSIX their mapping
+        stays valid after the files are unlinked.
+        """
+        with self._lock:
+            in_use = {key[1] for key, shared in self._loaded.items() if key[0] == name and shared.refcount}
+        old_versions = [version for version in self.versions(name) if version != current]
+        for version in old_versions[:max(len(old_versions) - self.keep_versions + 1, 0)]:
+            if version not in in_use:
+                shutil.rmtree(self._version_dir(name, version), ignore_errors=True)
+
+
+# One registry per root directory per process, so every session shares the loaded indexes
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_index_registry(root_dir=".shared_indexes"):
+    """Return the process-wide registry for a root directory"""
+    key = os.path.abspath(root_dir)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = IndexRegistry(root_dir)
+        return _registries[key]
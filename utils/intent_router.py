@@ -0,0 +1,230 @@
+# utils/intent_router.py
+"""
+Local intent routing for chat turns.
+
+Obvious turns go straight to a tool instead of through the ReAct agent,
+which spends an extra LLM call choosing the tool and often one more
+rephrasing its output. Routing happens in two stages:
+1. a compiled keyword matcher for phrases that are unambiguous on their own
+2. a TF-IDF nearest-centroid classifier trained on the example phrases below
+
+Turns the classifier is unsure about are left to the agent, and so are
+"document" questions whose words barely occur in the indexed documents.
+"""
+
+import re
+import json
+import math
+import time
+from collections import Counter, deque
+
+BOOKING = 'booking'
+DOCUMENT = 'document'
+GENERAL = 'general'
+AGENT = 'agent'
+
+# Phrases that decide the intent on their own
+KEYWORDS = {
+    BOOKING: ['call me', 'book appointment', 'schedule call', 'contact me', 'arrange call',
+              'book an appointment', 'schedule a call', 'arrange a call', 'set up a call',
+              'schedule an appointment', 'make an appointment'],
+    DOCUMENT: ['the document', 'the documents', 'the uploaded', 'the file', 'the pdf',
+               'according to the', 'in the report', 'in the policy'],
+}
+
+EXAMPLES = {
+    BOOKING: [
+        "can someone call me tomorrow",
+        "i would like to book a meeting",
+        "schedule a meeting for next monday",
+        "please ring me back",
+        "can we set up a time to talk",
+        "i want to talk to someone on the phone",
+        "reserve a slot with your team",
+        "get in touch with me",
+    ],
+    DOCUMENT: [
+        "what does the document say about refunds",
+        "summarize the key points",
+        "give me a summary of the report",
+        "what is the policy on returns",
+        "according to the contract when does it expire",
+        "list the requirements mentioned in the file",
+        "what are the terms and conditions",
+        "find the section about pricing",
+        "explain the process described in the manual",
+        "what deadline is mentioned",
+    ],
+    GENERAL: [
+        "hello",
+        "hi there",
+        "good morning",
+        "thanks",
+        "thank you so much",
+        "how are you",
+        "who are you",
+        "what can you do",
+        "tell me a joke",
+        "bye",
+        "what is machine learning",
+        "explain how neural networks work",
+    ],
+}
+
+
+def _terms(text):
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+class IntentRouter:
+    """Route a chat turn to booking, document or general handling, or defer to the agent"""
+
+    def __init__(self, threshold=0.6, temperature=0.1, min_document_match=0.5, keywords=None,
+                 examples=None, log_size=1000, log_path=None, log_text=False):
+        self.threshold = threshold
+        self.temperature = temperature
+        self.min_document_match = min_document_match
+        # Decisions keep the route, scores and reason; the user's words only with log_text=True,
+        # since they can hold names, phone numbers and the like
+        self.log_path = log_path
+        self.log_text = log_text
+        self.decisions = deque(maxlen=log_size)
+
+        # One alternation per intent; the regex engine scans the text once per intent
+        self.keyword_patterns = {
+            intent: re.compile(r'\b(?:' + '|'.join(re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True)) + r')\b')
+            for intent, phrases in (keywords or KEYWORDS).items()
+        }
+        self._train(examples or EXAMPLES)
+
+    def _train(self, examples):
+        """Build IDF weights and one normalized TF-IDF centroid per intent"""
+        documents = [(intent, Counter(_terms(text))) for intent, texts in examples.items() for text in texts]
+        document_frequency = Counter(term for _, counts in documents for term in counts)
+        self.idf = {
+            term: math.log((1 + len(documents)) / (1 + df)) + 1
+            for term, df in document_frequency.items()
+        }
+
+        self.centroids = {}
+        for intent in examples:
+            centroid = Counter()
+            for label, counts in documents:
+                if label == intent:
+                    centroid.update(self._vectorize(counts))
+            self.centroids[intent] = self._normalize(centroid)
+
+    def _vectorize(self, counts):
+        return self._normalize({term: tf * self.idf[term] for term, tf in counts.items() if term in self.idf})
+
+    @staticmethod
+    def _normalize(vector):
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def match_keywords(self, text, intent=BOOKING):
+        """Whether text contains one of the deciding phrases for an intent"""
+        pattern = self.keyword_patterns.get(intent)
+        return bool(pattern and pattern.search(text.lower()))
+
+    def classify(self, text, intents=None):
+        """Return {intent: probability} from the TF-IDF classifier"""
+        intents = intents or list(self.centroids)
+        vector = self._vectorize(Counter(_terms(text)))
+        if not vector:
+            return {intent: 1.0 / len(intents) for intent in intents}
+
+        similarities = {
+            intent: sum(weight * self.centroids[intent].get(term, 0.0) for term, weight in vector.items())
+            for intent in intents
+        }
+        # Softmax over cosine similarities; temperature sets how peaked the result is
+        top = max(similarities.values())
+        exps = {intent: math.exp((similarity - top) / self.temperature) for intent, similarity in similarities.items()}
+        total = sum(exps.values())
+        return {intent: value / total for intent, value in exps.items()}
+
+    def route(self, text, has_documents=True, document_match=None):
+        """Pick the handler for a turn and log the decision.
+
+        document_match (0..1) is how well the indexed documents cover the
+        query, if known. Returns (intent, confidence, method) where intent
+        is one of 'booking', 'document', 'general' or 'agent' (not confident
+        enough).
+        """
+        start = time.perf_counter()
+        intent, confidence, method = self._decide(text, has_documents, document_match)
+        decision = {
+            'intent': intent,
+            'confidence': round(confidence, 4),
+            'method': method,
+            'has_documents': has_documents,
+            'document_match': document_match,
+            'micros': round((time.perf_counter() - start) * 1e6, 1),
+            'time': time.time()
+        }
+        if self.log_text:
+            decision['text'] = text
+        self._log(decision)
+        return intent, confidence, method
+
+    def _decide(self, text, has_documents, document_match=None):
+        lowered = text.lower()
+        intents = [intent for intent in self.centroids if has_documents or intent != DOCUMENT]
+
+        for intent in (BOOKING, DOCUMENT):
+            if intent in intents and self.match_keywords(lowered, intent):
+                return intent, 1.0, 'keyword'
+
+        probabilities = self.classify(lowered, intents)
+        best = max(probabilities, key=probabilities.get)
+        if probabilities[best] >= self.threshold:
+            # "What is X?" reads like a document question even when X is nowhere in the documents
+            if best == DOCUMENT and document_match is not None and document_match < self.min_document_match:
+                return AGENT, probabilities[best], 'no_match'
+            return best, probabilities[best], 'classifier'
+        return AGENT, probabilities[best], 'fallback'
+
+    def _log(self, decision):
+        self.decisions.append(decision)
+        if self.log_path:
+            try:
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(decision) + "\n")
+            except OSError:
+                pass
+
+    def stats(self):
+        """Share of logged turns per intent and routing method"""
+        total = len(self.decisions)
+        return {
+            'turns': total,
+            'intents': dict(Counter(decision['intent'] for decision in self.decisions)),
+            'methods': dict(Counter(decision['method'] for decision in self.decisions)),
+            'agent_rate': sum(decision['intent'] == AGENT for decision in self.decisions) / total if total else 0.0
+        }
+
+    def evaluate(self, labelled, has_documents=True):
+        """Measure routing accuracy on (text, expected_intent) pairs.
+
+        Turns deferred to the agent count as neither right nor wrong; they
+        are reported as coverage instead.
+        """
+        routed = correct = 0
+        mistakes = []
+        for text, expected in labelled:
+            intent, _, _ = self._decide(text, has_documents)
+            if intent == AGENT:
+                continue
+            routed += 1
+            if intent == expected:
+                correct += 1
+            else:
+                mistakes.append((text, expected, intent))
+
+        return {
+            'accuracy': correct / routed if routed else 0.0,
+            'coverage': routed / len(labelled) if labelled else 0.0,
+            'mistakes': mistakes
+        }
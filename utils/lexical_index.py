@@ -0,0 +1,102 @@
+# utils/lexical_index.py
+import re
+import math
+from collections import Counter, defaultdict
+
+
+# Function words that say nothing about whether a document covers a question
+STOPWORDS = frozenset(
+    "a an and are as at be by can could did do does for from how i in is it me my of on or our "
+    "please should tell that the their there these this to was we what when where which who why "
+    "will with would you your".split()
+)
+
+
+def tokenize(text):
+    """Lowercase word tokens; keeps digits so codes like 'PN-4471' stay searchable"""
+    return re.findall(r'\w+', text.lower())
+
+
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse several ranked lists of ids into one list of (id, score), best first"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """Compact in-memory inverted index with Okapi BM25 scoring"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.clear()
+
+    def clear(self):
+        self.postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.doc_lengths = {}
+        self.doc_terms = {}                 # doc_id -> terms, needed for removal
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, text):
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+        self.doc_terms[doc_id] = tuple(counts)
+        self.doc_lengths[doc_id] = sum(counts.values())
+        self.total_length += self.doc_lengths[doc_id]
+
+    def remove(self, doc_id):
+        if doc_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(doc_id):
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.doc_lengths) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=10):
+        """Return up to k (doc_id, score) pairs, best first"""
+        if not self.doc_lengths:
+            return []
+
+        average_length = self.total_length / len(self.doc_lengths)
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def coverage(self, query, doc_id):
+        """IDF-weighted share of the query terms that occur in a document (0..1)"""
+        terms = set(tokenize(query))
+        if not terms or doc_id not in self.doc_terms:
+            return 0.0
+
+        doc_terms = set(self.doc_terms[doc_id])
+        weights = {term: self.idf(term) for term in terms}
+        total = sum(weights.values())
+        matched = sum(weight for term, weight in weights.items() if term in doc_terms)
+        return matched / total if total else 0.0
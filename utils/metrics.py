@@ -0,0 +1,242 @@
+# utils/metrics.py
+"""
+Latency and token instrumentation for chat turns.
+
+Code wraps the interesting steps in spans (metrics.span('route'), ...).
+Every span feeds a per-name latency histogram, and the spans of the turn in
+progress are also collected into a trace, so a single turn can be inspected
+step by step. LLM calls, agent iterations and tool calls are timed by
+MetricsCallbackHandler, which also counts prompt and completion tokens.
+
+Aggregates are exported as JSON (with p50/p95/p99) or in the Prometheus
+text format.
+"""
+
+import time
+import json
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from .tokens import estimate_tokens
+
+# Upper bounds in seconds, from cache hits and FAISS lookups up to slow agent turns
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Spans of the turn being handled in the current thread/task, if any
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Histogram:
+    """Cumulative buckets for export plus a window of recent samples for percentiles"""
+
+    def __init__(self, buckets=BUCKETS, window=2048):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantiles(self, quantiles=QUANTILES):
+        if not self.samples:
+            return {q: 0.0 for q in quantiles}
+        values = np.percentile(np.fromiter(self.samples, dtype=np.float64), [q * 100 for q in quantiles])
+        return dict(zip(quantiles, values.tolist()))
+
+
+class Metrics:
+    """Thread-safe registry of span latency histograms and counters"""
+
+    def __init__(self, prefix="chatbot"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}  # (name, label items) -> value
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the enclosed block as one span; attributes may be added through the yielded dict"""
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.record(name, time.perf_counter() - start, **attributes)
+
+    def record(self, name, seconds, **attributes):
+        """Record a span that was timed elsewhere"""
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append({'name': name, 'ms': round(seconds * 1000, 2), **attributes})
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def trace(self):
+        """Collect the spans recorded inside the block into the yielded list"""
+        spans = []
+        token = _current_trace.set(spans)
+        try:
+            yield spans
+        finally:
+            try:
+                _current_trace.reset(token)
+            except ValueError:
+                # A generator resumed in another context; it just stops collecting
+                pass
+
+    def to_dict(self):
+        """Aggregates as plain data: count, sum and p50/p95/p99 per span, plus counters"""
+        with self._lock:
+            spans = {}
+            for name, histogram in sorted(self.histograms.items()):
+                quantiles = histogram.quantiles()
+                spans[name] = {
+                    'count': histogram.count,
+                    'sum': round(histogram.sum, 6),
+                    **{f"p{round(q * 100)}": round(value, 6) for q, value in quantiles.items()}
+                }
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+        return {'spans': spans, 'counters': counters}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self):
+        """Aggregates in the Prometheus text exposition format"""
+        histogram_name = f"{self.prefix}_span_seconds"
+        summary_name = f"{self.prefix}_span_quantile_seconds"
+        lines = [f"# HELP {histogram_name} Latency of instrumented steps.",
+                 f"# TYPE {histogram_name} histogram"]
+        summaries = [f"# HELP {summary_name} Recent latency percentiles of instrumented steps.",
+                     f"# TYPE {summary_name} summary"]
+
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{histogram_name}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{histogram_name}_bucket{{span="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{histogram_name}_sum{{span="{name}"}} {histogram.sum}')
+                lines.append(f'{histogram_name}_count{{span="{name}"}} {histogram.count}')
+
+                for q, value in histogram.quantiles().items():
+                    summaries.append(f'{summary_name}{{span="{name}",quantile="{q}"}} {value}')
+                summaries.append(f'{summary_name}_sum{{span="{name}"}} {histogram.sum}')
+                summaries.append(f'{summary_name}_count{{span="{name}"}} {histogram.count}')
+
+            counter_lines = []
+            for name in sorted({name for name, _ in self.counters}):
+                counter_lines.append(f"# TYPE {self.prefix}_{name} counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        rendered = ",".join(f'{key}="{label}"' for key, label in labels)
+                        counter_lines.append(f"{self.prefix}_{name}{{{rendered}}} {value}")
+
+        return "\n".join(lines + summaries + counter_lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """LangChain callbacks that time LLM calls, agent iterations and tools, and count tokens"""
+
+    # Run in the caller's thread/task, so spans land in the current turn's trace
+    run_inline = True
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._starts = {}  # run id -> (start time, prompt tokens estimate)
+        self._steps = {}   # agent run id -> start of its current iteration
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = (time.perf_counter(), sum(estimate_tokens(prompt) for prompt in prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        prompt_tokens = sum(estimate_tokens(str(message.content)) for batch in messages for message in batch)
+        self._starts[run_id] = (time.perf_counter(), prompt_tokens)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start, prompt_tokens = self._starts.pop(run_id, (None, 0))
+        if start is None:
+            return
+
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        completion_tokens = estimate_tokens(generation.text) if generation else 0
+        # Use the provider's counts when it reports them
+        usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+        if usage:
+            prompt_tokens = usage.get('input_tokens', prompt_tokens)
+            completion_tokens = usage.get('output_tokens', completion_tokens)
+
+        self.metrics.record('llm', time.perf_counter() - start,
+                            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self.metrics.count('tokens_total', prompt_tokens, kind='prompt')
+        self.metrics.count('tokens_total', completion_tokens, kind='completion')
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+        self.metrics.count('errors_total', step='llm')
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        self._steps[run_id] = time.perf_counter()
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._steps.pop(run_id, None)
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        self._agent_step(run_id, tool=action.tool)
+
+    def on_agent_finish(self, finish, *, run_id, **kwargs):
+        self._agent_step(run_id, tool=None)
+
+    def _agent_step(self, run_id, **attributes):
+        # An iteration runs from the agent's start, or its previous tool result, to its next decision
+        start = self._steps.get(run_id)
+        if start is not None:
+            self.metrics.record('agent_iteration', time.perf_counter() - start, **attributes)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._starts[run_id] = (time.perf_counter(), (serialized or {}).get('name'))
+
+    def on_tool_end(self, output, *, run_id, parent_run_id=None, **kwargs):
+        start, name = self._starts.pop(run_id, (None, None))
+        if start is not None:
+            self.metrics.record('tool', time.perf_counter() - start, tool=name)
+        if parent_run_id in self._steps:
+            self._steps[parent_run_id] = time.perf_counter()
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+        self.metrics.count('errors_total', step='tool')
+
+
+# Every session reports into the same registry so the export covers the whole process
+_metrics = Metrics()
+
+def get_metrics():
+    """Return the process-wide metrics registry"""
+    return _metrics
@@ -0,0 +1,129 @@
+# utils/query_batcher.py
+"""
+Micro-batching of query embeddings across sessions.
+
+Every retrieval embeds one short query, and under load many sessions do so
+at the same moment, each paying a full API round-trip. QueryEmbeddingBatcher
+holds concurrent requests for at most max_wait seconds (or until
+max_batch_size are waiting), embeds them in one backend call and hands each
+caller its own vector.
+"""
+
+import time
+import asyncio
+import inspect
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from .embedding_pipeline import FakeEmbeddings
+
+
+class QueryEmbeddingBackend:
+    """Embeds a batch of queries in one request; subclass to plug in another API"""
+
+    def embed_queries(self, texts):
+        raise NotImplementedError
+
+
+class LangChainQueryBackend(QueryEmbeddingBackend):
+    """Batches through a LangChain Embeddings client's embed_documents"""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        # Gemini embeds queries and documents differently; keep query vectors for queries
+        self._task_type = 'task_type' in inspect.signature(embeddings.embed_documents).parameters
+
+    def embed_queries(self, texts):
+        if self._task_type:
+            return self.embeddings.embed_documents(texts, task_type="retrieval_query")
+        return self.embeddings.embed_documents(texts)
+
+
+class FakeQueryBackend(LangChainQueryBackend):
+    """Local backend with a simulated per-request latency, for offline benchmarks"""
+
+    def __init__(self, dimensions=256, latency=0.0):
+        super().__init__(FakeEmbeddings(dimensions=dimensions, latency=latency))
+
+
+class QueryEmbeddingBatcher:
+    """Collect concurrent query-embedding requests and send them as batched calls"""
+
+    def __init__(self, backend, max_batch_size=32, max_wait=0.005, max_concurrency=4):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = 0
+        self.batches = 0
+        self._pending = []  # (text, future, enqueued_at)
+        self._condition = threading.Condition()
+        self._worker = None
+        # Batches already sent do not hold up the collection of the next one
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="query-batch")
+
+    def submit(self, text):
+        """Queue text for embedding; returns a concurrent.futures.Future of its vector"""
+        future = Future()
+        with self._condition:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._collect, name="query-batcher", daemon=True)
+                self._worker.start()
+            self._pending.append((text, future, time.monotonic()))
+            self.requests += 1
+            self._condition.notify()
+        return future
+
+    def embed_query(self, text):
+        return self.submit(text).result()
+
+    async def aembed_query(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # The oldest request waits at most max_wait for company
+                deadline = self._pending[0][2] + self.max_wait
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+                self.batches += 1
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        # Sessions often ask the same thing at once; embed each distinct text once
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        try:
+            vectors = dict(zip(texts, self.backend.embed_queries(texts)))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for text, future, _ in batch:
+            future.set_result(vectors[text])
+
+    def stats(self):
+        with self._condition:
+            return {
+                'requests': self.requests,
+                'batches': self.batches,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+                'pending': len(self._pending)
+            }
+
+
+# One batcher per embedding client configuration, shared by every session in this process
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def get_query_batcher(key, backend_factory, **settings):
+    """Return the process-wide batcher for key, creating it with backend_factory() if needed"""
+    with _batchers_lock:
+        if key not in _batchers:
+            _batchers[key] = QueryEmbeddingBatcher(backend_factory(), **settings)
+        return _batchers[key]
@@ -0,0 +1,103 @@
+# utils/query_cache.py
+import re
+import time
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(text):
+    """Normalize query text so trivially different phrasings share a cache key"""
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    return text.rstrip('?!. ')
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None, count=True):
+        """Value for key, or default; count=False leaves the hit/miss counters alone"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += count
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += count
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries)
+            }
+
+
+# Query embeddings only depend on the embedding model, so every session in the process shares them
+_query_embedding_cache = TTLCache(maxsize=4096, ttl=24 * 3600)
+
+def get_query_embedding_cache():
+    """Return the process-wide query embedding cache"""
+    return _query_embedding_cache
+
+
+def embed_query_cached(embeddings, model_name, query, cache=None, batcher=None):
+    """Embed a query, reusing the vector for previously seen phrasings.
+
+    Misses go through batcher (a QueryEmbeddingBatcher) when one is given.
+    """
+    cache = cache or _query_embedding_cache
+    normalized = normalize_query(query)
+    cache_key = (type(embeddings).__name__, model_name, normalized)
+
+    embedding = cache.get(cache_key)
+    if embedding is None:
+        embedding = batcher.embed_query(normalized) if batcher else embeddings.embed_query(normalized)
+        cache.put(cache_key, embedding)
+    return embedding
+
+def cached_query_embedding(embeddings, model_name, query, cache=None):
+    """The vector embed_query_cached already holds for query, or None; never calls the API"""
+    cache = cache or _query_embedding_cache
+    return cache.get((type(embeddings).__name__, model_name, normalize_query(query)), count=False)
+
+async def aembed_query_cached(embeddings, model_name, query, cache=None, batcher=None):
+    """Async embed_query_cached, using the embedding client's async API"""
+    cache = cache or _query_embedding_cache
+    normalized = normalize_query(query)
+    cache_key = (type(embeddings).__name__, model_name, normalized)
+
+    embedding = cache.get(cache_key)
+    if embedding is None:
+        if batcher:
+            embedding = await batcher.aembed_query(normalized)
+        else:
+            embedding = await embeddings.aembed_query(normalized)
+        cache.put(cache_key, embedding)
+    return embedding
@@ -0,0 +1,381 @@
+# utils/session_state.py
+"""
+Per-user chat state kept outside the Streamlit process.
+
+A SessionSnapshot holds what a worker needs to pick a conversation back up:
+the transcript (which is also the chatbot's memory buffer), the rolling
+summary and the form's progress. Snapshots are encoded positionally (no
+field names), as compact JSON, then zlib-compressed behind a one-byte
+format version. They are kept in a pluggable backend: SQLite for a shared
+file, or an in-process, Redis-like store with expiry for tests and single
+workers. Any worker behind a load balancer can then restore a session on
+its first request, and a restart no longer loses half-finished bookings.
+
+Each browser gets a random id as a signed token in an HttpOnly cookie
+(SessionCookieMiddleware, mounted by server.py), and each tab a random tab
+id in its URL. A session is keyed by both. A reload resumes its tab, other
+tabs keep their own conversations, and a shared link carries nothing
+without the cookie. Tokens are signed with SESSION_SECRET, which every
+worker must share. Saves are compare-and-set on a per-session revision, so
+two tabs on the same URL (a duplicated tab) cannot overwrite each other.
+"""
+
+import os
+import re
+import hmac
+import json
+import time
+import zlib
+import hashlib
+import secrets
+import sqlite3
+import threading
+from http.cookies import SimpleCookie, CookieError
+from dataclasses import dataclass, field
+from .form_handler import FormState
+
+FORMAT_VERSION = 1
+ROLES = ('user', 'assistant')
+SESSION_COOKIE = "chat_session"
+TAB_PARAM = "tab"
+_TAB_ID = re.compile(r'^[A-Za-z0-9_-]{8,32}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires_at REAL,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at);
+"""
+
+
+@dataclass(slots=True)
+class SessionSnapshot:
+    """One user's transcript, memory summary and form progress"""
+    messages: list = field(default_factory=list)  # {'role', 'content'[, 'timing']} dicts, as app.py renders them
+    summary: str = ""
+    summarized: int = 0
+    form: FormState = field(default_factory=FormState)
+    revision: int = field(default=0, compare=False)  # the stored revision this copy is based on
+
+    @classmethod
+    def capture(cls, messages, chatbot=None, form_handler=None, revision=0):
+        """Snapshot the live objects of a session"""
+        memory = getattr(chatbot, 'memory', None)
+        return cls(
+            messages=list(messages),
+            # Only RollingSummaryMemory has a summary; a plain buffer is just the transcript
+            summary=getattr(memory, 'summary', ""),
+            summarized=getattr(memory, 'summarized', 0),
+            form=form_handler.export_state() if form_handler else FormState(),
+            revision=revision
+        )
+
+    def restore(self, chatbot=None, form_handler=None):
+        """Put the memory summary and form progress back into freshly created objects.
+
+        The transcript is restored by passing self.messages to ChatBot(transcript=...).
+        """
+        memory = getattr(chatbot, 'memory', None)
+        if hasattr(memory, 'summary'):
+            memory.summary, memory.summarized = self.summary, self.summarized
+        if form_handler:
+            form_handler.restore_state(self.form)
+
+    def to_bytes(self):
+        messages = [
+            [ROLES.index(message['role']), message['content']] + ([message['timing']] if message.get('timing') else [])
+            for message in self.messages
+        ]
+        form = self.form
+        payload = [messages, self.summary, self.summarized,
+                   [form.state, form.current_field, list(form.fields), form.appointment_id,
+                    [list(slot) for slot in form.suggested_slots]]]
+        encoded = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        return bytes([FORMAT_VERSION]) + zlib.compress(encoded)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data or data[0] != FORMAT_VERSION:
+            raise ValueError("Unsupported session snapshot format")
+        messages, summary, summarized, form = json.loads(zlib.decompress(data[1:]))
+        state, current_field, fields, appointment_id, suggested_slots = form
+        return cls(
+            messages=[
+                {'role': ROLES[entry[0]], 'content': entry[1], **({'timing': entry[2]} if len(entry) > 2 else {})}
+                for entry in messages
+            ],
+            summary=summary,
+            summarized=summarized,
+            form=FormState(state, current_field, tuple(fields), appointment_id,
+                           tuple(tuple(slot) for slot in suggested_slots))
+        )
+
+
+class SessionConflict(Exception):
+    """The session was saved by another tab or worker since this copy was loaded"""
+
+
+class SessionBackend:
+    """Key -> bytes storage with optional expiry; subclass to plug in another store.
+
+    Every write bumps the key's revision. A write with expected only lands if
+    the key is still at that revision (0: absent or expired), like a Redis
+    WATCH / MULTI transaction.
+    """
+
+    def fetch(self, key):
+        """(value, revision), or (None, 0) if the key is absent or expired"""
+        raise NotImplementedError
+
+    def get(self, key):
+        return self.fetch(key)[0]
+
+    def set(self, key, value, ttl=None, expected=None):
+        """Store value; returns False, storing nothing, if expected is given and out of date"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """In-process stand-in for Redis (GET / SET EX / DEL); expired keys are dropped on read"""
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at or None, revision)
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        value, expires_at, revision = self._data.get(key, (None, None, 0))
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None, 0
+        return value, revision
+
+    def fetch(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key, value, ttl=None, expected=None):
+        with self._lock:
+            revision = self._live(key)[1]
+            if expected is not None and expected != revision:
+                return False
+            self._data[key] = (value, time.time() + ttl if ttl else None, revision + 1)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions in a SQLite file that every worker on the host can open (WAL, one connection per thread)"""
+
+    def __init__(self, path="sessions.db"):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+        # Files created before revisions were tracked
+        if 'revision' not in {row[1] for row in connection.execute("PRAGMA table_info(sessions)")}:
+            with connection:
+                connection.execute("ALTER TABLE sessions ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def fetch(self, key):
+        row = self._connection().execute(
+            "SELECT data, revision FROM sessions WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    def set(self, key, value, ttl=None, expected=None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._connection() as connection:
+            if expected is None:
+                connection.execute(
+                    "INSERT INTO sessions (id, data, expires_at, revision) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at, "
+                    "revision = revision + 1",
+                    (key, value, expires_at)
+                )
+                return True
+            if expected == 0:
+                # Only if there is no session yet, or just an expired one (which reads as none)
+                cursor = connection.execute(
+                    "INSERT INTO sessions (id, data, expires_at, revision) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at, "
+                    "revision = 1 WHERE sessions.expires_at IS NOT NULL AND sessions.expires_at <= ?",
+                    (key, value, expires_at, now)
+                )
+            else:
+                cursor = connection.execute(
+                    "UPDATE sessions SET data = ?, expires_at = ?, revision = revision + 1 "
+                    "WHERE id = ? AND revision = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (value, expires_at, key, expected, now)
+                )
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (key,))
+
+    def purge_expired(self):
+        """Delete expired sessions; returns how many were removed"""
+        with self._connection() as connection:
+            return connection.execute(
+                "DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+
+
+def new_tab_id():
+    """Random id that tells one browser tab's conversation from another's"""
+    return secrets.token_urlsafe(9)
+
+
+def valid_tab_id(tab_id):
+    return isinstance(tab_id, str) and bool(_TAB_ID.match(tab_id))
+
+
+class SessionStore:
+    """Save and load SessionSnapshots by session id, and sign the browser tokens behind the ids"""
+
+    def __init__(self, backend, ttl=7 * 24 * 3600, secret=None):
+        self.backend = backend
+        self.ttl = ttl
+        # Tokens can only be issued or checked with a secret, which every worker must share
+        self.secret = secret.encode('utf-8') if secret else None
+
+    def _sign(self, browser_id):
+        if self.secret is None:
+            raise RuntimeError("Session tokens need a secret; set SESSION_SECRET on every worker")
+        return hmac.new(self.secret, browser_id.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def new_browser(self):
+        """A fresh, unguessable browser id and the signed token to set as its cookie"""
+        browser_id = secrets.token_urlsafe(24)
+        return browser_id, f"{browser_id}.{self._sign(browser_id)}"
+
+    def browser_id(self, token):
+        """The browser id in a token issued by new_browser, or None if it is missing or forged"""
+        if not isinstance(token, str):
+            return None
+        browser_id, _, signature = token.rpartition('.')
+        if not browser_id or not hmac.compare_digest(signature, self._sign(browser_id)):
+            return None
+        return browser_id
+
+    @staticmethod
+    def session_key(browser_id, tab_id):
+        return f"{browser_id}:{tab_id}"
+
+    def load(self, session_id):
+        """The saved snapshot, or None if there is none"""
+        data, revision = self.backend.fetch(session_id)
+        if data is None:
+            return None
+        try:
+            snapshot = SessionSnapshot.from_bytes(data)
+        except (ValueError, TypeError, IndexError, zlib.error):
+            # Unreadable, e.g. written by a newer format; start afresh, free to overwrite it
+            snapshot = SessionSnapshot()
+        snapshot.revision = revision
+        return snapshot
+
+    def save(self, session_id, snapshot):
+        """Store snapshot over the revision it is based on, then move snapshot.revision on.
+
+        Raises SessionConflict if the session was saved elsewhere in between.
+        """
+        if not self.backend.set(session_id, snapshot.to_bytes(), self.ttl, expected=snapshot.revision):
+            raise SessionConflict(session_id)
+        snapshot.revision += 1
+
+    def delete(self, session_id):
+        self.backend.delete(session_id)
+
+
+class SessionCookieMiddleware:
+    """ASGI middleware that gives each browser its signed token as an HttpOnly cookie.
+
+    Streamlit scripts cannot send response headers, so the cookie goes out with
+    the page itself; the script reads it back from st.context.cookies, which
+    holds the cookies of the websocket handshake.
+    """
+
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get('headers') or ())
+        cookies = SimpleCookie()
+        try:
+            cookies.load(headers.get(b'cookie', b'').decode('latin-1'))
+        except CookieError:
+            pass
+        store = self.store or get_session_store()
+        token = cookies[SESSION_COOKIE].value if SESSION_COOKIE in cookies else None
+        if store.browser_id(token) is None:
+            token = store.new_browser()[1]
+        # Re-sent with every page load, so an active browser's cookie does not expire
+        cookie = f"{SESSION_COOKIE}={token}; Path=/; Max-Age={int(store.ttl)}; HttpOnly; SameSite=Lax"
+        if scope.get('scheme') == 'https' or headers.get(b'x-forwarded-proto') == b'https':
+            cookie += "; Secure"
+
+        async def send_with_cookie(message):
+            if message['type'] == 'http.response.start':
+                response_headers = list(message.get('headers') or ())
+                if any(name.lower() == b'content-type' and value.startswith(b'text/html')
+                       for name, value in response_headers):
+                    message = {**message, 'headers': response_headers + [(b'set-cookie', cookie.encode('latin-1'))]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+def create_session_backend(url):
+    """'memory' or 'sqlite:<path>' -> backend"""
+    if url == "memory":
+        return MemorySessionBackend()
+    if url.startswith("sqlite:"):
+        return SQLiteSessionBackend(url[len("sqlite:"):] or "sessions.db")
+    raise ValueError(f"Unknown session backend: {url}")
+
+
+# Every session in this process shares one store; workers share whatever backend it points at
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store():
+    """Return the process-wide session store, configured by SESSION_STORE (default sqlite:sessions.db)
+    and SESSION_SECRET (required)"""
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            secret = os.environ.get("SESSION_SECRET")
+            if not secret:
+                # A per-process secret would strand every session on the worker that signed it
+                raise RuntimeError("SESSION_SECRET is not set; give every worker the same long random value")
+            _session_store = SessionStore(create_session_backend(os.environ.get("SESSION_STORE", "sqlite:sessions.db")),
+                                          secret=secret)
+        return _session_store
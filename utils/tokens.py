@@ -0,0 +1,32 @@
+# utils/tokens.py
+"""
+Cheap token estimates for prompt budgeting.
+
+Gemini does not ship a local tokenizer, so counts use the usual ~4
+characters per token rule of thumb. That is close enough for budgets.
+"""
+
+import math
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Approximate number of tokens in a piece of text"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to about max_tokens, preferring to stop at a word boundary"""
+    max_chars = max(max_tokens, 0) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+
+    # Leave room for the ellipsis
+    cut = text[:max(max_chars - 4, 0)]
+    boundary = cut.rfind(' ')
+    if boundary > len(cut) // 2:
+        cut = cut[:boundary]
+    return cut.rstrip() + " ..."
@@ -0,0 +1,160 @@
+# utils/validators.py
+"""
+Field validation shared by the conversational form and bulk lead imports.
+
+Every validator takes the raw text and returns (normalized value, None) or
+(None, error message). Patterns are compiled once. Phone, email and date
+normalization are memoized, because imports repeat values and a chat
+session re-validates answers. Email deliverability (a DNS lookup) is off
+by default.
+"""
+
+import re
+import threading
+from datetime import date
+from functools import lru_cache
+import phonenumbers
+from email_validator import validate_email, EmailNotValidError
+from .date_extractor import DateExtractor
+
+NAME_PATTERN = re.compile(r"^[a-zA-Z\s\-\.']+$")
+TIME_PATTERNS = (
+    re.compile(r'^([0-9]|1[0-2]):[0-5][0-9]\s?(AM|PM)$'),  # 12-hour format
+    re.compile(r'^([0-9]|1[0-9]|2[0-3]):[0-5][0-9]$'),     # 24-hour format
+    re.compile(r'^([0-9]|1[0-2])\s?(AM|PM)$'),             # Hour only 12-hour
+)
+
+
+class ValidatorRegistry:
+    """Named field validators with memoized normalization"""
+
+    def __init__(self, default_region="US", check_deliverability=False, cache_size=4096):
+        self.default_region = default_region
+        self.check_deliverability = check_deliverability
+        self.validators = {
+            'name': self.validate_name,
+            'phone': self.validate_phone,
+            'email': self.validate_email,
+            'appointment_date': self.validate_date,
+            'appointment_time': self.validate_time,
+            'purpose': self.validate_purpose
+        }
+        self._phone = lru_cache(maxsize=cache_size)(self._normalize_phone)
+        self._email = lru_cache(maxsize=cache_size)(self._normalize_email)
+        self._date = lru_cache(maxsize=cache_size)(self._resolve_date)
+        self._extractor = DateExtractor()
+        self._extractor_lock = threading.Lock()
+
+    def register(self, field, validator):
+        """Add or replace the validator for a field"""
+        self.validators[field] = validator
+
+    def validate(self, field, value):
+        """Run the validator registered for field"""
+        return self.validators[field](value)
+
+    def validate_name(self, name):
+        name = name.strip()
+        if len(name) < 2:
+            return None, "Please provide your full name (at least 2 characters)."
+        if not NAME_PATTERN.match(name):
+            return None, "Please provide a valid name using only letters, spaces, hyphens, dots, and apostrophes."
+        return name, None
+
+    def validate_phone(self, phone, region=None):
+        return self._phone(phone.strip(), region or self.default_region)
+
+    def _normalize_phone(self, phone, region):
+        try:
+            parsed_phone = phonenumbers.parse(phone, region)
+        except phonenumbers.NumberParseException:
+            return None, "Please provide a valid phone number (e.g., +1-234-567-8900 or (234) 567-8900)."
+
+        if not phonenumbers.is_valid_number(parsed_phone):
+            return None, "Please provide a valid phone number."
+
+        # Local numbers read best in national format; keep the country code on foreign ones
+        number_region = phonenumbers.region_code_for_number(parsed_phone)
+        number_format = (phonenumbers.PhoneNumberFormat.NATIONAL if number_region == region
+                         else phonenumbers.PhoneNumberFormat.INTERNATIONAL)
+        return phonenumbers.format_number(parsed_phone, number_format), None
+
+    def validate_email(self, email):
+        return self._email(email.strip().lower())
+
+    def _normalize_email(self, email):
+        try:
+            return validate_email(email, check_deliverability=self.check_deliverability).normalized, None
+        except EmailNotValidError:
+            return None, "Please provide a valid email address (e.g., john@example.com)."
+
+    def validate_date(self, date_input):
+        # Relative dates depend on the day, so it is part of the memo key
+        return self._date(date_input.lower().strip(), date.today())
+
+    def _resolve_date(self, date_input, today):
+        extractor = self.date_extractor(today)
+        extracted_date = extractor.extract_date(date_input)
+        if not extracted_date:
+            return None, "I couldn't understand the date. Please provide a date like 'next Monday', 'tomorrow', or in YYYY-MM-DD format."
+
+        is_valid, message = extractor.validate_date(extracted_date)
+        if not is_valid:
+            return None, f"Invalid date: {message}. Please provide a future date."
+        return extracted_date, None
+
+    def date_extractor(self, today=None):
+        """Shared DateExtractor, replaced when the day changes"""
+        today = today or date.today()
+        with self._extractor_lock:
+            if self._extractor.today != today:
+                self._extractor = DateExtractor()
+            return self._extractor
+
+    def validate_time(self, time_input):
+        time_input = time_input.strip().upper()
+        if not any(pattern.match(time_input) for pattern in TIME_PATTERNS):
+            return None, "Please provide a valid time format (e.g., 10:00 AM, 14:30, or 2 PM)."
+        return time_input, None
+
+    def validate_purpose(self, purpose):
+        purpose = purpose.strip()
+        if len(purpose) < 5:
+            return None, "Please provide a brief description of the purpose (at least 5 characters)."
+        return purpose, None
+
+    def validate_record(self, record, required=('name', 'phone')):
+        """Validate one record (field -> raw text); returns (normalized fields, errors)"""
+        normalized, errors = {}, {}
+        for field, validator in self.validators.items():
+            value = record.get(field)
+            if value is None or not str(value).strip():
+                if field in required:
+                    errors[field] = "Required"
+                continue
+            value, error = validator(str(value))
+            if error:
+                errors[field] = error
+            else:
+                normalized[field] = value
+        return normalized, errors
+
+    def validate_records(self, records, required=('name', 'phone')):
+        """Validate many records, e.g. rows from csv.DictReader.
+
+        Returns one (normalized fields, errors) pair per record, in order.
+        Repeated phones, emails and dates are only normalized once.
+        """
+        return [self.validate_record(record, required) for record in records]
+
+    def cache_info(self):
+        """Memo hit/miss statistics per normalizer"""
+        return {'phone': self._phone.cache_info(), 'email': self._email.cache_info(), 'date': self._date.cache_info()}
+
+
+# Validation rules are stateless apart from the memos, so every form shares one registry
+_validators = ValidatorRegistry()
+
+def get_validators():
+    """Return the process-wide validator registry"""
+    return _validators